@@ -4,13 +4,17 @@ An application for processing images
 This file is the main entry-point for the imager application.  When you 'run the folder',
 this is the file that is executed. This file works as traffic cop that directs the 
 application to the correct entry point.  It allows you to launch the GUI, or to do 
-something simple from the command line.
+something simple from the command line.  With --apply, it processes a batch of image 
+files with no GUI at all, for example
+
+    python imager --apply "monochromify:sepia,vignette,pixellate:10" -o out/ samples/*.png
 
 Author: Walker M. White (wmw2)
 Date:   October 29, 2019
 """
 # To handle command line options
 import argparse
+import sys
 
 # This is necessary to prevent conflicting command line arguments
 import os
@@ -25,9 +29,17 @@ def parse():
     argparse is the built-in error checking and help menu.
     """
     parser = argparse.ArgumentParser(prog='imager',description='Application to process an image file.')
-    parser.add_argument('image', type=str, nargs='?', help='the image file to process')
+    parser.add_argument('image', type=str, nargs='*', help='the image file(s) to process')
     parser.add_argument('-t','--test',   action='store_true',  help='run a unit test on Image and Editor')
     parser.add_argument('-g','--grade',   action='store_true', help='grade the assignment')
+    parser.add_argument('-a','--apply',  type=str, metavar='OPS',
+                        help='filter the images with no GUI (e.g. "monochromify:sepia,pixellate:10")')
+    parser.add_argument('-o','--output', type=str, default='.', help='the output folder for --apply')
+    parser.add_argument('-j','--jobs',   type=int, default=None, help='the number of processes for --apply')
+    parser.add_argument('-m','--memory', type=int, default=None, metavar='MB',
+                        help='the megabytes of pixels to load at once for --apply')
+    parser.add_argument('-b','--backend', type=str, default=None, choices=['python','numpy'],
+                        help='the filter backend for --apply')
     return parser.parse_args()
 
 
@@ -67,21 +79,63 @@ def grade(image):
         print('The grading program is not currently installed.')
 
 
+def batch(files, operations, output, jobs, memory, backend):
+    """
+    Processes a batch of image files with no GUI, reporting the time for each.
+    
+    Parameter files: The image files to process
+    Precondition: files is a list of filename strings
+    
+    Parameter operations: The filters to apply (see parse_operations in a6batch)
+    Precondition: operations is a string
+    
+    Parameter output: The output folder
+    Precondition: output is a folder name string
+    
+    Parameter jobs: The number of processes
+    Precondition: jobs is an int > 0 or None
+    
+    Parameter memory: The megabytes of pixels to load at once
+    Precondition: memory is an int > 0 or None
+    
+    Parameter backend: The filter backend
+    Precondition: backend is 'python', 'numpy' or None
+    """
+    import time
+    import a6batch
+    try:
+        operations = a6batch.parse_operations(operations)
+    except ValueError as e:
+        print('Invalid operations: '+str(e))
+        return 2
+    if not memory is None:
+        memory *= 1024*1024
+    
+    start = time.perf_counter()
+    report = lambda result: print(a6batch.format_result(result),flush=True)
+    results = a6batch.process_files(files,operations,output,jobs,memory,backend,report=report)
+    print(a6batch.format_summary(results,time.perf_counter()-start))
+    return 1 if any('error' in result for result in results) else 0
+
+
 def execute():
     """
     Executes the application, according to the command line arguments specified.
     """
     args = parse()
     
-    image = args.image
+    image = args.image[0] if args.image else None
     
     # Switch on the options
     if args.test:
         unittest()
     elif args.grade:
         grade(image)
+    elif args.apply:
+        return batch(args.image,args.apply,args.output,args.jobs,args.memory,args.backend)
     else:
         launch(image)
 
-# Do it
-execute()
\ No newline at end of file
+# Do it (but not when a worker process imports this module)
+if __name__ == '__main__':
+    sys.exit(execute())
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+Headless batch processing for the imager application.
+
+The GUI edits one image at a time.  The functions in this module apply the
+same filters to many image files from the command line, with no display.
+The operations are given as text, such as
+
+    monochromify:sepia,vignette,pixellate:10
+
+which is a comma-separated list of actions (see ACTIONS in class Filter), each
+followed by its arguments after colons.  Every file is loaded, filtered as a
+single pipeline (see the method pipeline in class Filter), and saved in PNG
+format to an output folder.
+
+The files are processed in a pool of processes.  To bound the memory in use,
+only a limited number of pixels are loaded at any time.  A timing is recorded
+for each file, so that slow steps are easy to find.
+
+This module does not depend on Kivy.
+"""
+import a6files
+import a6filter
+import a6image
+import os
+import time
+
+
+# The words allowed for the argument of monochromify
+_TONES = {'sepia': True, 'grey': False, 'gray': False, 'greyscale': False, 'grayscale': False}
+
+# The arguments used when an action is given without any
+_DEFAULTS = {'monochromify': (False,)}
+
+# The default number of bytes of pixels to load at once (about 40 12MP photos)
+MEMORY = 1024*1024*1024
+
+
+def parse_value(text):
+    """
+    Returns the argument represented by the given text.
+
+    The text true or false (in any case) is a bool.  The words sepia, grey
+    and greyscale (or gray and grayscale) are the bools True, False, False.
+    Otherwise the text must be an int or a float.
+
+    Parameter text: The text to convert
+    Precondition: text is a string
+    """
+    assert type(text) == str, repr(text)+' is not a string'
+    word = text.strip().lower()
+    if word in _TONES:
+        return _TONES[word]
+    elif word in ('true','false'):
+        return word == 'true'
+    try:
+        return int(word)
+    except ValueError:
+        pass
+    try:
+        return float(word)
+    except ValueError:
+        raise ValueError(repr(text)+' is not a valid argument')
+
+
+def parse_operations(text):
+    """
+    Returns the pipeline operations represented by the given text.
+
+    The text is a comma-separated list of actions, each followed by its
+    arguments after colons (e.g. 'monochromify:sepia,pixellate:10').  The
+    result is a list of tuples, as used by the method pipeline in class
+    Filter.  A ValueError is raised if the text is not valid, including
+    when the arguments are wrong for the action (see check_operations).
+
+    Parameter text: The operations to convert
+    Precondition: text is a string
+    """
+    assert type(text) == str, repr(text)+' is not a string'
+    operations = []
+    for item in text.split(','):
+        words = item.strip().split(':')
+        name  = words[0].strip()
+        if not name in a6filter.Filter.ACTIONS:
+            raise ValueError(repr(name)+' is not a valid action')
+        args = tuple(map(parse_value,words[1:]))
+        if len(args) == 0 and name in _DEFAULTS:
+            args = _DEFAULTS[name]
+        operations.append((name,)+args)
+    check_operations(operations)
+    return operations
+
+
+def check_operations(operations):
+    """
+    Raises a ValueError if any of the operations is not valid.
+
+    Each operation must be an action (see ACTIONS in class Filter) with the
+    right number and kind of arguments, e.g. pixellate needs an int > 0.
+    This is checked before any file is processed, and it does not depend on 
+    assert statements (so it works with python -O).
+
+    Parameter operations: The operations to check
+    Precondition: operations is a list
+    """
+    for operation in operations:
+        if not a6filter.Filter._isAction(operation):
+            raise ValueError(repr(operation)+' is not a valid operation')
+
+
+def get_targets(files, output):
+    """
+    Returns the files in folder output that files are saved to, in order.
+
+    Each target has the same name as its file, but with a png suffix.  Two
+    files may have the same name (in different folders), and they must not
+    overwrite each other.  So if a name is already taken, the first free 
+    name with a suffix -2, -3, ... is used instead (e.g. home-2.png).
+
+    Parameter files: The image files to process
+    Precondition: files is a list of strings
+
+    Parameter output: The output folder
+    Precondition: output is a string
+    """
+    targets = []
+    used = set()
+    for file in files:
+        name = os.path.splitext(os.path.basename(file))[0]
+        candidate = name
+        count = 1
+        while os.path.normcase(candidate) in used:
+            count += 1
+            candidate = name+'-'+str(count)
+        used.add(os.path.normcase(candidate))
+        targets.append(os.path.join(output,candidate+'.png'))
+    return targets
+
+
+def process_file(file, operations, target, backend=None, level=None):
+    """
+    Processes one image file, and returns its timing.
+
+    The file is loaded, filtered with a pipeline of the operations, and
+    saved in PNG format to target.  The result is a dictionary
+    with the keys 'file', 'target' and 'pixels', plus the number of seconds
+    spent in each step under the keys 'load', 'filter' and 'save'.
+
+    Parameter file: The image file to process
+    Precondition: file is a string naming an image file PIL can read
+
+    Parameter operations: The actions to apply, in order
+    Precondition: operations is a list of operations (see parse_operations)
+
+    Parameter target: The file to save to
+    Precondition: target is a string naming a file in an existing folder
+
+    Parameter backend: The name of the backend to filter with
+    Precondition: backend is None or a valid backend (see class Filter)
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9, or None for COMPRESSION
+    """
+    image, load = a6files.load_timed(file)
+
+    start  = time.perf_counter()
+    editor = a6filter.Filter(image,backend)
+    editor.pipeline(operations)
+    middle = time.perf_counter()
+    a6files.save_image(editor.getCurrent(),target,level)
+    end = time.perf_counter()
+
+    return {'file': file, 'target': target, 'pixels': len(image),
+            'load': load, 'filter': middle-start, 'save': end-middle}
+
+
+def get_size(file):
+    """
+    Returns the number of bytes file will take once loaded.
+
+    Only the header of the file is read.  If it cannot be read, this is 0
+    (the error will be reported when the file is processed).
+
+    Parameter file: The image file
+    Precondition: file is a string
+    """
+    from PIL import Image as CoreImage
+    try:
+        if a6image.is_raw(file):
+            width, height = a6image.get_raw_size(file)
+            return 3*width*height
+        with CoreImage.open(file) as image:
+            return 3*image.size[0]*image.size[1]
+    except Exception:
+        return 0
+
+
+def process_files(files, operations, output, processes=None, memory=None,
+                  backend=None, level=None, report=None):
+    """
+    Processes several image files in a pool of processes, and returns the timings.
+
+    Each file is processed with process_file, and saved to its target in 
+    output (see get_targets).  The files are started in
+    order, but only while the pixels of the files in progress fit in memory
+    bytes.  A single file larger than that is still processed, on its own.
+
+    A ValueError is raised before any file is processed if the operations
+    are not valid (see check_operations).
+
+    The result is a list with one dictionary for each file, in the order the
+    files finished.  It is the timing from process_file, or a dictionary with
+    the keys 'file', 'target' and 'error' (an exception) if the file failed.
+    Each result is also passed to report as soon as it is ready, if report
+    is not None.
+
+    Parameter files: The image files to process
+    Precondition: files is a list of strings
+
+    Parameter operations: The actions to apply, in order
+    Precondition: operations is a list of operations (see parse_operations)
+
+    Parameter output: The output folder (it is made if it does not exist)
+    Precondition: output is a string
+
+    Parameter processes: The number of processes
+    Precondition: processes is an int > 0, or None for one per CPU
+
+    Parameter memory: The number of bytes of pixels to load at once
+    Precondition: memory is an int > 0, or None for MEMORY
+
+    Parameter backend: The name of the backend to filter with
+    Precondition: backend is None or a valid backend (see class Filter)
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9, or None for COMPRESSION
+
+    Parameter report: The function to call as each file finishes
+    Precondition: report is None or a function taking a result dictionary
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    processes = os.cpu_count() if processes is None else processes
+    memory = MEMORY if memory is None else memory
+    assert type(processes) == int and processes > 0, repr(processes)+' is not a valid number of processes'
+    assert type(memory) == int and memory > 0, repr(memory)+' is not a valid memory limit'
+    assert backend is None or backend in a6filter.Filter.BACKENDS, repr(backend)+' is not a valid backend'
+    # Check the operations here, instead of failing on every file
+    check_operations(operations)
+    os.makedirs(output,exist_ok=True)
+
+    results = []
+    running = {}
+    pending = list(reversed(list(zip(files,get_targets(files,output)))))
+    loaded  = 0
+    with ProcessPoolExecutor(processes) as pool:
+        while pending or running:
+            # Start files while they fit (and always when nothing is running)
+            while pending and len(running) < 2*processes:
+                file, target = pending[-1]
+                size = get_size(file)
+                if running and loaded+size > memory:
+                    break
+                pending.pop()
+                future = pool.submit(process_file,file,operations,target,backend,level)
+                running[future] = (file,target,size)
+                loaded += size
+
+            done, _ = wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                file, target, size = running.pop(future)
+                loaded -= size
+                if future.exception() is None:
+                    result = future.result()
+                else:
+                    result = {'file': file, 'target': target,
+                              'error': future.exception()}
+                results.append(result)
+                if not report is None:
+                    report(result)
+    return results
+
+
+def format_result(result):
+    """
+    Returns a one line description of a result from process_files.
+
+    Parameter result: The result to describe
+    Precondition: result is a dictionary from process_files
+    """
+    if 'error' in result:
+        return '%s: FAILED (%s)' % (result['file'],result['error'])
+    total = result['load']+result['filter']+result['save']
+    return ('%s -> %s: %.1f MP, load %.3fs, filter %.3fs, save %.3fs, total %.3fs' %
+            (result['file'],result['target'],result['pixels']/1e6,result['load'],
+             result['filter'],result['save'],total))
+
+
+def format_summary(results, seconds):
+    """
+    Returns a one line summary of the results from process_files.
+
+    Parameter results: The results to summarize
+    Precondition: results is a list of dictionaries from process_files
+
+    Parameter seconds: The time taken by process_files
+    Precondition: seconds is an int or float >= 0
+    """
+    failed = sum(1 for result in results if 'error' in result)
+    pixels = sum(result.get('pixels',0) for result in results)
+    rate = pixels/1e6/seconds if seconds > 0 else 0.0
+    return ('Processed %d files (%d failed) in %.2fs, %.1f MP/s' %
+            (len(results),failed,seconds,rate))
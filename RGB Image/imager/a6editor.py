@@ -12,8 +12,18 @@ Based on an original file by Dexter Kozen (dck10) and Walker White (wmw2)
 Author: Walker White (wmw2)
 Date:   October 29, 2019
 """
-# THIS FILE IS COMPLETE.  DO NOT MODIFY THIS FILE AT ALL
 import a6image
+import a6history
+
+
+class Cancelled(Exception):
+    """
+    The exception raised when an edit is cancelled by its monitor.
+    
+    A cancelled edit may leave the current image partly changed.  It is up 
+    to the code that started the edit to undo it (see a6worker).
+    """
+    pass
 
 
 class Editor(object):
@@ -29,6 +39,21 @@ class Editor(object):
     If the number of edits exceeds MAX_HISTORY, the oldest edit will be
     deleted.  
     
+    The current image is the only full Image object.  The earlier edits are
+    kept in a compact History (see a6history), which only stores the rows 
+    that changed between one edit and the next.
+    
+    Instead of MAX_HISTORY, an editor can be given a memory budget in bytes.
+    Then there is no limit on the number of edits.  Older edits are 
+    compressed, and spilled to a temporary file when they do not fit in the
+    budget.  Undo reads them back as needed.
+    
+    An editor may also have a monitor, which is told the progress of long 
+    edits and can cancel them (see setMonitor).
+    
+    For previews, an editor keeps smaller copies of the current image (see
+    getProxy).  They are thrown away whenever the edit history changes.
+    
     Attribute MAX_HISTORY: A CLASS ATTRIBUTE for the maximum number of edits
     Invariant: MAX_HISTORY is an int > 0
     """
@@ -36,9 +61,23 @@ class Editor(object):
     # Attribute _original: The original image 
     # Invariant: _original is an Image object
     #
-    # Attribute _history: The edit history
-    # Invariant: _history is a non-empty list of Image objects. In addition, 
-    #the length of _history should never be longer than MAX_HISTORY.
+    # Attribute _current: The most recent edit
+    # Invariant: _current is an Image object
+    #
+    # Attribute _history: The edits before the most recent one
+    # Invariant: _history is a History object. In addition, if there is no
+    # memory budget, the length of _history should never be longer than 
+    # MAX_HISTORY-1.
+    #
+    # MUTABLE ATTRIBUTES (Can be changed at any time, via the setters)
+    # Attribute _monitor: The object following the progress of edits
+    # Invariant: _monitor is None or an object with methods setProgress and
+    # isCancelled (like a6worker.Job)
+    #
+    # Attribute _proxies: The pyramid of smaller copies of the current image
+    # Invariant: _proxies is a list of Image objects, where each one is the
+    # one before it (or _current, for the first) shrunk by a factor of 2.  It 
+    # is emptied whenever the edit history changes.
     
     # The number of edits that we are allowed to keep track of.
     # (THIS GOES IN CLASS FOLDER)
@@ -55,22 +94,108 @@ class Editor(object):
         """
         Returns the most recent edit
         """
-        return self._history[-1]
+        return self._current
+    
+    def getStats(self):
+        """
+        Returns a dictionary of memory statistics for the edit history.
+        
+        The keys are 'versions', 'resident', 'spilled' and 'ratio'.  See the
+        method getStats in class History for their meaning.  The current 
+        image and the original image are not included in these statistics.
+        """
+        return self._history.getStats()
+    
+    def getMonitor(self):
+        """
+        Returns the object following the progress of edits (or None)
+        """
+        return self._monitor
+    
+    def setMonitor(self, value):
+        """
+        Sets the object following the progress of edits.
+        
+        During a long edit, the editor calls value.setProgress with the 
+        fraction of the edit done (a float in 0..1).  Between parts of the 
+        edit it calls value.isCancelled, and if that returns True, the edit 
+        stops by raising Cancelled.  A a6worker.Job is such an object.
+        
+        Parameter value: The new monitor
+        Precondition: value is None or an object with methods setProgress 
+        and isCancelled
+        """
+        assert value is None or (hasattr(value,'setProgress') and hasattr(value,'isCancelled')), \
+            repr(value)+' is not a valid monitor'
+        self._monitor = value
+    
+    def getProxy(self, limit):
+        """
+        Returns a low-resolution version of the current image, for previews.
+        
+        The result is the first image with at most limit pixels in a pyramid:
+        the current image, then that image shrunk by a factor of 2 (see 
+        shrink in class Image), then shrunk by 2 again, and so on.  So if the
+        current image is small enough, it is the current image itself.
+        
+        The pyramid is made from getCurrent, so a subclass that defers its 
+        edits (see Filter) does them first.  The shrunk images are kept, so 
+        asking again is free.  They are thrown away when the edit history 
+        changes (by increment, undo or clear), or when deferred edits are 
+        done.  So this assumes that every edit starts with a call to 
+        increment, and that no edit is running when this method is called.
+        
+        Parameter limit: The maximum number of pixels
+        Precondition: limit is an int > 0
+        """
+        assert type(limit) == int and limit > 0, repr(limit)+' is not a valid limit'
+        proxy = self.getCurrent()
+        level = 0
+        while len(proxy) > limit:
+            if level == len(self._proxies):
+                self._proxies.append(proxy.shrink(2))
+            proxy = self._proxies[level]
+            level += 1
+        return proxy
     
     # INITIALIZER
-    def __init__(self,original):
+    def __init__(self,original,budget=None):
         """
         Initializes an edit history for the given image.
         
         The edit history starts with exactly one element, which is an 
         (uneditted) copy of the original image.
         
+        If original is a view of a rectangle of a larger image (see the method
+        view in class Image), the view itself is edited, which edits that 
+        rectangle of the larger image in place.  The original is then a copy
+        of the rectangle, and the history only stores that rectangle.
+        
+        If budget is None, the edit history holds at most MAX_HISTORY edits.
+        Otherwise, it holds any number of edits, but keeps at most budget 
+        bytes of them in memory.
+        
         Parameter original: The image to edit
         Precondition: original is an Image object
+        
+        Parameter budget: The memory budget of the edit history in bytes
+        Precondition: budget is an int >= 0 or None
         """
         assert isinstance(original,a6image.Image), repr(original)+' is not an image'
-        self._original = original
-        self._history  = [original.copy()]
+        assert budget is None or (type(budget) == int and budget >= 0), repr(budget)+' is not a valid budget'
+        if isinstance(original,a6image.ImageView):
+            # Edit the selection in place, keeping a copy as the original
+            self._original = original.copy()
+            self._current  = original
+        else:
+            self._original = original
+            self._current  = original.copy()
+        if budget is None:
+            self._history = a6history.History(self.MAX_HISTORY-1)
+        else:
+            self._history = a6history.History(None,budget)
+        self._monitor = None
+        self._proxies = []
     
     # EDIT METHODS
     def undo(self):
@@ -82,8 +207,9 @@ class Editor(object):
         be empty.  If this method is called on an edit history of one element,
         this method returns False instead.
         """
-        if len(self._history) > 1:
-            self._history.pop()
+        if len(self._history) > 0:
+            self._history.pop(self._current)
+            self._proxies = []
             return True
         return False
     
@@ -94,7 +220,12 @@ class Editor(object):
         When this method completes, the object should have the same values that 
         it did once it was first initialized.
         """
-        self._history = [self._original.copy()]
+        if isinstance(self._current,a6image.ImageView):
+            self._current.setBuffer(self._original.getView())
+        else:
+            self._current = self._original.copy()
+        self._history.clear()
+        self._proxies = []
     
     def increment(self):
         """
@@ -103,8 +234,26 @@ class Editor(object):
         This method copies the current most recent edit and adds it to the 
         end of the history.  If this causes the history to grow to larger 
         (greater than MAX_HISTORY), this method deletes the oldest edit.
+        
+        The most recent edit stays the same Image object.  It is the copy that 
+        goes into the history, and only its changed rows are kept there.
         """
-        self._history.append(self.getCurrent().copy())
-        if len(self._history) > self.MAX_HISTORY:
-            self._history.pop(0)
-
+        self._history.push(self._current)
+        self._proxies = []
+    
+    # HELPER METHODS
+    def _progress(self, fraction):
+        """
+        Reports the progress of an edit to the monitor (if any).
+        
+        Subclasses call this between the parts of a long edit.  If the monitor
+        has cancelled the edit, this raises Cancelled instead.
+        
+        Parameter fraction: The fraction of the edit done
+        Precondition: fraction is an int or float in 0..1
+        """
+        monitor = self._monitor
+        if not monitor is None:
+            if monitor.isCancelled():
+                raise Cancelled()
+            monitor.setProgress(fraction)
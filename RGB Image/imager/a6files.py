@@ -0,0 +1,211 @@
+"""
+Image file input and output for the imager application.
+
+The original application loaded an image by asking PIL for a list of pixel
+tuples, and then checking every tuple (and saved it the same way in reverse).
+For a large photo that is millions of Python objects, and it can take tens of
+seconds.  The functions in this module move the pixels between PIL and 
+buffer-backed Image objects as raw bytes instead, so no per-pixel Python 
+objects are ever made.  Saving can also happen in the background.
+
+This module does not depend on Kivy, so it can be used without the GUI.
+"""
+import a6image
+import time
+
+
+# The default zlib compression level (0..9) for saving PNG files
+COMPRESSION = 6
+
+
+def load_image(file, preview=None):
+    """
+    Returns a buffer-backed Image object for the given image file.
+
+    The pixels are unpacked from PIL straight into the buffer of the image
+    (see unpack_pixels), so loading takes about as long as decoding the file.
+
+    If preview is not None, the image is only needed at (about) that size.
+    For JPEG files, PIL can then decode at a reduced scale (draft mode),
+    which is much faster for large photos.  The result is at least as large
+    as preview, but not always exactly that size.  Other formats are loaded
+    at full size.
+
+    A file in the raw format of a6image (see saveRaw in class Image) is not
+    decoded at all.  Its pixels are mapped into memory (see openMmap), so
+    it loads instantly at any size.  Edits never change the file.
+
+    Parameter file: The image file to load
+    Precondition: file is a string naming an image file PIL can read, or a
+    raw image file
+
+    Parameter preview: The size needed, as (width, height)
+    Precondition: preview is None or a pair of ints > 0
+    """
+    from PIL import Image as CoreImage
+    assert preview is None or (len(preview) == 2 and all(type(x) == int and x > 0 for x in preview)), \
+        repr(preview)+' is not a valid preview size'
+
+    if a6image.is_raw(file):
+        return a6image.Image.openMmap(file)
+
+    image = CoreImage.open(file)
+    if not preview is None:
+        image.draft('RGB',tuple(preview))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return a6image.Image.fromBuffer(unpack_pixels(image),image.size[0])
+
+
+def unpack_pixels(image):
+    """
+    Returns a new bytearray with the packed pixels of the given PIL image.
+
+    This is the same as bytearray(image.tobytes()), but with one copy instead
+    of three.  tobytes unpacks the pixels into a list of blocks, and then
+    joins them into a bytes object (which bytearray copies again).  Here the
+    blocks are written into a buffer of the right size as they are unpacked.
+
+    Parameter image: The image to unpack
+    Precondition: image is a PIL image in RGB mode, with width and height > 0
+    """
+    from PIL import Image as CoreImage, ImageFile
+    assert image.mode == 'RGB', repr(image.mode)+' is not RGB mode'
+    image.load()
+    width, height = image.size
+    buffer = bytearray(3*width*height)
+    view   = memoryview(buffer)
+
+    encoder = CoreImage._getencoder(image.mode,'raw',image.mode)
+    encoder.setimage(image.im,(0,0,width,height))
+    block = max(ImageFile.MAXBLOCK,4*width)
+    pos = 0
+    while True:
+        count, error, data = encoder.encode(block)
+        view[pos:pos+len(data)] = data
+        pos += len(data)
+        if error:
+            break
+    if error < 0 or pos != len(buffer):
+        raise RuntimeError('encoder error '+repr(error)+' unpacking the pixels')
+    return buffer
+
+
+def load_timed(file, preview=None):
+    """
+    Returns a pair of a buffer-backed Image for file and the load time.
+
+    The load time is in seconds.  See load_image for the parameters.
+
+    Parameter file: The image file to load
+    Precondition: file is a string naming an image file PIL can read
+
+    Parameter preview: The size needed, as (width, height)
+    Precondition: preview is None or a pair of ints > 0
+    """
+    start = time.perf_counter()
+    image = load_image(file,preview)
+    return (image,time.perf_counter()-start)
+
+
+def to_pil(image):
+    """
+    Returns a PIL image with a copy of the pixels of image.
+
+    The pixels are copied in one block of bytes (not one pixel at a time).
+    The PIL image does not change if image does.
+
+    Parameter image: The image to convert
+    Precondition: image is an Image object
+    """
+    from PIL import Image as CoreImage
+    assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+    size = (image.getWidth(),image.getHeight())
+    return CoreImage.frombytes('RGB',size,image.getView())
+
+
+def save_image(image, file, level=None):
+    """
+    Saves image to the given file in PNG format.
+
+    Parameter image: The image to save
+    Precondition: image is an Image object
+
+    Parameter file: The file to write
+    Precondition: file is a string
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9, or None for COMPRESSION
+    """
+    level = COMPRESSION if level is None else level
+    assert type(level) == int and 0 <= level <= 9, repr(level)+' is not a valid compression level'
+    to_pil(image).save(file,'PNG',compress_level=level)
+
+
+def save_images(jobs, level=None, workers=None):
+    """
+    Saves several images in PNG format at once, and returns the failures.
+
+    The images are encoded in a pool of threads.  The zlib encoder does not
+    hold the Python interpreter lock, so this uses several cores.  The result
+    is a list of (file, exception) pairs, one for each image that could not
+    be saved.  It is empty if every image was saved.
+
+    Parameter jobs: The images to save
+    Precondition: jobs is a list of (image, file) pairs, where image is an
+    Image object and file is a string
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9, or None for COMPRESSION
+
+    Parameter workers: The number of threads
+    Precondition: workers is an int > 0, or None to choose automatically
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    failures = []
+    with ThreadPoolExecutor(workers) as pool:
+        futures = [(file,pool.submit(save_image,image,file,level)) for image, file in jobs]
+        for file, future in futures:
+            if not future.exception() is None:
+                failures.append((file,future.exception()))
+    return failures
+
+
+def save_async(jobs, level=None, callback=None):
+    """
+    Saves several images in PNG format in the background.
+
+    This function returns immediately, with the thread doing the saving.  The
+    images are snapshots taken when the function is called, so they may be
+    edited (even by another thread) while they are being saved.
+
+    When all images are saved, callback (if not None) is called with the list
+    of failures (see save_images).  It is called in the saving thread, so a
+    GUI should pass it back to its own thread.
+
+    Parameter jobs: The images to save
+    Precondition: jobs is a list of (image, file) pairs, where image is an
+    Image object and file is a string
+
+    Parameter level: The zlib compression level
+    Precondition: level is an int in 0..9, or None for COMPRESSION
+
+    Parameter callback: The function to call when done
+    Precondition: callback is None or a function taking a list of failures
+    """
+    import threading
+    snapshots = []
+    for image, file in jobs:
+        assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+        # The snapshot must not share the buffer, as that may change
+        snapshot = a6image.Image(bytearray(image.getView()),image.getWidth())
+        snapshots.append((snapshot,file))
+
+    def work():
+        failures = save_images(snapshots,level)
+        if not callback is None:
+            callback(failures)
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    return thread
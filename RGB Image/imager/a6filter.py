@@ -18,6 +18,528 @@ November 16 2020
 import a6editor
 import a6image
 import math # Just in case
+import operator
+from array import array
+from collections import OrderedDict
+from itertools import chain
+from multiprocessing import shared_memory
+from concurrent.futures import as_completed, wait
+
+# NumPy is optional.  Without it, only the pure Python backend is available.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# PIXEL MAPS
+def _channel_table(func):
+    """
+    Returns the lookup table of a function on color values.
+    
+    The table is a bytes object of length 256, where position v is func(v).
+    
+    Parameter func: The function to tabulate
+    Precondition: func is a function that takes an int in 0..255 and returns
+    an int in 0..255
+    """
+    table = [func(value) for value in range(256)]
+    for value in table:
+        assert type(value) == int and 0 <= value <= 255, repr(value)+' is not a color value'
+    return bytes(table)
+
+
+def _darken(data, mask):
+    """
+    Returns the packed pixels data darkened by the factors in mask.
+
+    Each color value is multiplied by the factor of its pixel, and converted
+    to int (but not rounded).
+
+    Parameter data: The packed pixels
+    Precondition: data is a bytes-like object with 3 bytes per pixel
+
+    Parameter mask: The darkening factors, one for each pixel
+    Precondition: mask is a sequence of floats in 0..1 of length len(data)//3
+    """
+    return bytes(map(int,map(operator.mul,data,chain.from_iterable(zip(mask,mask,mask)))))
+
+
+class _ColorTable(dict):
+    """
+    A lookup table of a function on pixels.
+    
+    There are too many colors to compute the function for all of them in 
+    advance.  Instead, this dictionary computes the function the first time 
+    it sees a color, and remembers the result (packed as 3 bytes).  A photo
+    has far fewer distinct colors than pixels, so most pixels are lookups.
+    
+    The keys are pixels (3-element tuples) and the values are bytes objects.
+    """
+    # Attribute _func: The function to tabulate
+    # Invariant: _func is a function that takes a pixel and returns a pixel
+    
+    def __init__(self, func):
+        """
+        Initializes an empty lookup table for func.
+        
+        Parameter func: The function to tabulate
+        Precondition: func is a function that takes a pixel (a 3-element 
+        tuple of ints in 0..255) and returns a pixel
+        """
+        super().__init__()
+        self._func = func
+    
+    def __missing__(self, pixel):
+        """
+        Returns (and remembers) the packed result of the function on pixel
+        
+        Parameter pixel: The pixel to look up
+        Precondition: pixel is a 3-element tuple of ints in 0..255
+        """
+        result = self._func(pixel)
+        assert a6image._is_pixel(result), repr(result) + " is not a pixel"
+        result = bytes(result)
+        self[pixel] = result
+        return result
+
+
+def _compose_tables(first, second):
+    """
+    Returns the lookup tables for applying first and then second.
+    
+    Parameter first: The first lookup tables
+    Precondition: first is a tuple of three lookup tables (red, green, blue)
+    
+    Parameter second: The second lookup tables
+    Precondition: second is a tuple of three lookup tables (red, green, blue)
+    """
+    return tuple(first[k].translate(second[k]) for k in range(3))
+
+
+def _compose_stages(stages):
+    """
+    Returns a function on pixels that applies every stage in order.
+    
+    A stage is either a tuple of three lookup tables (red, green, blue) or a
+    function on pixels (see Filter.mapPixels).
+    
+    Parameter stages: The stages to apply
+    Precondition: stages is a list of stages
+    """
+    def func(pixel):
+        for stage in stages:
+            if type(stage) == tuple:
+                pixel = (stage[0][pixel[0]],stage[1][pixel[1]],stage[2][pixel[2]])
+            else:
+                pixel = stage(pixel)
+        return pixel
+    return func
+
+
+# GEOMETRIC TRANSFORMS
+# The geometric actions form a group (the symmetries of a rectangle, with 
+# transposes allowed).  Each element is a tuple (swap, fliprows, flipcols) 
+# of bools, meaning: transpose if swap, then reverse the order of the rows if
+# fliprows, then reverse the order of the columns if flipcols.
+_IDENTITY = (False,False,False)
+
+_TRANSFORMS = {'transpose':   (True, False,False),
+               'reflectHori': (False,False,True),
+               'reflectVert': (False,True, False),
+               'rotateRight': (True, False,True),
+               'rotateLeft':  (True, True, False)}
+
+
+def _compose_transforms(first, second):
+    """
+    Returns the transform for applying first and then second.
+    
+    Reversing the rows and then transposing is the same as transposing and 
+    then reversing the columns (and vice versa).  So if second transposes, 
+    the flips of first trade places.
+    
+    Parameter first: The first transform
+    Precondition: first is a transform (a tuple of three bools)
+    
+    Parameter second: The second transform
+    Precondition: second is a transform (a tuple of three bools)
+    """
+    swap, fliprows, flipcols = first
+    if second[0]:
+        fliprows, flipcols = flipcols, fliprows
+    return (swap != second[0], fliprows != second[1], flipcols != second[2])
+
+
+def _complement(value):
+    """
+    Returns the complement of a color value (see Filter.invert)
+    
+    Parameter value: The color value
+    Precondition: value is an int in 0..255
+    """
+    return 255 - value
+
+
+def _contrasting(factor):
+    """
+    Returns the function on color values that changes contrast by factor
+    
+    See Filter.contrast for the formula.
+    
+    Parameter factor: The contrast factor
+    Precondition: factor is an int or float >= 0
+    """
+    assert type(factor) in [int,float] and factor >= 0, repr(factor) + " is not a valid factor"
+    return lambda value: min(255,max(0,int(128+factor*(value-128))))
+
+
+class _MaskCache(object):
+    """
+    A cache of precomputed masks, with a memory capacity.
+    
+    A mask is any object that depends only on its key (e.g. the vignette
+    darkening factors for an image size).  When the masks use more memory 
+    than the capacity, the least recently used masks are evicted.  A mask
+    larger than the capacity is never cached at all.
+    """
+    # Attribute _capacity: The maximum number of bytes of masks to keep
+    # Invariant: _capacity is an int >= 0
+    #
+    # Attribute _masks: The cached masks and their sizes, oldest use first
+    # Invariant: _masks is an OrderedDict mapping keys to (mask, size) pairs
+    #
+    # Attribute _size: The number of bytes of masks in the cache
+    # Invariant: _size is the sum of the sizes in _masks
+    
+    def __init__(self, capacity):
+        """
+        Initializes an empty mask cache.
+        
+        Parameter capacity: The maximum number of bytes of masks to keep
+        Precondition: capacity is an int >= 0
+        """
+        self._masks = OrderedDict()
+        self._size  = 0
+        self.setCapacity(capacity)
+    
+    def __len__(self):
+        """
+        Returns the number of masks in this cache
+        """
+        return len(self._masks)
+    
+    def getCapacity(self):
+        """
+        Returns the maximum number of bytes of masks to keep
+        """
+        return self._capacity
+    
+    def setCapacity(self, value):
+        """
+        Sets the maximum number of bytes of masks to keep.
+        
+        Masks are evicted immediately if the cache no longer fits.
+        
+        Parameter value: The new capacity
+        Precondition: value is an int >= 0
+        """
+        assert type(value) == int and value >= 0, repr(value)+' is not a valid capacity'
+        self._capacity = value
+        self._evict()
+    
+    def getSize(self):
+        """
+        Returns the number of bytes of masks in this cache
+        """
+        return self._size
+    
+    def get(self, key, func):
+        """
+        Returns the mask for key, computing it with func if it is not cached.
+        
+        Parameter key: The key of the mask
+        Precondition: key is hashable
+        
+        Parameter func: The function to compute the mask
+        Precondition: func is a function that takes no arguments and returns
+        an array (from the module array or from NumPy)
+        """
+        if key in self._masks:
+            self._masks.move_to_end(key)
+            return self._masks[key][0]
+        
+        mask = func()
+        size = mask.nbytes if hasattr(mask,'nbytes') else len(mask)*mask.itemsize
+        if size <= self._capacity:
+            self._masks[key] = (mask,size)
+            self._size += size
+            self._evict()
+        return mask
+    
+    def clear(self):
+        """
+        Removes every mask from this cache
+        """
+        self._masks.clear()
+        self._size = 0
+    
+    def _evict(self):
+        """
+        Removes the least recently used masks until the cache fits
+        """
+        while self._size > self._capacity:
+            mask, size = self._masks.popitem(False)[1]
+            self._size -= size
+
+
+# TILED EXECUTION
+# The NumPy backend methods that can be applied to horizontal bands (tiles)
+# of an image, each processed separately, with the same result
+_TILED = ('_invertNumpy','_monochromifyNumpy','_mapNumpy','_vignetteNumpy',
+          '_pixellateNumpy','_blurNumpy')
+
+# The process pools, by number of processes (created when first needed)
+_pools = {}
+
+# The filter used by a pool process to run the backend methods
+_scratch = None
+
+
+def _get_pool(processes):
+    """
+    Returns the (persistent) pool with the given number of processes
+    
+    Parameter processes: The number of processes
+    Precondition: processes is an int > 1
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    if not processes in _pools:
+        _pools[processes] = ProcessPoolExecutor(processes)
+    return _pools[processes]
+
+
+def _band_rows(name, args, rows):
+    """
+    Returns the pair (rows, halo) for splitting a NumPy method into bands.
+    
+    The first value is the number of rows per band: at least the given rows,
+    rounded up for pixellate so every band is a whole number of blocks.  The
+    second is the number of extra rows needed on each side of a band.
+    
+    Parameter name: The name of the backend method
+    Precondition: name is one of the names in _TILED
+    
+    Parameter args: The remaining arguments to the method
+    Precondition: args is a tuple of valid arguments for the method
+    
+    Parameter rows: The number of rows per band wanted
+    Precondition: rows is an int > 0
+    """
+    if name == '_pixellateNumpy':
+        return (-(-rows//args[0])*args[0],0)
+    elif name == '_blurNumpy':
+        return (rows,args[0])
+    return (rows,0)
+
+
+def _filter_band(editor, name, pixels, args, start, stop, halo):
+    """
+    Returns rows start..stop-1 of the result of a NumPy method.
+    
+    Only those rows (plus halo rows on each side) of pixels are processed.
+    
+    Parameter editor: The filter with the method
+    Precondition: editor is a Filter object
+    
+    Parameter name: The name of the backend method
+    Precondition: name is one of the names in _TILED
+    
+    Parameter pixels: The whole image
+    Precondition: pixels is a height x width x 3 array of uint8
+    
+    Parameter args: The remaining arguments to the method
+    Precondition: args is a tuple of valid arguments for the method
+    
+    Parameter start: The first row of the band
+    Precondition: start is an int in 0..height-1
+    
+    Parameter stop: The row after the band
+    Precondition: stop is an int in start+1..height
+    
+    Parameter halo: The number of extra rows needed on each side
+    Precondition: halo is an int >= 0
+    """
+    height = pixels.shape[0]
+    top    = max(0,start-halo)
+    bottom = min(height,stop+halo)
+    method = getattr(editor,name)
+    if name == '_vignetteNumpy':
+        band = method(pixels[top:bottom],top,height,*args)
+    else:
+        band = method(pixels[top:bottom],*args)
+    return band[start-top:stop-top]
+
+
+def _filter_tile(source, target, height, width, name, args, start, stop, halo):
+    """
+    Applies a NumPy backend method to one band of a shared image.
+    
+    This function runs in a pool process.  The image is in the shared memory
+    block source, and the result is written to the same rows of the shared
+    memory block target.  Only the names of the blocks are sent to the 
+    process, never the pixels.
+    
+    The method is applied to rows start..stop-1, plus up to halo rows above
+    and below (for methods where a pixel depends on its neighbors).
+    
+    Parameter source: The name of the shared memory block with the image
+    Precondition: source is a string
+    
+    Parameter target: The name of the shared memory block for the result
+    Precondition: target is a string
+    
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    
+    Parameter width: The image width
+    Precondition: width is an int > 0
+    
+    Parameter name: The name of the backend method
+    Precondition: name is one of the names in _TILED
+    
+    Parameter args: The remaining arguments to the method
+    Precondition: args is a tuple of valid arguments for the method.  For
+    _vignetteNumpy, it may instead hold the name of a shared memory block
+    with the mask of the whole image.
+    
+    Parameter start: The first row of the band
+    Precondition: start is an int in 0..height-1
+    
+    Parameter stop: The row after the band
+    Precondition: stop is an int in start+1..height
+    
+    Parameter halo: The number of extra rows needed on each side
+    Precondition: halo is an int >= 0
+    """
+    global _scratch
+    if _scratch is None:
+        _scratch = Filter(a6image.Image(bytearray(3),1),'numpy')
+    
+    inblock  = shared_memory.SharedMemory(name=source)
+    outblock = shared_memory.SharedMemory(name=target)
+    maskblock = None
+    pixels = result = band = None
+    try:
+        pixels = numpy.ndarray((height,width,3),dtype=numpy.uint8,buffer=inblock.buf)
+        result = numpy.ndarray((height,width,3),dtype=numpy.uint8,buffer=outblock.buf)
+        if name == '_vignetteNumpy' and args:
+            maskblock = shared_memory.SharedMemory(name=args[0])
+            args = (numpy.ndarray((height,width,1),dtype=numpy.float64,buffer=maskblock.buf),)
+        band = _filter_band(_scratch,name,pixels,args,start,stop,halo)
+        result[start:stop] = band
+    finally:
+        # The arrays must be gone before the blocks can be closed
+        pixels = result = band = args = None
+        inblock.close()
+        outblock.close()
+        if not maskblock is None:
+            maskblock.close()
+
+
+def _greyscale(pixel):
+    """
+    Returns the greyscale version of pixel (see Filter.monochromify)
+    
+    Parameter pixel: The pixel to convert
+    Precondition: pixel is a 3-element tuple of ints in 0..255
+    """
+    bness = int(0.3 * pixel[0] + 0.6 * pixel[1] + 0.1 * pixel[2])
+    return (bness,bness,bness)
+
+
+def _sepia(pixel):
+    """
+    Returns the sepia version of pixel (see Filter.monochromify)
+    
+    Parameter pixel: The pixel to convert
+    Precondition: pixel is a 3-element tuple of ints in 0..255
+    """
+    bness = 0.3 * pixel[0] + 0.6 * pixel[1] + 0.1 * pixel[2]
+    return (int(bness), int(0.6 * bness), int(0.4 *bness))
+
+
+# LAZY EVALUATION
+# The per-pixel actions, which commute with the geometric ones
+_PER_PIXEL = ('invert','monochromify','contrast')
+
+# The actions that can be done to a TiledImage a band at a time
+_STREAMED = ('invert','monochromify','contrast','vignette','pixellate')
+
+# The actions where doing them twice in a row is the same as doing them once.
+# Greyscale is NOT one of these: the brightness is truncated, so a grey pixel
+# can get darker by one (e.g. 0.3*11+0.6*11+0.1*11 is 10.999...).
+_IDEMPOTENT = ('jail','pixellate')
+
+
+def _transform_actions(move):
+    """
+    Returns the shortest list of geometric actions that make up move.
+    
+    Each action is a tuple with just the name of a geometric action, as used
+    in a pipeline.  The identity is the empty list.
+    
+    Parameter move: The transform to break up
+    Precondition: move is a transform (a tuple of three bools)
+    """
+    if move == _IDENTITY:
+        return []
+    for name in _TRANSFORMS:
+        if _TRANSFORMS[name] == move:
+            return [(name,)]
+    for first in _TRANSFORMS:
+        for second in _TRANSFORMS:
+            if _compose_transforms(_TRANSFORMS[first],_TRANSFORMS[second]) == move:
+                return [(first,),(second,)]
+
+
+def _simplify(operations):
+    """
+    Returns a list of operations with the same result as operations, but less work.
+    
+    The rules are exact, so the pixels are always the same as for the 
+    original operations.  They are:
+    * Neighboring geometric actions combine into at most two (and none at 
+      all if they cancel out, like reflectVert twice).
+    * Per-pixel actions commute with geometric ones, so the geometric 
+      actions move after them (where they may combine with others).
+    * Two inverts in a row cancel out.
+    * An action in _IDEMPOTENT right after the same action is dropped.
+    
+    Parameter operations: The operations to simplify
+    Precondition: operations is a list of valid pipeline operations
+    """
+    result = []
+    pixel  = []
+    move   = _IDENTITY
+    for action in operations:
+        action = tuple(action)
+        if action[0] in _TRANSFORMS:
+            move = _compose_transforms(move,_TRANSFORMS[action[0]])
+        elif action[0] == 'invert' and pixel and pixel[-1] == action:
+            pixel.pop()
+        elif action[0] in _PER_PIXEL:
+            pixel.append(action)
+        else:
+            result.extend(pixel)
+            result.extend(_transform_actions(move))
+            pixel = []
+            move  = _IDENTITY
+            if not (action[0] in _IDEMPOTENT and result and result[-1] == action):
+                result.append(action)
+    result.extend(pixel)
+    result.extend(_transform_actions(move))
+    return result
 
 
 class Filter(a6editor.Editor):
@@ -36,91 +558,294 @@ class Filter(a6editor.Editor):
     
     Each one of the non-hidden functions should edit the most recent image 
     in the edit history (which is inherited from Editor).
+    
+    Each filter has two implementations, called backends.  The 'python' 
+    backend uses only plain Python (pixel loops, lookup tables and slices of
+    the pixel buffer).  The 'numpy' backend processes the whole image at once as a
+    NumPy array, which is much faster.  Both backends produce exactly the 
+    same image.  The 'numpy' backend requires NumPy to be installed.
+    
+    The long filters (monochromify, vignette, pixellate and blur, plus 
+    invert and contrast with the 'numpy' backend) work in chunks of rows 
+    when the filter has a monitor (see setMonitor in Editor).  They report 
+    their progress after each chunk, and stop if the monitor cancels them.
+    
+    A filter can also be lazy (see setLazy).  Then the actions only record 
+    what to do, and the pixels are computed when the current image is next 
+    needed.  The recorded actions are simplified first, so work that would 
+    cancel out (like inverting twice) is never done.
+    
+    Attribute BACKENDS: A CLASS ATTRIBUTE for the names of the backends
+    Invariant: BACKENDS is a tuple of strings
+    
+    Attribute ACTIONS: A CLASS ATTRIBUTE for the names of the filter actions
+    Invariant: ACTIONS is a tuple of strings, each the name of a method
+    
+    Attribute MASKS: A CLASS ATTRIBUTE for the cache of vignette masks
+    Invariant: MASKS is a mask cache shared by all filters.  Use its method
+    setCapacity to change how much memory (in bytes) it may use.
+    
+    Attribute MIN_TILED: A CLASS ATTRIBUTE for the smallest image to split
+    Invariant: MIN_TILED is an int > 0 (a number of pixels)
+    
+    Attribute CHUNK_PIXELS: A CLASS ATTRIBUTE for the size of a progress step
+    Invariant: CHUNK_PIXELS is an int > 0 (a number of pixels)
     """
+    # MUTABLE ATTRIBUTES (Can be changed at any time, via the setters)
+    # Attribute _backend: The implementation used by the filters
+    # Invariant: _backend is one of the strings in BACKENDS
+    #
+    # Attribute _processes: The number of processes for tiled filters
+    # Invariant: _processes is an int > 0
+    #
+    # Attribute _lazy: Whether actions are recorded instead of done at once
+    # Invariant: _lazy is a bool
+    #
+    # Attribute _deferred: The recorded actions not yet done to _current
+    # Invariant: _deferred is a simplified list of pipeline operations (it 
+    # is empty if _lazy is False)
+    
+    # The available filter implementations
+    BACKENDS = ('python','numpy')
+    
+    # The actions that may be used in a pipeline
+    ACTIONS = ('invert','transpose','reflectHori','reflectVert','rotateRight',
+               'rotateLeft','monochromify','jail','vignette','pixellate',
+               'contrast','blur')
+    
+    # Vignette masks by image size, at 8 bytes per pixel (so 192 MB holds the 
+    # mask of a 24 MP photo, or several masks for smaller ones)
+    MASKS = _MaskCache(192*1024*1024)
+    
+    # Smaller images are not worth sending to other processes
+    MIN_TILED = 1024*1024
+    
+    # With a monitor, the long filters work in chunks of about this many pixels
+    CHUNK_PIXELS = 256*1024
+    
+    # INITIALIZER
+    def __init__(self, original, backend=None, budget=None):
+        """
+        Initializes an image filter for the given image.
+        
+        If backend is None, the filter uses the 'numpy' backend when NumPy is
+        installed and the 'python' backend otherwise.
+        
+        Parameter original: The image to edit
+        Precondition: original is an Image object
+        
+        Parameter backend: The filter implementation to use
+        Precondition: backend is None or a valid backend (see setBackend)
+        
+        Parameter budget: The memory budget of the edit history in bytes
+        Precondition: budget is an int >= 0 or None (see Editor)
+        """
+        super().__init__(original,budget)
+        if backend is None:
+            backend = 'python' if numpy is None else 'numpy'
+        self.setBackend(backend)
+        self._processes = 1
+        self._lazy = False
+        self._deferred = []
+    
+    # GETTERS AND SETTERS
+    def getBackend(self):
+        """
+        Returns the name of the backend used by the filters
+        """
+        return self._backend
+    
+    def setBackend(self, value):
+        """
+        Sets the backend used by the filters.
+        
+        Parameter value: The new backend
+        Precondition: value is one of the strings in BACKENDS.  It can only be
+        'numpy' if NumPy is installed.
+        """
+        assert value in self.BACKENDS, repr(value) + " is not a valid backend"
+        assert value != 'numpy' or numpy is not None, "NumPy is not installed"
+        self._backend = value
+    
+    def getProcesses(self):
+        """
+        Returns the number of processes used for tiled filters
+        """
+        return self._processes
+    
+    def setProcesses(self, value):
+        """
+        Sets the number of processes used for tiled filters.
+        
+        If value is more than 1, the 'numpy' backend splits large images 
+        (with at least MIN_TILED pixels) into bands of rows, and filters the 
+        bands at the same time in a pool of processes.  The pixels are shared
+        with the processes through shared memory, so they are never copied 
+        between processes.  The result is the same as without tiles.
+        
+        Only the filters where each band can be done separately are split.
+        These are invert, monochromify, contrast, vignette, pixellate (with 
+        bands that are a whole number of blocks), and blur (with extra rows 
+        on each side of a band).
+        
+        Parameter value: The number of processes
+        Precondition: value is an int > 0
+        """
+        assert type(value) == int and value > 0, repr(value) + " is not a valid number of processes"
+        self._processes = value
+    
+    def isLazy(self):
+        """
+        Returns True if this filter records actions instead of doing them at once
+        """
+        return self._lazy
+    
+    def setLazy(self, value):
+        """
+        Sets whether this filter records actions instead of doing them at once.
+        
+        In lazy mode, every action (including pipeline and transform) only 
+        adds itself to a list of deferred operations, which is simplified as 
+        it grows (e.g. an invert cancels the invert before it).  The deferred
+        operations are done, as a single pipeline, the next time the current 
+        image is needed: by getCurrent (so also to display or save it), by 
+        increment, or by flush.  An undo throws them away unread.
+        
+        Errors in a deferred action (other than a bad argument) are raised 
+        when the operations are done, not when the action is called.
+        
+        Turning lazy mode off does any deferred operations.
+        
+        Parameter value: Whether to be lazy
+        Precondition: value is a bool
+        """
+        assert type(value) == bool, repr(value) + " is not a bool"
+        if not value:
+            self.flush()
+        self._lazy = value
+    
+    def getDeferred(self):
+        """
+        Returns a copy of the operations recorded but not yet done (see setLazy)
+        """
+        return list(self._deferred)
+    
+    # EDITOR METHODS
+    def getCurrent(self):
+        """
+        Returns the most recent edit, doing any deferred operations first
+        """
+        if self._deferred:
+            self.flush()
+        return self._current
+    
+    def increment(self):
+        """
+        Adds a new copy of the image to the edit history.
+        
+        Any deferred operations are done first (see setLazy), since they are
+        part of the edit before.
+        """
+        self.flush()
+        super().increment()
+    
+    def undo(self):
+        """
+        Returns True if the latest edit can be undone, False otherwise.
+        
+        The deferred operations (see setLazy) belong to the latest edit, so if
+        it can be undone they are thrown away without ever being done.
+        """
+        if len(self._history) > 0:
+            self._deferred = []
+        return super().undo()
+    
+    def clear(self):
+        """
+        Deletes the entire edit history, retoring the original image.
+        
+        Any deferred operations are thrown away.
+        """
+        self._deferred = []
+        super().clear()
+    
+    def flush(self):
+        """
+        Does the deferred operations (if any) to the current image.
+        
+        The operations are done as a single pipeline.  They are removed even
+        if the pipeline fails (and so the current image is unchanged).  The
+        proxies of the current image (see getProxy) are thrown away.
+        """
+        operations = self._deferred
+        if not operations:
+            return
+        self._deferred = []
+        lazy = self._lazy
+        self._lazy = False
+        try:
+            self.pipeline(operations)
+        finally:
+            self._lazy = lazy
+            self._proxies = []
     
     # PROVIDED ACTIONS (STUDY THESE)
     def invert(self):
         """
         Inverts the current image, replacing each element with its color complement
         """
-        current = self.getCurrent()
-        for pos in range(len(current)): # We can do this because of __len__
-            rgb = current[pos]          # We can do this because of __getitem__
-            red   = 255 - rgb[0]
-            green = 255 - rgb[1]
-            blue  = 255 - rgb[2]
-            rgb = (red,green,blue)      # New pixel value
-            current[pos] = rgb          # We can do this because of __setitem__
+        if self._defer(('invert',)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._invertNumpy)
+            return
+        
+        # Each color value is replaced by its complement (a table lookup)
+        self.mapChannels(_complement)
     
     def transpose(self):
         """
         Transposes the current image
         
         Transposing is tricky, as it is hard to remember which values have been 
-        changed and which have not.  To simplify the process, we copy the 
-        current image and use that as a reference.  So we change the current 
-        image with setPixel, but read (with getPixel) from the copy.
+        changed and which have not.  Instead of moving pixels one at a time, 
+        this (like every geometric action) builds the new image from whole 
+        columns of the old one (see the method transform).
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,row))
+        self.transform(['transpose'])
     
     def reflectHori(self):
         """
         Reflects the current image around the horizontal middle.
         """
-        current = self.getCurrent()
-        for h in range(current.getWidth()//2):      # Loop over the columnns
-            for row in range(current.getHeight()):  # Loop over the rows
-                k = current.getWidth()-1-h
-                current.swapPixels(row,h,row,k)
+        self.transform(['reflectHori'])
     
     def rotateRight(self):
         """
         Rotates the current image right by 90 degrees.
         
         Technically, we can implement this via a transpose followed by a 
-        horizontal reflection. However, this is slow, so we use the faster 
-        strategy below.
+        horizontal reflection.  That is exactly how the method transform sees
+        it, but it combines the two into a single pass over the image.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(original.getHeight()-col-1,row))
+        self.transform(['rotateRight'])
     
     def rotateLeft(self):
         """
         Rotates the current image left by 90 degrees.
         
         Technically, we can implement this via a transpose followed by a 
-        vertical reflection. However, this is slow, so we use the faster 
-        strategy below.
+        vertical reflection.  That is exactly how the method transform sees
+        it, but it combines the two into a single pass over the image.
         """
-        current  = self.getCurrent()
-        original = current.copy()
-        current.setWidth(current.getHeight())
-        
-        for row in range(current.getHeight()):      # Loop over the rows
-            for col in range(current.getWidth()):   # Loop over the columnns
-                current.setPixel(row,col,original.getPixel(col,original.getWidth()-row-1))
+        self.transform(['rotateLeft'])
     
     # ASSIGNMENT METHODS (IMPLEMENT THESE)
     def reflectVert(self):
         """ 
         Reflects the current image around the vertical middle.
         """
-        current = self.getCurrent()
-        for h in range(current.getHeight()//2):     # Loop over the rows
-            for col in range(current.getHeight()):  # Loop over the columns
-                k = current.getHeight()-1-h
-                current.swapPixels(h,col,k,col)
+        self.transform(['reflectVert'])
     
     def monochromify(self, sepia):
         """
@@ -140,26 +865,16 @@ class Filter(a6editor.Editor):
         Precondition: sepia is a bool
         """
         assert type(sepia) == bool, repr(sepia) + " is not a bool"
-        current = self.getCurrent()
-
+        if self._defer(('monochromify',sepia)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._monochromifyNumpy,sepia)
+            return
+        
         if sepia == False: #greyscale
-            for row in range(current.getHeight()):      # Loop over the rows
-                for col in range(current.getWidth()):   # Loop over the columnns
-                    pixel = current.getPixel(row,col)
-                    red = pixel[0]
-                    green = pixel[1]
-                    blue = pixel[2]
-                    bness = int(0.3 * red + 0.6 * green + 0.1 * blue)
-                    current.setPixel(row,col,(bness,bness,bness))
+            self.mapPixels(_greyscale)
         else: #sepia
-            for row in range(current.getHeight()):      # Loop over the rows
-                for col in range(current.getWidth()):   # Loop over the columnns
-                    pixel = current.getPixel(row,col)
-                    red = pixel[0]
-                    green = pixel[1]
-                    blue = pixel[2]
-                    bness = 0.3 * red + 0.6 * green + 0.1 * blue
-                    current.setPixel(row,col,(int(bness), int(0.6 * bness), int(0.4 *bness)))        
+            self.mapPixels(_sepia)
     
     def jail(self):
         """
@@ -176,6 +891,12 @@ class Filter(a6editor.Editor):
         
         The n+2 vertical bars should be as evenly spaced as possible.
         """
+        if self._defer(('jail',)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._jailNumpy)
+            return
+        
         current = self.getCurrent()
 
         red = (255,0,0)
@@ -207,20 +928,27 @@ class Filter(a6editor.Editor):
         The values d and hfD should be left as floats and not converted to ints.
         Furthermore, when the final color value is calculated for each pixel,
         the result should be converted to int, but not rounded.
+        
+        The darkening factors only depend on the size of the image, so they 
+        are computed once per size and kept in the cache MASKS.  Vignetting
+        another image of the same size is then a single multiplication pass.
         """
+        if self._defer(('vignette',)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._vignetteNumpy)
+            return
+        
         current = self.getCurrent()
-        for row in range(current.getHeight()):      # Loop over the rows
-            for cl in range(current.getWidth()):   # Loop over the columnns
-                pixel = current.getPixel(row,cl)
-                d=math.sqrt(((row-(current.getHeight()/2))**2)
-                            +((cl-(current.getWidth()/2))**2))
-                hfD=math.sqrt(((0-(current.getHeight()/2))**2)
-                            +((0-(current.getWidth()/2))**2))
-                darken = 1.0 - ((d/hfD)**2)
-                red = int(pixel[0]*darken)
-                green = int(pixel[1]*darken)
-                blue = int(pixel[2]*darken)
-                current.setPixel(row,cl,(red,green,blue))
+        height  = current.getHeight()
+        width   = current.getWidth()
+        mask = self.MASKS.get(('python',height,width),lambda: self._vignetteMask(height,width))
+        view = current.getView()
+        parts = []
+        for start, stop in self._getChunks():
+            parts.append(_darken(view[start:stop],mask[start//3:stop//3]))
+            self._progress(stop/len(view))
+        current.setBuffer(b''.join(parts))
     
     def pixellate(self,step):
         """
@@ -243,53 +971,573 @@ class Filter(a6editor.Editor):
         Precondition: step is an int > 0
         """
         assert type(step) == int and step > 0, repr(step) + " is not a valid step"
+        if self._defer(('pixellate',step)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._pixellateNumpy,step)
+            return
+        
         current = self.getCurrent()
-        widthSteps = current.getWidth()//step
-        heightSteps = current.getHeight()//step
-        widthRem = current.getWidth()%step
-        heightRem = current.getHeight()%step
-        for i in range(heightSteps):
-            for j in range(widthSteps):
-                block = self._avging(i*step,j*step,step)
-                # fill in a block with dimensions step x step, starting at row + (i*step) and col + (j*step)
-                for row in range(step):
-                    for col in range(step):
-                        current.setPixel(row+(i*step), col+(j*step), block)
-            # fill the rest in through width remainder width and step height
-            if widthRem != 0:
-                r = 0
-                g = 0
-                b = 0
-                for ro in range(step):
-                    for co in range(widthRem):
-                        pixel = current.getPixel(ro+(i*step),co+(widthRem*step))
-                        r += pixel[0]
-                        g += pixel[1]
-                        b += pixel[2]
-                avgFactor = step*step        
-                blok = (int(r/avgFactor),int(g/avgFactor),int(b/avgFactor))
-                for k in range(step):
-                    for l in range(widthRem):
-                        current.setPixel(k+(i*step),l+(widthRem*step), blok)
-        
-        if heightRem != 0:
-            r = 0
-            g = 0
-            b = 0
-            for z in range(widthSteps):
-                for ro in range(heightRem):
-                    for co in range(step):
-                        pixel = current.getPixel(ro+(heightRem*step),co+(z*step))
-                        r += pixel[0]
-                        g += pixel[1]
-                        b += pixel[2]
-                avgFactor = step*step        
-                blok = (int(r/avgFactor),int(g/avgFactor),int(b/avgFactor))
-                for k in range(heightRem):
-                    for l in range(step):
-                        current.setPixel(ro+(heightRem*step),co+(z*step), blok)
-
+        sums = a6image.SummedArea(current)
+        for row in range(0,current.getHeight(),step):      # Loop over the block rows
+            for col in range(0,current.getWidth(),step):   # Loop over the block columns
+                block = self._avging(sums,row,col,step)
+                # The last blocks stop at the edge of the image
+                height = min(step,current.getHeight()-row)
+                width  = min(step,current.getWidth()-col)
+                current.fillRect(row,col,height,width,block)
+            self._progress(min(row+step,current.getHeight())/current.getHeight())
+    
+    def contrast(self, factor):
+        """
+        Changes the contrast of the current image.
+        
+        Each color value v is replaced by
+            
+            128 + factor * (v - 128)
+        
+        converted to int (but not rounded) and then clamped to 0..255.  So a 
+        factor greater than 1 increases the contrast, a factor less than 1 
+        reduces it, and a factor of 0 makes the whole image grey.
+        
+        Parameter factor: The contrast factor
+        Precondition: factor is an int or float >= 0
+        """
+        assert type(factor) in [int,float] and factor >= 0, repr(factor) + " is not a valid factor"
+        if self._defer(('contrast',factor)):
+            return
+        func = _contrasting(factor)
+        if self._backend == 'numpy':
+            self._apply(self._mapNumpy,(_channel_table(func),)*3)
+            return
+        
+        self.mapChannels(func)
+    
+    def pipeline(self, operations):
+        """
+        Applies a sequence of actions to the current image as a single edit.
+        
+        Each operation is a list or tuple whose first element is the name of
+        an action (one of ACTIONS) and whose other elements are the arguments
+        of that action.  For example
+            
+            [('monochromify',True),('vignette',),('invert',)]
+        
+        is the same as calling monochromify(True), vignette() and invert() in
+        that order.  But a pipeline is one edit, so it needs one call to
+        increment (and one version in the history) instead of one per action.
+        
+        In addition, neighboring per-pixel actions (invert, contrast and
+        monochromify) are fused, so they take a single pass over the image.
+        Neighboring channel actions (invert and contrast) fuse into a single 
+        set of lookup tables.  Neighboring geometric actions are combined 
+        into one transform (see transform), even with per-pixel actions 
+        between them.  With the 'numpy' backend, the whole pipeline 
+        works on one array, and the image is only written once at the end.
+        
+        If an action fails, the current image is restored to what it was 
+        before the pipeline, and the error is raised again.
+        
+        Parameter operations: The actions to apply, in order
+        Precondition: operations is a list or tuple of operations as above
+        """
+        assert type(operations) in [list,tuple], repr(operations) + " is not a list"
+        for action in operations:
+            assert self._isAction(action), repr(action) + " is not a valid action"
+        if self._defer(*operations):
+            return
+        
+        current = self.getCurrent()
+        backup  = current.copy()
+        try:
+            if self._backend == 'numpy':
+                self._apply(self._pipelineNumpy,operations)
+                return
+            
+            # Per-pixel stages and geometric transforms commute
+            stages = []
+            move = _IDENTITY
+            for action in operations:
+                stage = self._getStage(action)
+                if action[0] in _TRANSFORMS:
+                    move = _compose_transforms(move,_TRANSFORMS[action[0]])
+                elif stage is None:
+                    self._mapStages(stages)
+                    self._transform(move)
+                    stages = []
+                    move = _IDENTITY
+                    getattr(self,action[0])(*action[1:])
+                else:
+                    stages.append(stage)
+            self._mapStages(stages)
+            self._transform(move)
+        except:
+            if current.getWidth() != backup.getWidth():
+                current.setWidth(backup.getWidth())
+            current.setBuffer(backup.getView())
+            raise
+    
+    def transform(self, names):
+        """
+        Applies a sequence of geometric actions to the current image at once.
+        
+        The names are geometric actions ('transpose', 'reflectHori', 
+        'reflectVert', 'rotateRight' or 'rotateLeft'), applied in order.  The 
+        sequence is first combined into a single transform.  For example, four
+        right rotations do nothing at all, and a transpose followed by a 
+        horizontal reflection is a single right rotation.  The combined 
+        transform is then done in one pass over the image.
+        
+        The pass moves whole rows (or whole columns, if the transform 
+        transposes) at once with slices, instead of one pixel at a time.
+        
+        Parameter names: The geometric actions to apply, in order
+        Precondition: names is a list or tuple of the names above
+        """
+        assert type(names) in [list,tuple], repr(names) + " is not a list"
+        move = _IDENTITY
+        for name in names:
+            assert name in _TRANSFORMS, repr(name) + " is not a geometric action"
+            move = _compose_transforms(move,_TRANSFORMS[name])
+        if self._defer(*[(name,) for name in names]):
+            return
+        
+        if self._backend == 'numpy':
+            if move != _IDENTITY:
+                self._apply(self._transformNumpy,move)
+            return
+        self._transform(move)
+    
+    def coalesce(self, first, second):
+        """
+        Returns a single action equivalent to first then second, if simple.
+        
+        Actions are lists (or tuples) as in pipeline.  Geometric actions (and
+        the action 'transform') coalesce into one 'transform' action, so any
+        number of rotations and reflections in a row are done in one pass.  
+        If the two actions do not coalesce, this method returns None.
+        
+        This method does not change the image.  It lets a queue of actions 
+        (see a6worker) merge actions that are waiting to run.
+        
+        Parameter first: The first action
+        Precondition: first is a non-empty list or tuple, starting with a string
+        
+        Parameter second: The second action
+        Precondition: second is a non-empty list or tuple, starting with a string
+        """
+        names = []
+        for action in [first,second]:
+            if action[0] in _TRANSFORMS and len(action) == 1:
+                names.append(action[0])
+            elif action[0] == 'transform' and len(action) == 2:
+                names.extend(action[1])
+            else:
+                return None
+        return ['transform',names]
+    
+    def preview(self, proxy, *action):
+        """
+        Returns the result of an action on a low-resolution proxy image.
+        
+        The proxy is usually from getProxy, or an earlier preview.  It is not 
+        changed, and neither is the current image.  The arguments that are
+        sizes in pixels (the step of pixellate and the radius of blur, also 
+        inside a pipeline) are scaled down by the ratio of the sizes of the 
+        current image and the proxy.  So the preview looks like the result 
+        at full size, only smaller.
+        
+        Parameter proxy: The low-resolution image
+        Precondition: proxy is an Image object
+        
+        Parameter action: The method name followed by its arguments
+        Precondition: action is a valid pipeline operation, or 'pipeline' or
+        'transform' followed by a valid argument
+        """
+        assert isinstance(proxy,a6image.Image), repr(proxy)+' is not an image'
+        factor = math.sqrt(len(self._current)/len(proxy))
+        if action[0] == 'pipeline':
+            action = ('pipeline',[self._scaleAction(item,factor) for item in action[1]])
+        else:
+            action = self._scaleAction(action,factor)
+        editor = Filter(proxy,self._backend)
+        getattr(editor,action[0])(*action[1:])
+        return editor.getCurrent()
+    
+    def stream(self, image, *action):
+        """
+        Applies an action to a tiled image, one band of rows at a time.
+        
+        The tiled image (see TiledImage in a6image) is changed in place, and
+        it does not need to fit in memory.  Each band is about one tile (for
+        pixellate, a whole number of blocks), so only a few tiles are ever in
+        memory at once.  The result is the same as the action on an Image.
+        Only the actions where each band can be done on its own may be 
+        streamed: invert, monochromify, contrast, vignette and pixellate.
+        
+        The tiled image is not part of the edit history, and the current 
+        image of this filter does not change.  The progress is reported to 
+        the monitor (if any) after each band, as in the long filters.  If it 
+        cancels, the bands done so far stay done.
+        
+        Parameter image: The image to change
+        Precondition: image is a TiledImage object
+        
+        Parameter action: The method name followed by its arguments
+        Precondition: action is a valid pipeline operation, for one of the 
+        actions above
+        """
+        assert isinstance(image,a6image.TiledImage), repr(image)+' is not a tiled image'
+        assert self._isAction(action), repr(action) + " is not a valid action"
+        assert action[0] in _STREAMED, repr(action[0]) + " cannot be streamed"
+        height = image.getHeight()
+        width  = image.getWidth()
+        rows = image.getTileRows()
+        if action[0] == 'pixellate':
+            rows = -(-rows//action[1])*action[1]
+        for top in range(0,height,rows):
+            count = min(rows,height-top)
+            image.setRows(top,self._streamBand(image.getRows(top,count),width,action,top,height))
+            self._progress((top+count)/height)
+    
+    def mapChannels(self, red, green=None, blue=None):
+        """
+        Applies a function to every color value of the current image.
+        
+        Each function takes a color value (an int in 0..255) and returns the
+        new color value.  The function red is applied to the red values, and
+        so on.  If green or blue is None, the red function is used instead.
+        
+        Each function is called only 256 times, to make a lookup table.  The
+        image is then converted with the tables in a single pass over its 
+        bytes, which is fast no matter how big the image is.
+        
+        Parameter red: The function for the red values
+        Precondition: red is a function that takes an int in 0..255 and returns
+        an int in 0..255
+        
+        Parameter green: The function for the green values
+        Precondition: green is None or a function like red
+        
+        Parameter blue: The function for the blue values
+        Precondition: blue is None or a function like red
+        """
+        red   = _channel_table(red)
+        green = red if green is None else _channel_table(green)
+        blue  = red if blue is None else _channel_table(blue)
+        self._mapTables(red,green,blue)
+    
+    def mapPixels(self, func):
+        """
+        Applies a function to every pixel of the current image.
+        
+        The function takes a pixel (a 3-element tuple of ints in 0..255) and
+        returns the new pixel.  Unlike mapChannels, the new color values may 
+        depend on all three old color values (e.g. for greyscale).
+        
+        The function is called only once for each distinct color in the image.
+        The results are remembered in a lookup table, and the image is then
+        converted in a single pass.
+        
+        Parameter func: The function to apply
+        Precondition: func is a function that takes a pixel and returns a pixel
+        """
+        current = self.getCurrent()
+        table = _ColorTable(func)
+        view  = current.getView()
+        parts = []
+        for start, stop in self._getChunks():
+            chunk  = view[start:stop]
+            pixels = zip(chunk[0::3],chunk[1::3],chunk[2::3])
+            parts.append(b''.join(map(table.__getitem__,pixels)))
+            self._progress(stop/len(view))
+        current.setBuffer(b''.join(parts))
+    
+    def blur(self, radius):
+        """
+        Blurs the current image with a box blur.
+        
+        Each pixel is replaced by the average of the colors in the square of
+        pixels within radius rows and radius columns of it.  Near the edges,
+        the square stops at the edge of the image and the average is taken
+        over the pixels that remain.  As with pixellate, the final color 
+        values are converted to int, but not rounded.
+        
+        Parameter radius: The radius of the blur square
+        Precondition: radius is an int >= 0
+        """
+        assert type(radius) == int and radius >= 0, repr(radius) + " is not a valid radius"
+        if self._defer(('blur',radius)):
+            return
+        if self._backend == 'numpy':
+            self._apply(self._blurNumpy,radius)
+            return
+        
+        current = self.getCurrent()
+        height = current.getHeight()
+        width  = current.getWidth()
+        sums = a6image.SummedArea(current)
+        for row in range(height):      # Loop over the rows
+            top = max(0,row-radius)
+            bot = min(height,row+radius+1)
+            line = bytearray()
+            for col in range(width):   # Loop over the columnns
+                left = max(0,col-radius)
+                rght = min(width,col+radius+1)
+                mean = sums.getMean(top,left,bot-top,rght-left)
+                line.extend((int(mean[0]),int(mean[1]),int(mean[2])))
+            current.setRow(row,line)
+            self._progress((row+1)/height)
+    
     # HELPER METHODS
+    @classmethod
+    def _isAction(cls, action):
+        """
+        Returns True if action is a valid pipeline operation (see pipeline)
+        
+        This checks the name of the action and the preconditions on its 
+        arguments, since the 'numpy' backend does not call the action itself.
+        It is a class method, so operations can be checked with no image.
+        
+        Parameter action: The value to check
+        Precondition: NONE (action can be any value)
+        """
+        if type(action) not in [list,tuple] or len(action) == 0:
+            return False
+        name = action[0]
+        args = action[1:]
+        if not name in cls.ACTIONS:
+            return False
+        elif name == 'monochromify':
+            return len(args) == 1 and type(args[0]) == bool
+        elif name == 'pixellate':
+            return len(args) == 1 and type(args[0]) == int and args[0] > 0
+        elif name == 'blur':
+            return len(args) == 1 and type(args[0]) == int and args[0] >= 0
+        elif name == 'contrast':
+            return len(args) == 1 and type(args[0]) in [int,float] and args[0] >= 0
+        return len(args) == 0
+    
+    def _getStage(self, action):
+        """
+        Returns the per-pixel stage of action, or None if it has none.
+        
+        A stage is either a tuple of three lookup tables (red, green, blue) or
+        a function on pixels (see mapPixels).  Only per-pixel actions, where
+        each new pixel depends on the old pixel alone, have a stage.
+        
+        Parameter action: The action to convert
+        Precondition: action is a valid pipeline operation (see pipeline)
+        """
+        name = action[0]
+        if name == 'invert':
+            return (_channel_table(_complement),)*3
+        elif name == 'contrast':
+            return (_channel_table(_contrasting(*action[1:])),)*3
+        elif name == 'monochromify':
+            assert len(action) == 2 and type(action[1]) == bool, repr(action) + " is not a valid action"
+            return _sepia if action[1] else _greyscale
+        return None
+    
+    def _mapStages(self, stages):
+        """
+        Applies the given per-pixel stages to the current image in one pass.
+        
+        If every stage is a tuple of lookup tables, the tables are composed
+        first.  Otherwise the stages are composed into one function on pixels.
+        
+        Parameter stages: The stages to apply
+        Precondition: stages is a (possibly empty) list of stages (see _getStage)
+        """
+        if len(stages) == 0:
+            return
+        elif all(type(stage) == tuple for stage in stages):
+            tables = stages[0]
+            for stage in stages[1:]:
+                tables = _compose_tables(tables,stage)
+            self._mapTables(*tables)
+        else:
+            self.mapPixels(_compose_stages(stages))
+    
+    def _mapTables(self, red, green, blue):
+        """
+        Converts every color value of the current image with lookup tables.
+        
+        Parameter red: The lookup table for the red values
+        Precondition: red is a bytes object of length 256
+        
+        Parameter green: The lookup table for the green values
+        Precondition: green is a bytes object of length 256
+        
+        Parameter blue: The lookup table for the blue values
+        Precondition: blue is a bytes object of length 256
+        """
+        current = self.getCurrent()
+        view = current.getView()
+        if red == green == blue:
+            current.setBuffer(view.tobytes().translate(red))
+        else:
+            data = bytearray(view)
+            data[0::3] = data[0::3].translate(red)
+            data[1::3] = data[1::3].translate(green)
+            data[2::3] = data[2::3].translate(blue)
+            current.setBuffer(data)
+    
+    def _defer(self, *operations):
+        """
+        Returns True if the operations were recorded instead of done.
+        
+        In lazy mode (see setLazy), this adds the operations to the deferred 
+        ones and simplifies them all.  Otherwise, it does nothing.
+        
+        Parameter operations: The operations to record
+        Precondition: each element of operations is a valid pipeline operation
+        """
+        if not self._lazy:
+            return False
+        self._deferred = _simplify(self._deferred+list(operations))
+        return True
+    
+    def _scaleAction(self, action, factor):
+        """
+        Returns action with its sizes in pixels divided by factor (see preview)
+        
+        Parameter action: The action to scale
+        Precondition: action is a non-empty list or tuple, starting with a string
+        
+        Parameter factor: The factor to divide by
+        Precondition: factor is a float >= 1
+        """
+        if action[0] == 'pixellate' and len(action) == 2:
+            return ('pixellate',max(1,round(action[1]/factor)))
+        elif action[0] == 'blur' and len(action) == 2:
+            return ('blur',round(action[1]/factor))
+        return tuple(action)
+    
+    def _streamBand(self, data, width, action, top, height):
+        """
+        Returns the packed pixels of a band after an action (see stream)
+        
+        Parameter data: The packed pixels of the band
+        Precondition: data is a bytes object for a whole number of rows
+        
+        Parameter width: The image width
+        Precondition: width is an int > 0
+        
+        Parameter action: The action to apply
+        Precondition: action is a valid pipeline operation, that can be streamed
+        
+        Parameter top: The image row of the first row of the band
+        Precondition: top is an int >= 0
+        
+        Parameter height: The height of the whole image
+        Precondition: height is an int > top
+        """
+        rows = len(data)//(3*width)
+        if action[0] == 'vignette':
+            # The mask of the whole image might not fit in memory
+            if self._backend == 'numpy':
+                pixels = numpy.frombuffer(data,dtype=numpy.uint8).reshape(rows,width,3)
+                mask = self._vignetteMaskNumpy(height,width,top,rows)
+                return (pixels*mask).astype(numpy.uint8).tobytes()
+            return _darken(data,self._vignetteMask(height,width,top,rows))
+        
+        editor = Filter(a6image.Image(bytearray(data),width),self._backend)
+        getattr(editor,action[0])(*action[1:])
+        return editor.getCurrent().getView()
+    
+    def _getChunks(self):
+        """
+        Returns the chunks of the packed data of the current image.
+        
+        Each chunk is a pair (start, stop) of byte positions.  The chunks are
+        whole rows, about CHUNK_PIXELS pixels each, in order.
+        """
+        current = self.getCurrent()
+        size = 3*current.getWidth()*max(1,self.CHUNK_PIXELS//current.getWidth())
+        total = 3*len(current)
+        return [(start,min(total,start+size)) for start in range(0,total,size)]
+    
+    def _transform(self, move):
+        """
+        Applies a geometric transform to the current image in one pass.
+        
+        Without a transpose, the rows are moved whole.  Reversing the columns
+        is done by reversing all of the bytes (which also reverses the rows,
+        and the color values in each pixel) and putting the colors back.
+        
+        With a transpose, each new row is a column of the old image.  Each 
+        color value of a column is a single (possibly backwards) slice of the 
+        old bytes, so a new row takes three slices.
+        
+        Parameter move: The geometric transform
+        Precondition: move is a transform (a tuple of three bools)
+        """
+        if move == _IDENTITY:
+            return
+        
+        swap, fliprows, flipcols = move
+        current = self.getCurrent()
+        height  = current.getHeight()
+        width   = current.getWidth()
+        source  = current.getView().tobytes()
+        
+        if swap:
+            size = 3*height
+            data = bytearray(len(source))
+            for row in range(width):
+                col = width-1-row if fliprows else row
+                for k in range(3):
+                    if flipcols:
+                        column = source[3*((height-1)*width+col)+k::-3*width]
+                    else:
+                        column = source[3*col+k::3*width]
+                    data[row*size+k:(row+1)*size:3] = column
+            current.setWidth(height)
+            current.setBuffer(data)
+            return
+        
+        size = 3*width
+        data = source
+        if flipcols:
+            data = bytearray(source[::-1])
+            data[0::3], data[2::3] = data[2::3], data[0::3]
+            fliprows = not fliprows
+        if fliprows:
+            data = b''.join(data[row*size:(row+1)*size] for row in range(height-1,-1,-1))
+        current.setBuffer(data)
+    
+    def _vignetteMask(self, height, width, top=0, rows=None):
+        """
+        Returns the vignette darkening factors for an image of the given size.
+        
+        The factors are in an array of floats with one factor for every pixel
+        (see _darken).  They may be for just the band of rows top..top+rows-1 
+        of the image.
+        
+        Parameter height: The image height
+        Precondition: height is an int > 0
+        
+        Parameter width: The image width
+        Precondition: width is an int > 0
+        
+        Parameter top: The first row of the band
+        Precondition: top is an int in 0..height-1
+        
+        Parameter rows: The number of rows in the band
+        Precondition: rows is None (for every row from top) or an int > 0 
+        with top+rows <= height
+        """
+        rows = height-top if rows is None else rows
+        hfD  = math.sqrt(((0-(height/2))**2)+((0-(width/2))**2))
+        mask = array('d')
+        for row in range(top,top+rows):      # Loop over the rows
+            for cl in range(width):    # Loop over the columnns
+                d = math.sqrt(((row-(height/2))**2)+((cl-(width/2))**2))
+                darken = 1.0 - ((d/hfD)**2)
+                mask.append(darken)
+        return mask
+    
     def _drawHBar(self, row, pixel):
         """
         Draws a horizontal bar on the current image at the given row.
@@ -310,10 +1558,7 @@ class Filter(a6editor.Editor):
         assert (0<=row and row+2<current.getHeight()), repr(row)+"is not a valid row"
         assert a6image._is_pixel(pixel) == True, repr(pixel) + " is not a pixel"
 
-        for col in range(current.getWidth()):
-            current.setPixel(row,   col, pixel)
-            current.setPixel(row+1, col, pixel)
-            current.setPixel(row+2, col, pixel)
+        current.fillRect(row,0,3,current.getWidth(),pixel)
 
     def _drawVBar(self, col, pixel):
         """
@@ -335,16 +1580,20 @@ class Filter(a6editor.Editor):
         assert (0<=col and col+3<current.getWidth()), repr(col)+" is not a valid col"
         assert a6image._is_pixel(pixel) == True, repr(pixel) + " is not a pixel"
 
-        for row in range(current.getHeight()):
-            current.setPixel(row, col, pixel)
-            current.setPixel(row, col+1, pixel)
-            current.setPixel(row, col+2, pixel)
-            current.setPixel(row, col+3, pixel)
+        current.fillRect(0,col,current.getHeight(),4,pixel)
 
-    def _avging(self, row, col, step):
+    def _avging(self, sums, row, col, step):
         """
         Returns the a tuple of the average rgb values for a given step, starting at coordinate row, col
         
+        The block is step x step pixels, unless it reaches the edge of the 
+        image.  In that case, the block stops at the edge and the average is
+        taken over the pixels that remain.  The average is computed in 
+        constant time from the summed-area table of the current image.
+        
+        Parameter sums: The summed-area table of the current image
+        Precondition: sums is a SummedArea object for the current image
+        
         Parameter step: The number of pixels in a pixellated block
         Precondition: step is an int > 0
 
@@ -359,14 +1608,388 @@ class Filter(a6editor.Editor):
         assert type(step) == int and step > 0, repr(step) + " is not a valid step"
         assert type(col) == int and (0<=col and col<current.getWidth())
         assert type(row) == int and (0<=row and row<current.getHeight())
-        r = 0
-        g = 0
-        b = 0
-        for i in range(step):
-            for j in range(step):
-                pixel = current.getPixel(row+i,col+j)
-                r += pixel[0]
-                g += pixel[1]
-                b += pixel[2]
-        avgFactor = step*step        
-        return (int(r/avgFactor),int(g/avgFactor),int(b/avgFactor))
\ No newline at end of file
+        height = min(step,current.getHeight()-row)
+        width  = min(step,current.getWidth()-col)
+        mean = sums.getMean(row,col,height,width)
+        return (int(mean[0]),int(mean[1]),int(mean[2]))
+    
+    # NUMPY BACKEND
+    # Each of these methods takes the current image as a height x width x 3 
+    # array of uint8 (plus the filter arguments) and returns the new image as
+    # an array of the same kind.  The result may have a different shape.
+    def _apply(self, method, *args):
+        """
+        Applies a NumPy backend method to the current image.
+        
+        Parameter method: The backend method to apply
+        Precondition: method is one of the NumPy backend methods below
+        
+        Parameter args: The remaining arguments to method
+        Precondition: args are valid arguments for method
+        """
+        current = self.getCurrent()
+        if (self._processes > 1 and method.__name__ in _TILED and 
+            len(current) >= self.MIN_TILED):
+            self._applyTiled(method.__name__,*args)
+            return
+        elif not self._monitor is None and method.__name__ in _TILED:
+            self._applyChunked(method.__name__,*args)
+            return
+        
+        pixels = numpy.frombuffer(current.getView(),dtype=numpy.uint8)
+        pixels = pixels.reshape(current.getHeight(),current.getWidth(),3)
+        result = method(pixels,*args)
+        if result.shape[1] != current.getWidth():
+            current.setWidth(result.shape[1])
+        current.setBuffer(numpy.ascontiguousarray(result).tobytes())
+    
+    def _applyTiled(self, name, *args):
+        """
+        Applies a NumPy backend method to the current image in bands.
+        
+        The bands are filtered by the process pool (see setProcesses).  There
+        are twice as many bands as processes, to keep all of them busy.
+        
+        Parameter name: The name of the backend method to apply
+        Precondition: name is one of the names in _TILED
+        
+        Parameter args: The remaining arguments to the method
+        Precondition: args are valid arguments for the method
+        """
+        current = self.getCurrent()
+        height  = current.getHeight()
+        width   = current.getWidth()
+        size = 3*len(current)
+        
+        rows, halo = _band_rows(name,args,-(-height//(2*self._processes)))
+        
+        # The processes share the cached vignette mask, instead of each one 
+        # computing (and caching) the whole mask for itself
+        darken = self._getVignetteMask(height,width) if name == '_vignetteNumpy' else None
+        
+        pool = _get_pool(self._processes)
+        source = shared_memory.SharedMemory(create=True,size=size)
+        target = shared_memory.SharedMemory(create=True,size=size)
+        mask = None
+        futures = []
+        try:
+            source.buf[:size] = current.getView()
+            if not darken is None:
+                mask = shared_memory.SharedMemory(create=True,size=darken.nbytes)
+                mask.buf[:darken.nbytes] = darken.data.cast('B')
+                args = (mask.name,)
+            futures = [pool.submit(_filter_tile,source.name,target.name,height,width,
+                                   name,args,start,min(height,start+rows),halo)
+                       for start in range(0,height,rows)]
+            for done, future in enumerate(as_completed(futures)):
+                future.result()
+                self._progress((done+1)/len(futures))
+            current.setBuffer(target.buf[:size])
+        finally:
+            # The processes must be done with the blocks before they go
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            source.close()
+            source.unlink()
+            target.close()
+            target.unlink()
+            if not mask is None:
+                mask.close()
+                mask.unlink()
+    
+    def _applyChunked(self, name, *args):
+        """
+        Applies a NumPy backend method to the current image in row chunks.
+        
+        The result is the same as applying the method all at once, but the 
+        progress is reported after each chunk (see CHUNK_PIXELS), and the 
+        method can be cancelled between chunks.  The image is only changed
+        once every chunk is done.
+        
+        Parameter name: The name of the backend method to apply
+        Precondition: name is one of the names in _TILED
+        
+        Parameter args: The remaining arguments to the method
+        Precondition: args are valid arguments for the method
+        """
+        current = self.getCurrent()
+        height  = current.getHeight()
+        width   = current.getWidth()
+        pixels  = numpy.frombuffer(current.getView(),dtype=numpy.uint8)
+        pixels  = pixels.reshape(height,width,3)
+        
+        rows, halo = _band_rows(name,args,max(1,self.CHUNK_PIXELS//width))
+        if name == '_vignetteNumpy':
+            # Every chunk is a slice of the one cached mask (if it fits)
+            darken = self._getVignetteMask(height,width)
+            args = () if darken is None else (darken,)
+        result = numpy.empty_like(pixels)
+        for start in range(0,height,rows):
+            stop = min(height,start+rows)
+            result[start:stop] = _filter_band(self,name,pixels,args,start,stop,halo)
+            self._progress(stop/height)
+        current.setBuffer(result.tobytes())
+    
+    def _pipelineNumpy(self, pixels, operations):
+        """
+        Returns the pixels after every operation (see pipeline)
+        
+        Neighboring channel actions are fused into one set of lookup tables,
+        and neighboring geometric actions into one transform.  Per-pixel
+        actions commute with geometric ones, so the transform can wait.
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter operations: The actions to apply, in order
+        Precondition: operations is a list or tuple of valid operations
+        """
+        tables = None
+        move = _IDENTITY
+        for action in operations:
+            stage = self._getStage(action)
+            if action[0] in _TRANSFORMS:
+                move = _compose_transforms(move,_TRANSFORMS[action[0]])
+                continue
+            elif type(stage) == tuple:
+                tables = stage if tables is None else _compose_tables(tables,stage)
+                continue
+            if not tables is None:
+                pixels = self._mapNumpy(pixels,tables)
+                tables = None
+            if stage is None:
+                pixels = self._transformNumpy(pixels,move)
+                move = _IDENTITY
+            pixels = getattr(self,'_'+action[0]+'Numpy')(pixels,*action[1:])
+        if not tables is None:
+            pixels = self._mapNumpy(pixels,tables)
+        return self._transformNumpy(pixels,move)
+    
+    def _mapNumpy(self, pixels, tables):
+        """
+        Returns the pixels converted by lookup tables (see mapChannels)
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter tables: The lookup tables
+        Precondition: tables is a tuple of three lookup tables (red, green, blue)
+        """
+        result = numpy.empty_like(pixels)
+        for k in range(3):
+            table = numpy.frombuffer(tables[k],dtype=numpy.uint8)
+            result[...,k] = table[pixels[...,k]]
+        return result
+    
+    def _invertNumpy(self, pixels):
+        """
+        Returns the inverted pixels (see invert)
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        """
+        return 255-pixels
+    
+    def _transformNumpy(self, pixels, move):
+        """
+        Returns the pixels moved by a geometric transform (see transform)
+        
+        The result is a view of pixels, so nothing is copied until _apply
+        makes it contiguous.
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter move: The geometric transform
+        Precondition: move is a transform (a tuple of three bools)
+        """
+        swap, fliprows, flipcols = move
+        if swap:
+            pixels = pixels.transpose(1,0,2)
+        if fliprows:
+            pixels = pixels[::-1]
+        if flipcols:
+            pixels = pixels[:,::-1]
+        return pixels
+    
+    def _monochromifyNumpy(self, pixels, sepia):
+        """
+        Returns the pixels in monochrome (see monochromify)
+        
+        The brightness is computed in the same order as the Python backend,
+        so the floating point results (and hence the pixels) are identical.
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter sepia: Whether to use sepia tone instead of greyscale.
+        Precondition: sepia is a bool
+        """
+        bness = 0.3*pixels[:,:,0] + 0.6*pixels[:,:,1] + 0.1*pixels[:,:,2]
+        if sepia:
+            result = numpy.stack((bness,0.6*bness,0.4*bness),axis=2)
+        else:
+            result = numpy.stack((bness,bness,bness),axis=2)
+        return result.astype(numpy.uint8)
+    
+    def _jailNumpy(self, pixels):
+        """
+        Returns the pixels with jail bars (see jail)
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        """
+        result = pixels.copy()
+        height, width = result.shape[:2]
+        red = (255,0,0)
+        
+        result[:3] = red
+        result[height-3:] = red
+        result[:,:4] = red
+        result[:,width-4:] = red
+        n = (width - 8) // 50
+        spacing = (width-(4*(n+2)))/(n+1)
+        for i in range(n):
+            col = int((4*(i+1))+(spacing*(i+1)))
+            result[:,col:col+4] = red
+        return result
+    
+    def _vignetteNumpy(self, pixels, top=0, height=None, darken=None):
+        """
+        Returns the vignetted pixels (see vignette)
+        
+        The darkening factor is computed in the same order as the Python 
+        backend, so the floating point results (and hence the pixels) are 
+        identical.
+        
+        The pixels may be a band of rows of a taller image.  Then top is the
+        first row of the band, and height is the height of the whole image.
+        The factors are the rows of the mask for the whole image, which is 
+        given as darken, or else taken from the cache MASKS (see 
+        _getVignetteMask).  If that mask is too large for the cache, only the
+        factors for the band are computed.
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a band x width x 3 array of uint8
+        
+        Parameter top: The image row of the first row of pixels
+        Precondition: top is an int >= 0
+        
+        Parameter height: The height of the whole image
+        Precondition: height is None (for the height of pixels) or an int 
+        >= top + the height of pixels
+        
+        Parameter darken: The mask of the whole image
+        Precondition: darken is None or a height x width x 1 array of float64
+        (see _vignetteMaskNumpy)
+        """
+        band, width = pixels.shape[:2]
+        height = band if height is None else height
+        if darken is None:
+            darken = self._getVignetteMask(height,width)
+        if darken is None:
+            darken = self._vignetteMaskNumpy(height,width,top,band)
+        else:
+            darken = darken[top:top+band]
+        return (pixels*darken).astype(numpy.uint8)
+    
+    def _getVignetteMask(self, height, width):
+        """
+        Returns the NumPy vignette mask for the whole image from MASKS.
+        
+        The mask is computed if it is not cached.  If it is too large to be
+        cached, the result is None, so that the mask is computed one band at
+        a time instead.
+        
+        Parameter height: The image height
+        Precondition: height is an int > 0
+        
+        Parameter width: The image width
+        Precondition: width is an int > 0
+        """
+        if 8*height*width > self.MASKS.getCapacity():
+            return None
+        return self.MASKS.get(('numpy',height,width),lambda: self._vignetteMaskNumpy(height,width))
+    
+    def _vignetteMaskNumpy(self, height, width, top=0, rows=None):
+        """
+        Returns the vignette darkening factors for an image of the given size.
+        
+        The factors are a read-only rows x width x 1 array of float64, for 
+        the band of rows top..top+rows-1 (by default, the whole image).  They
+        are not float32, as that would change the pixels (see vignette).
+        
+        Parameter height: The image height
+        Precondition: height is an int > 0
+        
+        Parameter width: The image width
+        Precondition: width is an int > 0
+        
+        Parameter top: The first row of the band
+        Precondition: top is an int in 0..height-1
+        
+        Parameter rows: The number of rows in the band
+        Precondition: rows is None (for every row from top) or an int > 0 
+        with top+rows <= height
+        """
+        rows = height-top if rows is None else rows
+        rows = numpy.arange(top,top+rows).reshape(rows,1)
+        cols = numpy.arange(width).reshape(1,width)
+        d = numpy.sqrt(((rows-(height/2))**2)+((cols-(width/2))**2))
+        hfD=math.sqrt(((0-(height/2))**2)+((0-(width/2))**2))
+        darken = 1.0 - ((d/hfD)**2)
+        darken = darken[:,:,numpy.newaxis]
+        darken.flags.writeable = False
+        return darken
+    
+    def _pixellateNumpy(self, pixels, step):
+        """
+        Returns the pixellated pixels (see pixellate)
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter step: The number of pixels in a pixellated block
+        Precondition: step is an int > 0
+        """
+        height, width = pixels.shape[:2]
+        rows = numpy.arange(0,height,step)
+        cols = numpy.arange(0,width,step)
+        sums = numpy.add.reduceat(pixels.astype(numpy.int64),rows,axis=0)
+        sums = numpy.add.reduceat(sums,cols,axis=1)
+        
+        # The last block in each direction may be cut short by the edge
+        heights = numpy.diff(numpy.append(rows,height))
+        widths  = numpy.diff(numpy.append(cols,width))
+        counts  = numpy.outer(heights,widths)[:,:,numpy.newaxis]
+        blocks  = (sums/counts).astype(numpy.uint8)
+        return blocks.repeat(heights,axis=0).repeat(widths,axis=1)
+    
+    def _blurNumpy(self, pixels, radius):
+        """
+        Returns the blurred pixels (see blur)
+        
+        Like the Python backend, this uses a summed-area table, computed here
+        with cumulative sums.
+        
+        Parameter pixels: The image pixels
+        Precondition: pixels is a height x width x 3 array of uint8
+        
+        Parameter radius: The radius of the blur square
+        Precondition: radius is an int >= 0
+        """
+        height, width = pixels.shape[:2]
+        sums = numpy.zeros((height+1,width+1,3),dtype=numpy.int64)
+        sums[1:,1:] = pixels.cumsum(axis=0,dtype=numpy.int64).cumsum(axis=1)
+        
+        rows = numpy.arange(height)
+        cols = numpy.arange(width)
+        top  = numpy.maximum(0,rows-radius)
+        bot  = numpy.minimum(height,rows+radius+1)
+        left = numpy.maximum(0,cols-radius)
+        rght = numpy.minimum(width,cols+radius+1)
+        total  = sums[numpy.ix_(bot,rght)]-sums[numpy.ix_(bot,left)]
+        total -= sums[numpy.ix_(top,rght)]-sums[numpy.ix_(top,left)]
+        counts = numpy.outer(bot-top,rght-left)[:,:,numpy.newaxis]
+        return (total/counts).astype(numpy.uint8)
@@ -0,0 +1,343 @@
+"""
+A compact edit history for the imager application.
+
+The original edit history kept a full copy of the image for every edit. For a
+large photo, that is a lot of memory spent on pixels that never changed. The
+class in this module keeps the same history in much less space. It stores one
+copy of the most recent version, and for each older version only the blocks
+that differ from the version after it.  For a buffer-backed image, even the
+copy of the most recent version only pays for the blocks that have changed
+since (see the method copy in class Image).
+
+A history can also be given a memory budget.  Then older versions are
+compressed, and when that is not enough, the oldest versions are written to a
+temporary file.  They are read back automatically when they are needed.
+"""
+import a6image
+import tempfile
+import zlib
+
+
+class _Step(object):
+    """
+    A single step back to an older version in a History.
+
+    A step records the width of the older version and the runs that turn the
+    version after it into the older version (see getChanges in class Image).  The data of all the
+    runs is joined into a single block.  To save memory, this block can be
+    compressed, and the compressed block can be moved to a spill file.
+    """
+    # Attribute width: The width of the older version
+    # Invariant: width is an int > 0
+    #
+    # Attribute layout: The position and length of each run, in order
+    # Invariant: layout is a list of pairs of ints >= 0
+    #
+    # Attribute size: The length of the uncompressed block
+    # Invariant: size is the sum of the run lengths in layout
+    #
+    # Attribute data: The block (compressed or not), or None if it is spilled
+    # Invariant: data is a bytes object or None
+    #
+    # Attribute compressed: Whether the block is compressed
+    # Invariant: compressed is a bool (always True if the block is spilled)
+    #
+    # Attribute offset: The position of the block in the spill file
+    # Invariant: offset is an int >= 0, or None if the block is in memory
+    #
+    # Attribute stored: The length of the block as stored (maybe compressed)
+    # Invariant: stored is an int >= 0
+
+    def __init__(self, width, runs):
+        """
+        Initializes a step from a list of runs.
+
+        Parameter width: The width of the older version
+        Precondition: width is an int > 0
+
+        Parameter runs: The runs back to the older version
+        Precondition: runs is a list of runs (see getChanges in class Image)
+        """
+        self.width  = width
+        self.layout = [(pos,len(data)) for pos, data in runs]
+        self.data   = b''.join(data for pos, data in runs)
+        self.size   = len(self.data)
+        self.stored = self.size
+        self.compressed = False
+        self.offset = None
+
+    def getResident(self):
+        """
+        Returns the number of bytes of this step held in memory
+        """
+        return 0 if self.data is None else self.stored
+
+    def compress(self):
+        """
+        Compresses the block of this step, if it is not compressed already
+        """
+        if not self.compressed:
+            self.data = zlib.compress(self.data,History.COMPRESSION)
+            self.stored = len(self.data)
+            self.compressed = True
+
+    def spill(self, file, offset):
+        """
+        Writes the (compressed) block of this step to file at offset.
+
+        Parameter file: The spill file
+        Precondition: file is a binary file open for reading and writing
+
+        Parameter offset: The position to write the block
+        Precondition: offset is an int >= 0
+        """
+        self.compress()
+        file.seek(offset)
+        file.write(self.data)
+        self.data = None
+        self.offset = offset
+
+    def getRuns(self, file):
+        """
+        Returns the runs of this step, reading them from file if spilled.
+
+        Parameter file: The spill file
+        Precondition: file is the file this step was spilled to (or None if
+        the step was never spilled)
+        """
+        data = self.data
+        if data is None:
+            file.seek(self.offset)
+            data = file.read(self.stored)
+        if self.compressed:
+            data = zlib.decompress(data)
+
+        runs = []
+        start = 0
+        for pos, length in self.layout:
+            runs.append((pos,data[start:start+length]))
+            start += length
+        return runs
+
+
+class History(object):
+    """
+    A class that stores the older versions of an image compactly.
+
+    The history is a stack.  Pushing an image saves a copy of its current
+    pixels as the newest version.  Popping an image restores its pixels (and
+    width) to the newest version and removes that version from the history.
+
+    Only the newest version is stored in full, as a copy of the image. Every
+    older version is stored as a step that turns the version after it back
+    into that older version.  Normally a step holds just the blocks that 
+    differ.
+    If the width differs (e.g. after a rotation), or if more than half of the
+    image changed, the step holds the whole older version instead.  This is a
+    keyframe.  Either way a pop only has to apply one step, so undoing is
+    fast no matter how deep the history is.
+
+    The history may have a maximum length.  When a push would make the 
+    history longer than this, the oldest version is deleted.
+
+    The history may also have a memory budget in bytes.  Then every step but
+    the most recent one is compressed.  If the history still uses more than
+    the budget, the oldest steps are moved to a temporary spill file until it
+    fits.  The newest version always stays in memory, so the budget should be
+    larger than 3 bytes per pixel.
+
+    Attribute COMPRESSION: A CLASS ATTRIBUTE for the zlib compression level
+    Invariant: COMPRESSION is an int in 0..9
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _maximum: The maximum number of versions
+    # Invariant: _maximum is an int >= 0, or None for no maximum
+    #
+    # Attribute _budget: The maximum number of bytes to keep in memory
+    # Invariant: _budget is an int >= 0, or None for no budget
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _newest: The newest version
+    # Invariant: _newest is an Image object, or None if the history is empty
+    #
+    # Attribute _steps: The steps back to each older version, oldest first
+    # Invariant: _steps is a list of _Step objects.  The spilled steps come
+    # before all of the others, in the same order as in the spill file.
+    #
+    # Attribute _file: The spill file
+    # Invariant: _file is a temporary binary file, or None if nothing has been
+    # spilled since the last clear
+    #
+    # Attribute _end: The end of the data in the spill file
+    # Invariant: _end is an int >= 0
+
+    # The zlib level (fast, since history compression happens on every edit)
+    COMPRESSION = 1
+
+    # INITIALIZER
+    def __init__(self, maximum=None, budget=None):
+        """
+        Initializes an empty history.
+
+        Parameter maximum: The maximum number of versions
+        Precondition: maximum is an int >= 0, or None for no maximum
+
+        Parameter budget: The maximum number of bytes to keep in memory
+        Precondition: budget is an int >= 0, or None for no budget
+        """
+        assert maximum is None or (type(maximum) == int and maximum >= 0), repr(maximum)+' is not a valid maximum'
+        assert budget is None or (type(budget) == int and budget >= 0), repr(budget)+' is not a valid budget'
+        self._maximum = maximum
+        self._budget  = budget
+        self._file = None
+        self.clear()
+
+    # OPERATOR OVERLOADING
+    def __len__(self):
+        """
+        Returns the number of versions in this history
+
+        This special method supports the built-in len function.
+        """
+        if self._newest is None:
+            return 0
+        return len(self._steps)+1
+
+    # GETTERS
+    def getStats(self):
+        """
+        Returns a dictionary of memory statistics for this history.
+
+        The dictionary has the following keys:
+            'versions': the number of versions in the history
+            'resident': the number of bytes of pixel data in memory (this
+                        counts the newest version in full)
+            'spilled':  the number of bytes of pixel data in the spill file
+            'ratio':    the compression ratio (uncompressed size divided by 
+                        compressed size) of the compressed steps, or 1.0 if
+                        no steps are compressed
+        """
+        size   = 0
+        stored = 0
+        for step in self._steps:
+            if step.compressed:
+                size   += step.size
+                stored += step.stored
+        return {'versions': len(self),
+                'resident': self._getResident(),
+                'spilled':  sum(step.stored for step in self._steps if step.data is None),
+                'ratio':    size/stored if stored else 1.0}
+
+    # STACK METHODS
+    def push(self, image):
+        """
+        Saves a copy of the pixels of image as the newest version.
+
+        If this makes the history longer than the maximum, the oldest version
+        is deleted.  If it makes the history use more memory than the budget,
+        older versions are compressed or spilled to disk.
+
+        Parameter image: The image to save
+        Precondition: image is an Image object
+        """
+        assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+        if self._maximum == 0:
+            return
+
+        snapshot = image.copy()
+        if not self._newest is None:
+            self._steps.append(self._step(snapshot))
+        self._newest = snapshot
+
+        if not self._maximum is None and len(self) > self._maximum:
+            self._steps.pop(0)
+        self._fit()
+
+    def pop(self, image):
+        """
+        Restores image to the newest version and removes it from the history.
+
+        Parameter image: The image to restore
+        Precondition: image is an Image object with the same number of pixels
+        as the saved versions.  The history is not empty.
+        """
+        assert isinstance(image,a6image.Image), repr(image)+' is not an image'
+        assert len(self) > 0, 'The history is empty'
+        if image.getWidth() != self._newest.getWidth():
+            image.setWidth(self._newest.getWidth())
+        image.setBuffer(self._newest.getView())
+
+        if len(self._steps) == 0:
+            self._newest = None
+            return
+
+        step = self._steps.pop()
+        pixels = bytearray(image.getView())
+        for pos, data in step.getRuns(self._file):
+            pixels[pos:pos+len(data)] = data
+        self._newest = a6image.Image(pixels,step.width)
+
+        # The spill file is a stack too
+        if not step.offset is None:
+            self._end = step.offset
+        if len(self._steps) == 0 or self._steps[0].offset is None:
+            self._end = 0
+        if not self._file is None:
+            self._file.truncate(self._end)
+
+    def clear(self):
+        """
+        Deletes every version in this history.
+        """
+        self._newest = None
+        self._steps  = []
+        self._end    = 0
+        if not self._file is None:
+            self._file.close()
+            self._file = None
+
+    # HELPER METHODS
+    def _step(self, snapshot):
+        """
+        Returns the step from snapshot back to the current newest version.
+
+        Parameter snapshot: The version that will be newest
+        Precondition: snapshot is an Image the same size as _newest
+        """
+        older = self._newest
+        if older.getWidth() == snapshot.getWidth():
+            runs = older.getChanges(snapshot)
+            if 2*sum(len(data) for pos, data in runs) <= 3*len(older):
+                return _Step(older.getWidth(),runs)
+        # Keyframe
+        return _Step(older.getWidth(),[(0,bytes(older.getView()))])
+
+    def _getResident(self):
+        """
+        Returns the number of bytes of pixel data in memory
+        """
+        resident = 0 if self._newest is None else 3*len(self._newest)
+        return resident+sum(step.getResident() for step in self._steps)
+
+    def _fit(self):
+        """
+        Compresses and spills steps until the history fits in the budget.
+
+        The most recent step is only compressed (or spilled) if there is no
+        other way to fit.
+        """
+        if self._budget is None:
+            return
+
+        for step in self._steps[:-1]:
+            step.compress()
+
+        pos = 0
+        while self._getResident() > self._budget and pos < len(self._steps):
+            step = self._steps[pos]
+            if not step.data is None:
+                if self._file is None:
+                    self._file = tempfile.TemporaryFile()
+                step.spill(self._file,self._end)
+                self._end += step.stored
+            pos += 1
@@ -11,6 +11,95 @@ November 16 2020
 """
 from copy import deepcopy
 from copy import copy
+from itertools import accumulate
+from itertools import chain
+from array import array
+from collections import OrderedDict
+import operator
+import weakref
+import mmap
+import struct
+
+# The number of bytes in a block of a pixel buffer (1024 pixels).
+# Copies of buffer-backed images share their blocks until one is written.
+BLOCK_BYTES = 3*1024
+
+# The most dirty rectangles an image keeps before merging them into one.
+MAX_DIRTY = 64
+
+# Whether to check pixel lists (and trusted buffers) the slow, strict way.
+# Set this to True when debugging, to find the first bad pixel.
+STRICT = False
+
+# The raw image format: a header, then the packed (r,g,b) bytes in row-major
+# order.  The header is the magic bytes, the width, height and number of
+# channels (always 3), and the position of the pixels in the file, padded 
+# with zeros up to that position.  The pixels start on a boundary where the
+# operating system can map them (see Image.openMmap).
+RAW_MAGIC  = b'A6RAW\x00\x00\x01'
+RAW_HEADER = struct.Struct('<8sIIIQ')
+
+def is_raw(file):
+    """
+    Returns True if file is an image in the raw format, False otherwise.
+
+    Parameter file: The file to check
+    Precondition: file is a string
+    """
+    try:
+        with open(file,'rb') as handle:
+            return handle.read(len(RAW_MAGIC)) == RAW_MAGIC
+    except OSError:
+        return False
+
+
+def get_raw_size(file):
+    """
+    Returns the size (width, height) of the image in a raw file.
+
+    Only the header of the file is read.
+
+    Parameter file: The raw file
+    Precondition: file is a string naming a raw image file
+    """
+    with open(file,'rb') as handle:
+        width, height, offset = _read_raw_header(handle,file)
+    return (width,height)
+
+
+def _raw_header(width, height):
+    """
+    Returns the header of a raw file for an image of the given size.
+
+    The header is padded with zeros, so the pixels come right after it.
+
+    Parameter width: The image width
+    Precondition: width is an int > 0
+
+    Parameter height: The image height
+    Precondition: height is an int > 0
+    """
+    offset = max(mmap.ALLOCATIONGRANULARITY,RAW_HEADER.size)
+    header = RAW_HEADER.pack(RAW_MAGIC,width,height,3,offset)
+    return header+bytes(offset-len(header))
+
+
+def _read_raw_header(handle, name):
+    """
+    Returns the triple (width, height, offset) from the header of a raw file.
+
+    Parameter handle: The open raw file
+    Precondition: handle is a binary file open for reading, at the start
+
+    Parameter name: The name of the file (for error messages)
+    Precondition: name is a string
+    """
+    header = handle.read(RAW_HEADER.size)
+    assert len(header) == RAW_HEADER.size, repr(name)+' is not a raw image file'
+    magic, width, height, channels, offset = RAW_HEADER.unpack(header)
+    assert magic == RAW_MAGIC and channels == 3, repr(name)+' is not a raw image file'
+    return (width,height,offset)
+
 
 def _is_pixel(item):
     """
@@ -39,11 +128,16 @@ def _is_pixel_list(data):
     A pixel list is a 1-dimensional list of pixels where a pixel is a tuple
     of 3 ints in the range 0..255
 
+    Unless STRICT is True, the whole list is checked in bulk (see 
+    _check_pixels) and not one pixel at a time.  The answer is the same.
+
     Parameter data: The data to check
     Precondition: NONE (data can be anything)
     """
     if type(data) != list:
         return False
+    if not STRICT:
+        return _check_pixels(data)
 
     for j in range(len(data)):
         if _is_pixel(data[j]) == False:
@@ -52,6 +146,45 @@ def _is_pixel_list(data):
     return True
 
 
+def _check_pixels(data):
+    """
+    Returns True if every item of the list data is a pixel, False otherwise.
+
+    This is the bulk version of checking each item with _is_pixel.  Each test
+    is done on the whole list at once by built-in functions, so no Python 
+    code runs per pixel.  For a large list this is many times faster.
+
+    Parameter data: The items to check
+    Precondition: data is a list
+    """
+    if len(data) == 0:
+        return True
+    if set(map(type,data)) != {tuple} or set(map(len,data)) != {3}:
+        return False
+    if set(map(type,chain.from_iterable(data))) != {int}:
+        return False
+    try:
+        bytes(chain.from_iterable(data))    # Fails if any int is not in 0..255
+    except ValueError:
+        return False
+    return True
+
+
+def _is_pixel_buffer(data):
+    """
+    Returns True if data is a pixel buffer, False otherwise.
+
+    A pixel buffer is a non-empty bytearray (or mmap of a file) whose length 
+    is a multiple of 3.  Each consecutive triple of bytes is the (r,g,b) value
+    of one pixel.  Since a byte is always in the range 0..255, there is 
+    nothing else to check.
+
+    Parameter data: The data to check
+    Precondition: NONE (data can be anything)
+    """
+    return type(data) in (bytearray,mmap.mmap) and len(data) > 0 and len(data) % 3 == 0
+
+
 # TASK 1: IMPLEMENT THIS CLASS
 class Image(object):
     """
@@ -79,17 +212,70 @@ class Image(object):
         image.__setitem__(pos, (255,0,0))
 
     These operations are used by the greyscale filters in particular.
+
+    An image can store its pixels in one of two ways.  The original storage
+    is a pixel list, which is simple but costs a tuple per pixel.  The other
+    storage is a pixel buffer (see _is_pixel_buffer), which packs each pixel
+    into 3 bytes.  Both storages support exactly the same methods, so code
+    that uses an image does not need to know which one it has.  The only
+    difference is that a buffer-backed image creates a new tuple each time
+    you read a pixel.
+
+    Copying a buffer-backed image is cheap, because the copy does not copy
+    any pixels.  Instead it shares the buffer of the original (its root).
+    The buffer is divided into blocks of BLOCK_BYTES bytes.  Right before
+    the root writes to a block, it saves the old contents of that block in
+    each of its copies.  So a copy only pays memory for the blocks that have
+    changed since it was made.  If a copy is written to, it makes its own
+    buffer first.  Copying a pixel list shares the pixel tuples, which is
+    safe because tuples cannot change.
+
+    An image also remembers which parts of it have changed (are dirty), as
+    a list of rectangles.  This lets a display update only the pixels that
+    changed since it last showed the image (see getDirty).
+
+    An image can be saved in a simple raw format (see saveRaw), and opened 
+    again with its buffer mapped straight from the file (see openMmap). 
+    Opening then takes no time at all, whatever the size of the image, and 
+    the operating system only reads the parts of the file that are used.
     """
     # IMMUTABLE ATTRIBUTES (Fixed after initialization)
-    # Attribute _data: The underlying list of pixels
-    # Invariant: _data is a non-empty pixel list (see _is_pixel_list)
+    # Attribute _data: The underlying pixels
+    # Invariant: _data is a non-empty pixel list (see _is_pixel_list) or a
+    # pixel buffer (see _is_pixel_buffer)
+    #
+    # Attribute _buffered: Whether _data is a pixel buffer
+    # Invariant: _buffered is a bool
+    #
+    # Attribute _parent: The root image this (buffer-backed) copy shares with
+    # Invariant: _parent is an Image whose _parent is None, or None if this
+    # image does not share another image's buffer.  If _parent is not None,
+    # _data is _parent._data.
+    #
+    # Attribute _saved: The blocks this copy has saved from its root
+    # Invariant: _saved is a dict mapping block numbers to bytes objects of
+    # length at most BLOCK_BYTES (empty if _parent is None)
+    #
+    # Attribute _dependents: The copies that share this image's buffer
+    # Invariant: _dependents is a weakref.WeakSet of Image objects
+    #
+    # Attribute _copied: The blocks already saved in all the dependents
+    # Invariant: _copied is a set of block numbers
+    #
+    # Attribute _shared: Whether any buffer sharing might be going on
+    # Invariant: _shared is a bool, True if _parent or _dependents is not empty
+    #
+    # Attribute _dirty: The rectangles changed since the last clearDirty
+    # Invariant: _dirty is a list of at most MAX_DIRTY rectangles (row, col,
+    # height, width) inside the image.  Every pixel changed since the last
+    # call to clearDirty is in one of them.
     #
     # MUTABLE ATTRIBUTES (Can be changed at any time, via the setters)
     # Attribute _width:  The image width, which is the number of columns
-    # Invariant: _width is an int > 0, _width*_height = len(_data)
+    # Invariant: _width is an int > 0, _width*_height = len(self)
     #
     # Attribute _height:  The image height, which is the number of rows
-    # Invariant: _height is an int > 0, _width*_height = len(_data)
+    # Invariant: _height is an int > 0, _width*_height = len(self)
     #
     # Note that if you change width, you must change height (to satisfy the invariant)
 
@@ -101,10 +287,211 @@ class Image(object):
 
         The image data is a 1-dimensional list of 3-element tuples.  The list
         returned by this method is a copy of the one managed by this object.
+        This is true even if the image is buffer-backed.
         """
+        if self._buffered:
+            data = self.getView()
+            return list(zip(data[0::3],data[1::3],data[2::3]))
         listcopy = self._data.copy()
         return listcopy
 
+    def isBuffered(self):
+        """
+        Returns True if this image is backed by a pixel buffer, False otherwise.
+        """
+        return self._buffered
+
+    def getBuffer(self):
+        """
+        Returns the image data as a packed bytearray.
+
+        The bytearray has 3 bytes (r,g,b) per pixel in row-major order.  If
+        this image is buffer-backed, this is the underlying buffer itself and
+        NOT a copy, so changes to it are changes to the image.  This allows
+        bulk operations on the pixels.  If the image is backed by a pixel
+        list, the result is a newly packed copy of the data.
+
+        Because the buffer might be changed, any buffer sharing with copies
+        of this image ends (and they pay for their own buffers), and the whole
+        image is marked dirty.  If you only want to read the buffer, use 
+        getView instead.
+        """
+        if self._buffered:
+            if self._shared:
+                self._unshare()
+            self._dirty = [(0,0,self._height,self._width)]
+            return self._data
+        result = bytearray(3*len(self._data))
+        result[0::3] = bytes(pixel[0] for pixel in self._data)
+        result[1::3] = bytes(pixel[1] for pixel in self._data)
+        result[2::3] = bytes(pixel[2] for pixel in self._data)
+        return result
+
+    def getView(self):
+        """
+        Returns a read-only memoryview of the image data, packed as bytes.
+
+        The bytes are the same as those of getBuffer.  If this image is
+        buffer-backed (and not a copy with changed blocks), the view is of
+        the underlying buffer, so nothing is copied.  Otherwise the view is
+        of a newly packed copy of the data.
+        """
+        if not self._buffered:
+            return memoryview(self.getBuffer()).toreadonly()
+        if not self._saved:
+            return memoryview(self._data).toreadonly()
+        data = bytearray(self._data)
+        for block, saved in self._saved.items():
+            data[block*BLOCK_BYTES:block*BLOCK_BYTES+len(saved)] = saved
+        return memoryview(data).toreadonly()
+
+    def getRawBuffer(self):
+        """
+        Returns the underlying pixel buffer, or None if there is not one.
+
+        Unlike getView, the result is the writable buffer itself (a bytearray
+        or memory map), for libraries that do not accept read-only buffers.
+        It must only be read.  Unlike getBuffer, buffer sharing is unchanged 
+        and nothing is marked dirty.
+
+        The result is None if the image is backed by a pixel list, or if it 
+        is a copy with changed blocks (so the buffer is not its data), or if 
+        the buffer is read-only anyway.  Then use getView instead.
+        """
+        if not self._buffered or self._saved or memoryview(self._data).readonly:
+            return None
+        return self._data
+
+    def getChanges(self, other):
+        """
+        Returns the runs of bytes where the data of this image and other differ.
+
+        A run is a pair (pos, data), where pos is a position in the packed
+        image data (see getBuffer) and data is the bytes of THIS image
+        starting at pos.  Every changed byte is in some run, though a run may
+        include unchanged bytes too.  So writing the runs into the packed data
+        of other gives the packed data of this image.  The widths of the two
+        images are ignored.
+
+        The images are compared in blocks of BLOCK_BYTES bytes, and adjacent
+        changed blocks are joined into one run.  If the images share a buffer
+        (see copy), only the blocks saved by one of them can differ, so only
+        those blocks are compared.
+
+        Parameter other: The image to compare to
+        Precondition: other is an Image with the same number of pixels
+        """
+        assert isinstance(other,Image), repr(other)+' is not an image'
+        assert len(other) == len(self), repr(other)+' is not the same size'
+        if self._buffered and other._buffered and self._data is other._data:
+            mine   = self._getBlock
+            theirs = other._getBlock
+            blocks = sorted(set(self._saved) | set(other._saved))
+        else:
+            myview = self.getView()
+            theirview = other.getView()
+            mine   = lambda block: myview[block*BLOCK_BYTES:(block+1)*BLOCK_BYTES]
+            theirs = lambda block: theirview[block*BLOCK_BYTES:(block+1)*BLOCK_BYTES]
+            blocks = range((3*len(self)+BLOCK_BYTES-1)//BLOCK_BYTES)
+
+        runs = []
+        last = None
+        for block in blocks:
+            data = mine(block)
+            if data != theirs(block):
+                if last == block-1:
+                    runs[-1][1].append(data)
+                else:
+                    runs.append((block*BLOCK_BYTES,[data]))
+                last = block
+        return [(pos,b''.join(data)) for pos, data in runs]
+
+    def setBuffer(self, buffer):
+        """
+        Sets the image data from the packed bytes in buffer.
+
+        The bytes are copied into this image, whichever storage it uses. The
+        buffer must hold 3 bytes (r,g,b) per pixel, in row-major order for the
+        current width.  This is the inverse of getBuffer.
+
+        If copies of this image share its buffer, only the blocks that really
+        change are saved in the copies.  Similarly, only the rows that really
+        change are marked dirty.
+
+        Parameter buffer: The new image data
+        Precondition: buffer is a bytes-like object of length 3*len(self)
+        """
+        assert len(buffer) == 3*len(self), repr(len(buffer)) + " is not a valid buffer length"
+        if self._buffered:
+            if self._shared and not self._parent is None:
+                self._detach()
+            # Compare slices of the bytearray (memcmp), not of memoryviews
+            view = memoryview(buffer).cast('B')
+            mine = self._data
+            if self._shared:
+                for pos in range(0,len(mine),BLOCK_BYTES):
+                    block = pos//BLOCK_BYTES
+                    if not block in self._copied and mine[pos:pos+BLOCK_BYTES] != view[pos:pos+BLOCK_BYTES]:
+                        self._share(block)
+            if not self._isAllDirty():
+                size = 3*self._width
+                start = None
+                for row in range(self._height+1):
+                    same = row == self._height or mine[row*size:(row+1)*size] == view[row*size:(row+1)*size]
+                    if not same and start is None:
+                        start = row
+                    elif same and not start is None:
+                        self._addDirty(start,0,row-start,self._width)
+                        start = None
+            self._data[:] = buffer
+        else:
+            self._data[:] = zip(buffer[0::3],buffer[1::3],buffer[2::3])
+            self._dirty = [(0,0,self._height,self._width)]
+
+    def getDirty(self):
+        """
+        Returns the list of rectangles changed since the last clearDirty.
+
+        Each rectangle is a tuple (row, col, height, width).  Every pixel that
+        changed is in at least one of the rectangles, but the rectangles may
+        also include pixels that did not change.  A new image, or an image 
+        whose width just changed, is dirty everywhere.
+
+        The list is a copy, so it is safe to keep.
+        """
+        return self._dirty.copy()
+
+    def clearDirty(self):
+        """
+        Marks every pixel of this image as clean (unchanged).
+        """
+        self._dirty = []
+
+    def markDirty(self, row, col, height, width):
+        """
+        Marks the given rectangle of this image as dirty.
+
+        The image methods mark their own changes.  This method is for code
+        that changes the image some other way (e.g. through getBuffer).
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        assert type(height) == int and height > 0 and row+height <= self._height, repr(height) + " is not a valid height"
+        assert type(width) == int and width > 0 and col+width <= self._width, repr(width) + " is not a valid width"
+        self._addDirty(row,col,height,width)
+
     def getWidth(self):
         """
         Returns the image width
@@ -129,10 +516,11 @@ class Image(object):
         Precondition: value is a valid width > 0
         """
         assert type(value) == int and value > 0, repr(value) + " is not a valid width"
-        assert len(self._data) % value == 0, repr(value) + " is not a valid width"
+        assert len(self) % value == 0, repr(value) + " is not a valid width"
         self._width = value
-        if len(self._data) / value != self._height:
-            self.setHeight(int(len(self._data) / value))        
+        if len(self) / value != self._height:
+            self.setHeight(int(len(self) / value))        
+        self._dirty = [(0,0,self._height,self._width)]
 
 
     def getHeight(self):
@@ -159,15 +547,112 @@ class Image(object):
         Precondition: value is a valid height > 0
         """
         assert type(value) == int and value > 0, repr(value) + " is not a valid height"
-        assert len(self._data) % value == 0, repr(value) + " is not a valid height"
+        assert len(self) % value == 0, repr(value) + " is not a valid height"
         self._height = value
-        if len(self._data) / value != self._width:
-            self.setWidth(int(len(self._data) / value))
+        if len(self) / value != self._width:
+            self.setWidth(int(len(self) / value))
+        self._dirty = [(0,0,self._height,self._width)]
+
+    # BUFFER INITIALIZER
+    @classmethod
+    def fromBuffer(cls, data, width, validated=True):
+        """
+        Returns a buffer-backed image with the given packed pixels.
+
+        The data is any bytes-like object with 3 bytes (r,g,b) per pixel, such
+        as the result of tobytes() for a PIL image.  A bytearray is used as 
+        the buffer directly, as in the initializer.  Anything else is copied 
+        into a new bytearray.
+
+        If validated is True, the data is trusted (e.g. it was just decoded by 
+        PIL), and only the preconditions are asserted.  If validated is False, 
+        the data comes from somewhere untrusted, and it is checked in full.
+        Then a ValueError is raised if it is not a valid image.  Since every
+        byte is in 0..255, the check is done in bulk, and is the same speed 
+        for any size.  If STRICT is True, the data is always checked.
+
+        Parameter data: The packed pixels
+        Precondition: data is a non-empty bytes-like object whose length is a
+        multiple of 3 (if validated is True)
+
+        Parameter width: The image width
+        Precondition: width is an int > 0 that evenly divides the number of 
+        pixels (if validated is True)
+
+        Parameter validated: Whether data is known to be valid
+        Precondition: validated is a bool
+        """
+        assert type(validated) == bool, repr(validated)+' is not a bool'
+        if not validated or STRICT:
+            try:
+                size = memoryview(data).nbytes
+            except TypeError:
+                raise ValueError(repr(type(data))+' is not a bytes-like object')
+            if size == 0 or size % 3 != 0:
+                raise ValueError(repr(size)+' is not a valid buffer length')
+            if type(width) != int or width <= 0 or (size//3) % width != 0:
+                raise ValueError(repr(width)+' is not a valid width')
+        buffer = data if type(data) in (bytearray,mmap.mmap) else bytearray(data)
+        return cls(buffer,width)
+
+    # RAW FILES
+    @classmethod
+    def openMmap(cls, file, mode='c'):
+        """
+        Returns an image whose pixel buffer is a memory map of a raw file.
+
+        The file must be in the raw format (see saveRaw).  Nothing is read but
+        the header: the pixels are read from the file by the operating system
+        when they are first used.  Several processes can map the same file, 
+        and they share its pixels in memory until they write to them.
+
+        The mode says what happens when the image is written to:
+            'r': writing is an error (a TypeError)
+            'c': the changes stay in memory, and the file is never changed
+            'w': the changes are written to the file
+        Note that an Editor always edits a copy of its original image, and
+        the copy reads the whole image into memory when first written to.
+
+        Parameter file: The raw file to open
+        Precondition: file is a string naming a raw image file
+
+        Parameter mode: What happens to writes
+        Precondition: mode is one of 'r', 'c' or 'w'
+        """
+        access = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY, 'w': mmap.ACCESS_WRITE}
+        assert mode in access, repr(mode)+' is not a valid mode'
+        with open(file,'r+b' if mode == 'w' else 'rb') as handle:
+            width, height, offset = _read_raw_header(handle,file)
+            size = 3*width*height
+            if offset % mmap.ALLOCATIONGRANULARITY == 0:
+                data = mmap.mmap(handle.fileno(),size,offset=offset,access=access[mode])
+            else:
+                # Written on a system with a finer mapping boundary
+                handle.seek(offset)
+                data = bytearray(handle.read(size))
+            assert len(data) == size, repr(file)+' is not a complete raw image file'
+        return cls(data,width)
+
+    def saveRaw(self, file):
+        """
+        Saves this image to file in the raw format.
+
+        The raw format is a header (see RAW_HEADER) followed by the packed 
+        pixels (see getBuffer), starting on a boundary where they can be 
+        mapped into memory (see openMmap).  Nothing is compressed, so saving 
+        is as fast as the disk.
+
+        Parameter file: The file to write
+        Precondition: file is a string
+        """
+        with open(file,'wb') as handle:
+            handle.write(_raw_header(self._width,self._height))
+            handle.write(self.getView())
 
     # INITIALIZER
     def __init__(self, data, width):
         """
-        Initializes an Image from the given pixel list.
+        Initializes an Image from the given pixel list or pixel buffer.
 
         A pixel list is a 1-dimensional list of pixels where a pixel is a
         tuple of 3 ints in the range 0..255. The pixel list contains the
@@ -175,6 +660,11 @@ class Image(object):
         That happens elsewhere in the application (in code that you did not
         write).
 
+        Alternatively, data may be a pixel buffer: a bytearray with 3 bytes
+        (r,g,b) for each pixel.  This uses a fraction of the memory of a pixel
+        list, and it is the storage to use for large images.  A memory map 
+        (mmap) of the same bytes in a file is also a pixel buffer.
+
         However, in order to be valid, the width  must evenly divide the
         number of pixels in the image. So if the pixel list has 10 pixels, a
         valid width is 1, 2, 5, or 10.
@@ -186,18 +676,26 @@ class Image(object):
         does not copy it. So changes to the image will change the data
         parameter as well.
 
-        Parameter data: The image data as a pixel list
-        Precondition: data is a non-empty pixel list
+        Parameter data: The image data as a pixel list or pixel buffer
+        Precondition: data is a non-empty pixel list or pixel buffer
 
         Parameter width: The image width
         Precondition: width is an int > 0 and evenly divides the length of pixels
         """
-        assert _is_pixel_list(data), repr(data)+" is not a pixel list"
+        buffered = _is_pixel_buffer(data)
+        assert buffered or _is_pixel_list(data), repr(data)+" is not a pixel list"
+        size = len(data)//3 if buffered else len(data)
         assert type(width) == int, repr(width) + " is not a valid width"
-        assert width>0 and len(data) % width==0, repr(width) + " is not a valid width"
+        assert width>0 and size % width==0, repr(width) + " is not a valid width"
         self._data = data
+        self._buffered = buffered
+        self._parent = None
+        self._saved = {}
+        self._dependents = weakref.WeakSet()
+        self._copied = set()
+        self._shared = False
         self._width = width
-        self.setHeight(int(len(self._data)/self._width))
+        self.setHeight(size//width)
 
     # PART B
     # OPERATOR OVERLOADING
@@ -207,6 +705,8 @@ class Image(object):
 
         This special method supports the built-in len function.
         """
+        if self._buffered:
+            return len(self._data)//3
         return len(self._data)
 
     def __getitem__(self, pos):
@@ -226,7 +726,16 @@ class Image(object):
         Precondition: pos is an int and a valid position >= 0 in the pixel list.
         """
         assert type(pos) == int and pos >= 0, repr(pos) + "is not a valid position"
-        assert pos <= len(self._data), repr(pos) + "is not a valid position"
+        assert pos <= len(self), repr(pos) + "is not a valid position"
+        if self._buffered:
+            pos *= 3
+            data = self._data
+            if self._saved:
+                block = pos//BLOCK_BYTES
+                if block in self._saved:
+                    data = self._saved[block]
+                    pos -= block*BLOCK_BYTES
+            return (data[pos],data[pos+1],data[pos+2])
         return self._data[pos]
 
     def __setitem__(self, pos, pixel):
@@ -243,9 +752,17 @@ class Image(object):
         Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
         """
         assert type(pos) == int and pos >= 0, repr(pos) + " is not a valid position"
-        assert pos <= len(self._data), repr(pos) + "is not a valid position"
+        assert pos <= len(self), repr(pos) + "is not a valid position"
         assert _is_pixel(pixel) == True, repr(pixel) + " is not a valid pixel"
-        self._data[pos] = pixel
+        if self._buffered:
+            pos *= 3
+            if self._shared:
+                self._prepare(pos)
+            self._data[pos:pos+3] = bytes(pixel)
+            pos //= 3
+        else:
+            self._data[pos] = pixel
+        self._addDirty(pos//self._width,pos % self._width,1,1)
 
     # PART C
     # TWO-DIMENSIONAL ACCESS METHODS
@@ -266,6 +783,15 @@ class Image(object):
         """
         assert type(row) == int and (row >= 0 and row < self._height)
         assert type(col) == int and (col >= 0 and col < self._width)
+        if self._buffered:
+            pos = 3*((self._width*row)+col)
+            data = self._data
+            if self._saved:
+                block = pos//BLOCK_BYTES
+                if block in self._saved:
+                    data = self._saved[block]
+                    pos -= block*BLOCK_BYTES
+            return (data[pos],data[pos+1],data[pos+2])
         return self._data[(self._width*row)+col]
 
     def setPixel(self, row, col, pixel):
@@ -287,7 +813,126 @@ class Image(object):
         assert type(row) == int and (row >= 0 and row < self._height)
         assert type(col) == int and (col >= 0 and col < self._width)
         assert _is_pixel(pixel) == True, repr(pixel) + " is not a valid pixel"
-        self._data[(self._width*row)+col] = pixel
+        if self._buffered:
+            pos = 3*((self._width*row)+col)
+            if self._shared:
+                self._prepare(pos)
+            self._data[pos:pos+3] = bytes(pixel)
+        else:
+            self._data[(self._width*row)+col] = pixel
+        self._addDirty(row,col,1,1)
+
+    # BULK ACCESS METHODS
+    # These methods move many pixels at once as packed bytes (3 bytes r,g,b
+    # per pixel, as in getBuffer), with slices of the underlying storage.
+    def getRow(self, row):
+        """
+        Returns the pixels of the given row, packed as bytes.
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        return self._getRect(row,0,1,self._width)
+
+    def setRow(self, row, data):
+        """
+        Sets the pixels of the given row from packed bytes.
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter data: The packed pixels of the row
+        Precondition: data is a bytes-like object of length 3*width
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert len(data) == 3*self._width, repr(len(data)) + " is not a valid row length"
+        self._setRect(row,0,1,self._width,data)
+
+    def getColumn(self, col):
+        """
+        Returns the pixels of the given column (top to bottom), packed as bytes.
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        if not self._buffered:
+            return self._getRect(0,col,self._height,1)
+        view = self.getView()
+        size = 3*self._width
+        data = bytearray(3*self._height)
+        for color in range(3):
+            data[color::3] = view[3*col+color::size]
+        return bytes(data)
+
+    def getBlock(self, row, col, height, width):
+        """
+        Returns the pixels of a rectangle of this image, packed as bytes.
+
+        The pixels are in row-major order, so the result is the buffer of an
+        image of the given width.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        assert self._isRect(row,col,height,width), repr((row,col,height,width))+' is not a valid rectangle'
+        return self._getRect(row,col,height,width)
+
+    def setBlock(self, row, col, height, width, data):
+        """
+        Sets the pixels of a rectangle of this image from packed bytes.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+
+        Parameter data: The packed pixels of the rectangle, in row-major order
+        Precondition: data is a bytes-like object of length 3*height*width
+        """
+        assert self._isRect(row,col,height,width), repr((row,col,height,width))+' is not a valid rectangle'
+        assert len(data) == 3*height*width, repr(len(data)) + " is not a valid block length"
+        self._setRect(row,col,height,width,data)
+
+    def fillRect(self, row, col, height, width, pixel):
+        """
+        Sets every pixel of a rectangle of this image to pixel.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert self._isRect(row,col,height,width), repr((row,col,height,width))+' is not a valid rectangle'
+        assert _is_pixel(pixel) == True, repr(pixel) + " is not a valid pixel"
+        self._setRect(row,col,height,width,bytes(pixel)*(height*width))
 
     # PART D
     def __str__(self):
@@ -319,15 +964,15 @@ class Image(object):
         need to handle the commas between pixels and the newlines between rows.
         """
         twoDimList = ""
-        for i in range(len(self._data)):
+        for i in range(len(self)):
             if i == 0:
                 twoDimList += "[["
-            if (i + 1) % self._width == 0 and i + 1 != len(self._data):
-                twoDimList = twoDimList + str(self._data[i]) +"],\n["
-            elif i + 1 == len(self._data):
-                twoDimList = twoDimList + str(self._data[i]) + "]]"
+            if (i + 1) % self._width == 0 and i + 1 != len(self):
+                twoDimList = twoDimList + str(self[i]) +"],\n["
+            elif i + 1 == len(self):
+                twoDimList = twoDimList + str(self[i]) + "]]"
             else:
-                twoDimList = twoDimList + str(self._data[i]) +", "
+                twoDimList = twoDimList + str(self[i]) +", "
         return twoDimList 
 
     # ADDITIONAL METHODS
@@ -360,5 +1005,1047 @@ class Image(object):
 
         The underlying pixel data must be copied (e.g. the copy cannot refer
         to the same list of pixels that this object does).
+
+        For a pixel list, the copy is a new list of the same (immutable)
+        tuples.  For a pixel buffer, the copy shares the buffer until it is
+        written to (see the class specification), so this takes constant
+        time.
+        """
+        result = copy(self)
+        result._dependents = weakref.WeakSet()
+        result._copied = set()
+        result._dirty = [(0,0,self._height,self._width)]
+        if not self._buffered:
+            result._data = self._data.copy()
+            return result
+
+        root = self if self._parent is None else self._parent
+        result._parent = root
+        result._saved = self._saved.copy()
+        result._shared = True
+        root._dependents.add(result)
+        root._copied = set()
+        root._shared = True
+        return result
+
+    def shrink(self, factor):
+        """
+        Returns a smaller buffer-backed copy of this image.
+
+        The result keeps every factor-th pixel of every factor-th row, starting
+        with the top left pixel.  So it has (width+factor-1)//factor columns 
+        and (height+factor-1)//factor rows.  Skipping pixels (instead of 
+        averaging them) is fast, since each row is copied with three slices.
+        It is meant for previews.
+
+        Parameter factor: The shrinking factor
+        Precondition: factor is an int > 0
+        """
+        assert type(factor) == int and factor > 0, repr(factor)+' is not a valid factor'
+        view  = self.getView()
+        size  = 3*self._width
+        width = (self._width+factor-1)//factor
+        rows  = range(0,self._height,factor)
+        data  = bytearray(3*width*len(rows))
+        pos = 0
+        for row in rows:
+            line = view[row*size:(row+1)*size]
+            data[pos:pos+3*width:3]   = line[0::3*factor]
+            data[pos+1:pos+3*width:3] = line[1::3*factor]
+            data[pos+2:pos+3*width:3] = line[2::3*factor]
+            pos += 3*width
+        return Image(data,width)
+
+    def view(self, row, col, height, width):
+        """
+        Returns a window onto a rectangle of this image.
+
+        The window (see ImageView) has no pixels of its own.  Reading it reads
+        this image, and writing it writes this image.  It has the same methods
+        as an Image, so it can be given to an Editor or Filter to edit just 
+        that rectangle in place.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        return ImageView(self,row,col,height,width)
+
+    # HIDDEN METHODS FOR REGIONS
+    def _isRect(self, row, col, height, width):
+        """
+        Returns True if (row, col, height, width) is a rectangle in this image.
+
+        Parameter row: The top row of the rectangle
+        Precondition: NONE (row may be any value)
+
+        Parameter col: The left column of the rectangle
+        Precondition: NONE (col may be any value)
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: NONE (height may be any value)
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: NONE (width may be any value)
+        """
+        if not all(type(x) == int for x in (row,col,height,width)):
+            return False
+        return (0 <= row and 0 < height and row+height <= self._height and
+                0 <= col and 0 < width and col+width <= self._width)
+
+    def _getRect(self, row, col, height, width):
+        """
+        Returns the packed pixels of a rectangle of this image, as bytes.
+
+        The rectangle must be inside the image.  The bytes are in row-major 
+        order, 3 bytes (r,g,b) per pixel (see getBuffer).
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        if not self._buffered:
+            start = row*self._width+col
+            rows  = [self._data[pos:pos+width] for pos in range(start,start+height*self._width,self._width)]
+            return bytes(chain.from_iterable(chain.from_iterable(rows)))
+        view = self.getView()
+        size = 3*self._width
+        if width == self._width:
+            return bytes(view[row*size:(row+height)*size])
+        start = row*size+3*col
+        return b''.join([view[pos:pos+3*width] for pos in range(start,start+height*size,size)])
+
+    def _setRect(self, row, col, height, width, data):
+        """
+        Sets a rectangle of this image from packed pixels.
+
+        The rectangle must be inside the image.  Buffer sharing with copies is
+        handled as for setPixel, and the rectangle is marked dirty.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+
+        Parameter data: The packed pixels of the rectangle
+        Precondition: data is a bytes-like object of length 3*height*width
+        """
+        data = memoryview(data).cast('B')
+        rowbytes = 3*width
+        if self._buffered:
+            size  = 3*self._width
+            start = row*size+3*col
+            if self._shared:
+                for pos in range(start,start+height*size,size):
+                    for block in range(pos//BLOCK_BYTES,(pos+rowbytes-1)//BLOCK_BYTES+1):
+                        self._prepare(block*BLOCK_BYTES)
+            if width == self._width:
+                self._data[start:start+height*size] = data
+            else:
+                for r in range(height):
+                    pos = start+r*size
+                    self._data[pos:pos+rowbytes] = data[r*rowbytes:(r+1)*rowbytes]
+        else:
+            for r in range(height):
+                line = data[r*rowbytes:(r+1)*rowbytes]
+                pos  = (row+r)*self._width+col
+                self._data[pos:pos+width] = zip(line[0::3],line[1::3],line[2::3])
+        self._addDirty(row,col,height,width)
+
+    # HIDDEN METHODS FOR DIRTY RECTANGLES
+    def _isAllDirty(self):
+        """
+        Returns True if the whole image is already marked dirty
+        """
+        return (0,0,self._height,self._width) in self._dirty
+
+    def _addDirty(self, row, col, height, width):
+        """
+        Adds a rectangle to the dirty rectangles, merging where possible.
+
+        The new rectangle is merged with the last one if it is inside it or
+        continues it (to the right or below).  This keeps the list short for
+        the usual writing order (row by row).  If there are still more than
+        MAX_DIRTY rectangles, they are replaced by their bounding box.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        dirty = self._dirty
+        while dirty:
+            r, c, h, w = dirty[-1]
+            if r <= row and row+height <= r+h and c <= col and col+width <= c+w:
+                return
+            elif r == row and h == height and c+w == col:
+                col, width = c, w+width
+            elif c == col and w == width and r+h == row:
+                row, height = r, h+height
+            else:
+                break
+            dirty.pop()
+        dirty.append((row,col,height,width))
+
+        if len(dirty) > MAX_DIRTY:
+            top    = min(rect[0] for rect in dirty)
+            left   = min(rect[1] for rect in dirty)
+            bottom = max(rect[0]+rect[2] for rect in dirty)
+            right  = max(rect[1]+rect[3] for rect in dirty)
+            self._dirty = [(top,left,bottom-top,right-left)]
+
+    # HIDDEN METHODS FOR BUFFER SHARING
+    def _getBlock(self, block):
+        """
+        Returns a memoryview of the given block of this image's data
+
+        Parameter block: The block number
+        Precondition: block is an int, 0 <= block*BLOCK_BYTES < 3*len(self),
+        and this image is buffer-backed
+        """
+        if block in self._saved:
+            return memoryview(self._saved[block])
+        return memoryview(self._data)[block*BLOCK_BYTES:(block+1)*BLOCK_BYTES]
+
+    def _prepare(self, pos):
+        """
+        Prepares the block containing byte pos to be written.
+
+        If this image is a copy, it gets its own buffer.  If this image has
+        copies, each gets its own copy of the block.
+
+        Parameter pos: The position of the byte to be written
+        Precondition: pos is an int, 0 <= pos < 3*len(self), and this image
+        is buffer-backed
+        """
+        if not self._parent is None:
+            self._detach()
+        block = pos//BLOCK_BYTES
+        if not block in self._copied:
+            self._share(block)
+
+    def _share(self, block):
+        """
+        Saves the given block in every copy that shares this image's buffer.
+
+        Parameter block: The block number
+        Precondition: block is an int, 0 <= block*BLOCK_BYTES < 3*len(self),
+        and this image is a buffer-backed root
+        """
+        data = None
+        for image in self._dependents:
+            if not block in image._saved:
+                if data is None:
+                    data = bytes(self._data[block*BLOCK_BYTES:(block+1)*BLOCK_BYTES])
+                image._saved[block] = data
+        self._copied.add(block)
+        self._shared = len(self._dependents) > 0
+
+    def _detach(self):
+        """
+        Gives this copy its own buffer, so it no longer shares with its root.
+
+        Precondition: this image is buffer-backed and _parent is not None
+        """
+        data = bytearray(self._data)
+        for block, saved in self._saved.items():
+            data[block*BLOCK_BYTES:block*BLOCK_BYTES+len(saved)] = saved
+        self._parent._dependents.discard(self)
+        self._parent = None
+        self._saved = {}
+        self._data = data
+        self._shared = False
+
+    def _unshare(self):
+        """
+        Ends all buffer sharing between this image and other images.
+
+        Precondition: this image is buffer-backed
+        """
+        if not self._parent is None:
+            self._detach()
+        for image in list(self._dependents):
+            image._detach()
+        self._copied = set()
+        self._shared = False
+
+
+class ImageView(Image):
+    """
+    A class for a window onto a rectangle of another image.
+
+    A view has no pixels of its own.  Its pixels are the pixels of the 
+    rectangle in its source image, so changing the view changes the source
+    (and any copies of the source are protected, as usual).  A view has all
+    the methods of an Image, with its own width and height, so an Editor or
+    Filter can work on it to edit a selection of the source in place.
+
+    There are two differences.  The shape of a view is fixed, so setWidth 
+    and setHeight may not change it (a square view can still be transposed).
+    And the packed data of a view (getBuffer and getView) is a packed copy
+    of the rectangle, since the rows are not next to each other in the 
+    source.  Write it back with setBuffer.  The method copy returns a plain 
+    Image with the pixels of the rectangle only.
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _source: The image this is a view of
+    # Invariant: _source is an Image object, but not an ImageView
+    #
+    # Attribute _row: The top row of the rectangle in _source
+    # Invariant: _row is an int >= 0, with _row+_height <= _source height
+    #
+    # Attribute _col: The left column of the rectangle in _source
+    # Invariant: _col is an int >= 0, with _col+_width <= _source width
+    #
+    # Attribute _width: The width of the rectangle
+    # Invariant: _width is an int > 0
+    #
+    # Attribute _height: The height of the rectangle
+    # Invariant: _height is an int > 0
+    #
+    # Attribute _buffered: Always False (the view has no buffer of its own)
+    # Invariant: _buffered is False
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _dirty: The rectangles of the view changed through the view
+    # Invariant: _dirty is a list of rectangles, as in Image
+
+    # GETTERS AND SETTERS
+    def getSource(self):
+        """
+        Returns the image this is a view of
+        """
+        return self._source
+
+    def getOrigin(self):
+        """
+        Returns the position (row, col) of this view in its source image
+        """
+        return (self._row,self._col)
+
+    def getData(self):
+        """
+        Returns a COPY of the pixels of this view, as a pixel list.
+        """
+        data = self.getView()
+        return list(zip(data[0::3],data[1::3],data[2::3]))
+
+    def isBuffered(self):
+        """
+        Returns True if the source of this view is backed by a pixel buffer.
+        """
+        return self._source.isBuffered()
+
+    def getBuffer(self):
+        """
+        Returns a packed copy of the pixels of this view, as a bytearray.
+
+        Unlike an Image, changing the result does not change the view.
+        """
+        return bytearray(self.getView())
+
+    def getView(self):
+        """
+        Returns a read-only memoryview of a packed copy of the pixels.
+        """
+        return memoryview(self._source._getRect(self._row,self._col,self._height,self._width)).toreadonly()
+
+    def setBuffer(self, buffer):
+        """
+        Sets the pixels of this view (and its source) from packed bytes.
+
+        Parameter buffer: The new image data
+        Precondition: buffer is a bytes-like object of length 3*len(self)
+        """
+        assert len(buffer) == 3*len(self), repr(len(buffer)) + " is not a valid buffer length"
+        self._source._setRect(self._row,self._col,self._height,self._width,buffer)
+        self._dirty = [(0,0,self._height,self._width)]
+
+    def setWidth(self, value):
+        """
+        Sets the width of this view, which may not change.
+
+        Parameter value: the new width value
+        Precondition: value is the current width
+        """
+        assert value == self._width, 'the shape of a view cannot change'
+        self._dirty = [(0,0,self._height,self._width)]
+
+    def setHeight(self, value):
+        """
+        Sets the height of this view, which may not change.
+
+        Parameter value: the new height value
+        Precondition: value is the current height
+        """
+        assert value == self._height, 'the shape of a view cannot change'
+        self._dirty = [(0,0,self._height,self._width)]
+
+    # INITIALIZER
+    def __init__(self, image, row, col, height, width):
+        """
+        Initializes a view of a rectangle of image.
+
+        If image is itself a view, the new view is of the same source, and
+        the rectangle is relative to image.
+
+        Parameter image: The image to view
+        Precondition: image is an Image object
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < width
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= image width
+        """
+        assert isinstance(image,Image), repr(image)+' is not an image'
+        assert type(row) == int and (row >= 0 and row < image.getHeight()), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < image.getWidth()), repr(col) + " is not a valid column"
+        assert type(height) == int and height > 0 and row+height <= image.getHeight(), repr(height) + " is not a valid height"
+        assert type(width) == int and width > 0 and col+width <= image.getWidth(), repr(width) + " is not a valid width"
+        if isinstance(image,ImageView):
+            row += image._row
+            col += image._col
+            image = image._source
+        self._source = image
+        self._row = row
+        self._col = col
+        self._width  = width
+        self._height = height
+        self._buffered = False
+        self._dirty = [(0,0,height,width)]
+
+    # OPERATOR OVERLOADING
+    def __len__(self):
+        """
+        Returns the number of pixels in this view
+        """
+        return self._width*self._height
+
+    def __getitem__(self, pos):
+        """
+        Returns the pixel at the given position in this view.
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int and a valid position >= 0 in the pixel list.
+        """
+        assert type(pos) == int and pos >= 0 and pos < len(self), repr(pos) + " is not a valid position"
+        return self._source.getPixel(self._row+pos//self._width,self._col+pos % self._width)
+
+    def __setitem__(self, pos, pixel):
+        """
+        Sets the pixel at the given position in this view.
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int and a valid position >= 0 in the pixel list.
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert type(pos) == int and pos >= 0 and pos < len(self), repr(pos) + " is not a valid position"
+        self.setPixel(pos//self._width,pos % self._width,pixel)
+
+    # TWO-DIMENSIONAL ACCESS METHODS
+    def getPixel(self, row, col):
+        """
+        Returns the pixel value at (row, col) of this view
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        return self._source.getPixel(self._row+row,self._col+col)
+
+    def setPixel(self, row, col, pixel):
+        """
+        Sets the pixel value at (row, col) of this view to pixel
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        self._source.setPixel(self._row+row,self._col+col,pixel)
+        self._addDirty(row,col,1,1)
+
+    # ADDITIONAL METHODS
+    def copy(self):
+        """
+        Returns a new buffer-backed Image with the pixels of this view.
+
+        Only the rectangle is copied, not the source.
+        """
+        return Image(bytearray(self.getView()),self._width)
+
+    # HIDDEN METHODS FOR REGIONS
+    def _getRect(self, row, col, height, width):
+        """
+        Returns the packed pixels of a rectangle of this view (see Image)
+        """
+        return self._source._getRect(self._row+row,self._col+col,height,width)
+
+    def _setRect(self, row, col, height, width, data):
+        """
+        Sets a rectangle of this view from packed pixels (see Image)
+        """
+        self._source._setRect(self._row+row,self._col+col,height,width,data)
+        self._addDirty(row,col,height,width)
+
+
+class SummedArea(object):
+    """
+    A class for the summed-area table (integral image) of an Image.
+
+    A summed-area table stores, for every position (row, col), the sums of
+    the red, green and blue values of all pixels above and to the left of
+    that position.  With it, the sum of any rectangle of pixels can be found
+    in constant time, no matter how big the rectangle is.  This makes block
+    averages (pixellate), box blurs and region statistics fast.
+
+    The table is computed when it is created.  It does not change if the
+    image changes afterwards.
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _width: The width of the image
+    # Invariant: _width is an int > 0
+    #
+    # Attribute _height: The height of the image
+    # Invariant: _height is an int > 0
+    #
+    # Attribute _tables: The tables for red, green and blue
+    # Invariant: _tables is a list of 3 arrays of (_height+1)*(_width+1) ints.
+    # Entry r*(_width+1)+c of a table is the sum of that color over all the
+    # pixels in rows 0..r-1 and columns 0..c-1.
+
+    # GETTERS
+    def getWidth(self):
+        """
+        Returns the width of the image for this table
+        """
+        return self._width
+
+    def getHeight(self):
+        """
+        Returns the height of the image for this table
+        """
+        return self._height
+
+    # INITIALIZER
+    def __init__(self, image):
+        """
+        Initializes the summed-area table of the given image.
+
+        Parameter image: The image to sum
+        Precondition: image is an Image object
+        """
+        assert isinstance(image,Image), repr(image)+' is not an image'
+        self._width  = image.getWidth()
+        self._height = image.getHeight()
+
+        data = image.getView()
+        size = 3*self._width
+        self._tables = []
+        for color in range(3):
+            above = [0]*(self._width+1)
+            table = array('q',above)
+            for row in range(self._height):
+                start = row*size+color
+                line  = list(accumulate(data[start:start+size:3],initial=0))
+                above = list(map(operator.add,line,above))
+                table.extend(above)
+            self._tables.append(table)
+
+    # ACCESS METHODS
+    def getSum(self, row, col, height, width):
+        """
+        Returns the sums (r,g,b) of the colors in the given rectangle.
+
+        The rectangle starts at (row, col) and extends height rows down and
+        width columns to the right.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int >= 0, row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int >= 0, col+width <= image width
+        """
+        assert type(row) == int and type(height) == int, repr((row,height))+' is not a valid row range'
+        assert row >= 0 and height >= 0 and row+height <= self._height, repr((row,height))+' is not a valid row range'
+        assert type(col) == int and type(width) == int, repr((col,width))+' is not a valid column range'
+        assert col >= 0 and width >= 0 and col+width <= self._width, repr((col,width))+' is not a valid column range'
+        span = self._width+1
+        top  = row*span
+        bot  = (row+height)*span
+        rght = col+width
+        return tuple(t[bot+rght]-t[bot+col]-t[top+rght]+t[top+col] for t in self._tables)
+
+    def getMean(self, row, col, height, width):
+        """
+        Returns the averages (r,g,b) of the colors in the given rectangle.
+
+        The averages are floats.  See getSum for the rectangle.
+
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0
+
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0
+
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0, row+height <= image height
+
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0, col+width <= image width
+        """
+        assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        sums  = self.getSum(row,col,height,width)
+        count = height*width
+        return (sums[0]/count,sums[1]/count,sums[2]/count)
+
+
+class TiledImage(object):
+    """
+    A class for an image that is too large for memory.
+
+    The pixels of a tiled image stay in a raw image file (see saveRaw in 
+    class Image).  The image is divided into tiles, which are bands of whole
+    rows of about TILE_BYTES bytes each.  A tile is read into memory when a
+    pixel in it is first used, and kept in a cache.  The cache holds at most
+    capacity bytes of tiles.  When it is full, the least recently used tile
+    is dropped, after writing it back to the file if it was changed.  So the
+    memory used stays the same no matter how large the image is.
+
+    A tiled image has the same pixel access as Image (getPixel, setPixel, 
+    the [] operator, getWidth, getHeight and len).  To filter it, see the 
+    method stream in class Filter, which works a band of tiles at a time.
+    Changes are only certain to be in the file after flush (or close).  A
+    tiled image is a context manager, so use it in a with statement:
+
+        with TiledImage(file) as image:
+            ...
+
+    Then it is closed (and every change written) even if there is an error.
+
+    Attribute TILE_BYTES: A CLASS ATTRIBUTE for the size of a tile
+    Invariant: TILE_BYTES is an int > 0
+
+    Attribute CAPACITY: A CLASS ATTRIBUTE for the default size of the cache
+    Invariant: CAPACITY is an int > 0
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _file: The raw image file
+    # Invariant: _file is a binary file open for reading and writing
+    #
+    # Attribute _offset: The position of the pixels in the file
+    # Invariant: _offset is an int >= 0
+    #
+    # Attribute _width: The image width
+    # Invariant: _width is an int > 0
+    #
+    # Attribute _height: The image height
+    # Invariant: _height is an int > 0
+    #
+    # Attribute _rows: The number of rows in a tile (the last may have fewer)
+    # Invariant: _rows is an int > 0
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _capacity: The most bytes of tiles to keep in memory
+    # Invariant: _capacity is an int > 0.  At least one tile is always kept.
+    #
+    # Attribute _tiles: The tiles in memory, least recently used first
+    # Invariant: _tiles is an OrderedDict mapping tile numbers to bytearrays
+    #
+    # Attribute _changed: The tiles in memory that differ from the file
+    # Invariant: _changed is a set of keys of _tiles
+    #
+    # Attribute _reads: The number of tiles read from the file so far
+    # Invariant: _reads is an int >= 0
+
+    # A tile is a band of rows of about this many bytes
+    TILE_BYTES = 1024*1024
+
+    # The default cache size (64 tiles)
+    CAPACITY = 64*1024*1024
+
+    # GETTERS AND SETTERS
+    def getWidth(self):
+        """
+        Returns the image width
+        """
+        return self._width
+
+    def getHeight(self):
+        """
+        Returns the image height
+        """
+        return self._height
+
+    def getTileRows(self):
+        """
+        Returns the number of rows in a tile (the last tile may have fewer)
+        """
+        return self._rows
+
+    def getCapacity(self):
+        """
+        Returns the most bytes of tiles kept in memory
+        """
+        return self._capacity
+
+    def setCapacity(self, value):
+        """
+        Sets the most bytes of tiles kept in memory.
+
+        If the cache holds more than this, tiles are dropped right away.  At
+        least one tile is always kept, even if it is larger than value.
+
+        Parameter value: The new capacity
+        Precondition: value is an int > 0
+        """
+        assert type(value) == int and value > 0, repr(value)+' is not a valid capacity'
+        self._capacity = value
+        self._evict()
+
+    def getStats(self):
+        """
+        Returns a dictionary of cache statistics for this image.
+
+        The dictionary has the following keys:
+            'resident': the number of bytes of tiles in memory
+            'tiles':    the number of tiles in memory
+            'changed':  the number of tiles in memory not yet written back
+            'reads':    the number of tiles read from the file so far
+        """
+        return {'resident': sum(map(len,self._tiles.values())), 'tiles': len(self._tiles),
+                'changed': len(self._changed), 'reads': self._reads}
+
+    # INITIALIZER
+    def __init__(self, file, capacity=None):
+        """
+        Initializes a tiled image for the given raw image file.
+
+        The file is opened for reading and writing, but nothing else is read
+        but the header.
+
+        Parameter file: The raw image file
+        Precondition: file is a string naming a raw image file (see saveRaw
+        in class Image)
+
+        Parameter capacity: The most bytes of tiles to keep in memory
+        Precondition: capacity is an int > 0, or None for CAPACITY
+        """
+        capacity = self.CAPACITY if capacity is None else capacity
+        assert type(capacity) == int and capacity > 0, repr(capacity)+' is not a valid capacity'
+        self._file = open(file,'r+b')
+        try:
+            self._width, self._height, self._offset = _read_raw_header(self._file,file)
+        except:
+            self._file.close()
+            raise
+        self._rows = max(1,self.TILE_BYTES//(3*self._width))
+        self._capacity = capacity
+        self._tiles = OrderedDict()
+        self._changed = set()
+        self._reads = 0
+
+    @classmethod
+    def create(cls, file, width, height, capacity=None):
+        """
+        Returns a new black tiled image, in a new raw file.
+
+        On most file systems the file is sparse, so it takes no disk space
+        until pixels are written.
+
+        Parameter file: The raw image file to create
+        Precondition: file is a string
+
+        Parameter width: The image width
+        Precondition: width is an int > 0
+
+        Parameter height: The image height
+        Precondition: height is an int > 0
+
+        Parameter capacity: The most bytes of tiles to keep in memory
+        Precondition: capacity is an int > 0, or None for CAPACITY
+        """
+        assert type(width) == int and width > 0, repr(width)+' is not a valid width'
+        assert type(height) == int and height > 0, repr(height)+' is not a valid height'
+        header = _raw_header(width,height)
+        with open(file,'wb') as handle:
+            handle.write(header)
+            handle.truncate(len(header)+3*width*height)
+        return cls(file,capacity)
+
+    # OPERATOR OVERLOADING
+    def __enter__(self):
+        """
+        Returns this image, for use in a with statement.
+        """
+        return self
+
+    def __exit__(self, kind, value, trace):
+        """
+        Closes this image (see close) at the end of a with statement.
+
+        The changed tiles are written back even if the with statement ended
+        with an error, so the work done before the error is kept.  The error
+        (if any) is not suppressed.
+
+        Parameter kind: The type of the error
+        Precondition: kind is an exception class or None
+
+        Parameter value: The error
+        Precondition: value is an exception or None
+
+        Parameter trace: The traceback of the error
+        Precondition: trace is a traceback or None
+        """
+        self.close()
+        return False
+
+    def __len__(self):
+        """
+        Returns the number of pixels in this image
+
+        This special method supports the built-in len function.
+        """
+        return self._width*self._height
+
+    def __getitem__(self, pos):
+        """
+        Returns the pixel at the given position (see __getitem__ in Image).
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int and a valid position >= 0 in the pixel list.
+        """
+        assert type(pos) == int and pos >= 0 and pos < len(self), repr(pos) + " is not a valid position"
+        return self.getPixel(pos//self._width,pos % self._width)
+
+    def __setitem__(self, pos, pixel):
+        """
+        Sets the pixel at the given position (see __setitem__ in Image).
+
+        Parameter pos: The position in the pixel list
+        Precondition: pos is an int and a valid position >= 0 in the pixel list.
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert type(pos) == int and pos >= 0 and pos < len(self), repr(pos) + " is not a valid position"
+        self.setPixel(pos//self._width,pos % self._width,pixel)
+
+    # TWO-DIMENSIONAL ACCESS METHODS
+    def getPixel(self, row, col):
+        """
+        Returns the pixel value at (row, col)
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        tile = self._getTile(row//self._rows)
+        pos  = 3*((row % self._rows)*self._width+col)
+        return (tile[pos],tile[pos+1],tile[pos+2])
+
+    def setPixel(self, row, col, pixel):
+        """
+        Sets the pixel value at (row, col) to pixel
+
+        Parameter row: The pixel row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter col: The pixel column
+        Precondition: col is an int >= 0 and < width
+
+        Parameter pixel: The pixel value
+        Precondition: pixel is a 3-element tuple (r,g,b) of ints in 0..255
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(col) == int and (col >= 0 and col < self._width), repr(col) + " is not a valid column"
+        assert _is_pixel(pixel), repr(pixel) + " is not a valid pixel"
+        index = row//self._rows
+        tile  = self._getTile(index)
+        pos   = 3*((row % self._rows)*self._width+col)
+        tile[pos:pos+3] = bytes(pixel)
+        self._changed.add(index)
+
+    # BAND METHODS
+    def getRows(self, row, count):
+        """
+        Returns the packed pixels of count rows, starting at row.
+
+        The result is a bytes object with 3 bytes (r,g,b) per pixel, in 
+        row-major order (see getBuffer in class Image).
+
+        Parameter row: The first row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter count: The number of rows
+        Precondition: count is an int > 0 and row+count <= height
+        """
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert type(count) == int and count > 0 and row+count <= self._height, repr(count) + " is not a valid count"
+        size  = 3*self._width
+        parts = []
+        while count > 0:
+            index = row//self._rows
+            start = row % self._rows
+            rows  = min(count,self._rows-start)
+            parts.append(bytes(self._getTile(index)[start*size:(start+rows)*size]))
+            row   += rows
+            count -= rows
+        return b''.join(parts)
+
+    def setRows(self, row, data):
+        """
+        Sets whole rows, starting at row, from packed pixels.
+
+        Parameter row: The first row
+        Precondition: row is an int >= 0 and < height
+
+        Parameter data: The packed pixels of the rows (see getRows)
+        Precondition: data is a bytes-like object, and its length is a 
+        positive multiple of 3*width with row+len(data)//(3*width) <= height
+        """
+        size = 3*self._width
+        assert type(row) == int and (row >= 0 and row < self._height), repr(row) + " is not a valid row"
+        assert len(data) > 0 and len(data) % size == 0 and row+len(data)//size <= self._height, \
+            repr(len(data)) + " is not a valid data length"
+        data = memoryview(data).cast('B')
+        pos = 0
+        while pos < len(data):
+            index = row//self._rows
+            start = row % self._rows
+            rows  = min((len(data)-pos)//size,self._rows-start)
+            tile  = self._getTile(index)
+            tile[start*size:(start+rows)*size] = data[pos:pos+rows*size]
+            self._changed.add(index)
+            row += rows
+            pos += rows*size
+
+    # FILE METHODS
+    def flush(self):
+        """
+        Writes every changed tile back to the file.
+        """
+        for index in sorted(self._changed):
+            self._write(index)
+        self._changed = set()
+        self._file.flush()
+
+    def close(self):
+        """
+        Writes every changed tile back to the file, and closes it.
+
+        The image cannot be used afterwards.
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+            self._tiles = OrderedDict()
+
+    # HIDDEN METHODS
+    def _getTile(self, index):
+        """
+        Returns the given tile, reading it from the file if needed.
+
+        The tile becomes the most recently used one.
+
+        Parameter index: The tile number
+        Precondition: index is an int, 0 <= index*_rows < height
+        """
+        tile = self._tiles.get(index)
+        if tile is None:
+            rows = min(self._rows,self._height-index*self._rows)
+            size = 3*self._width*rows
+            self._file.seek(self._offset+3*self._width*self._rows*index)
+            tile = bytearray(self._file.read(size))
+            tile.extend(bytes(size-len(tile)))     # In case the file is short
+            self._reads += 1
+            self._tiles[index] = tile
+            self._evict()
+        else:
+            self._tiles.move_to_end(index)
+        return tile
+
+    def _write(self, index):
+        """
+        Writes the given tile to the file.
+
+        Parameter index: The tile number
+        Precondition: index is the number of a tile in _tiles
+        """
+        self._file.seek(self._offset+3*self._width*self._rows*index)
+        self._file.write(self._tiles[index])
+
+    def _evict(self):
+        """
+        Drops the least recently used tiles until the cache fits its capacity.
+
+        Changed tiles are written back first.  The most recently used tile is
+        never dropped.
         """
-        return deepcopy(self)
+        resident = sum(map(len,self._tiles.values()))
+        while resident > self._capacity and len(self._tiles) > 1:
+            index = next(iter(self._tiles))
+            if index in self._changed:
+                self._write(index)
+                self._changed.discard(index)
+            resident -= len(self._tiles.pop(index))
@@ -12,7 +12,12 @@ Date:   October 29, 2019
 """
 import introcs
 import a6image
+import a6editor
+import a6history
 import a6filter
+import a6files
+import a6worker
+import a6batch
 import traceback
 
 # Helper to read the test images
@@ -85,15 +90,23 @@ def test_pixel_list():
     Tests the precondition helper _is_pixel_list
     """
     print('Testing helper _is_pixel_list')
-    introcs.assert_false(a6image._is_pixel_list('a'))
-    introcs.assert_false(a6image._is_pixel_list((0,244,255)))
-    introcs.assert_false(a6image._is_pixel_list(['a']))
-    introcs.assert_true(a6image._is_pixel_list([(0,244,255)]))
-    introcs.assert_false(a6image._is_pixel_list([[(0,244,255)]]))
-    introcs.assert_false(a6image._is_pixel_list([(304,244,255)]))
-    introcs.assert_true(a6image._is_pixel_list([(0,244,255),(100,64,255),(50,3,250)]))
-    introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,'64',255),(50,3,250)]))
-    introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,-64,255),(50,3,250)]))
+    # The bulk check must agree with the strict check
+    strict = a6image.STRICT
+    for mode in [True,False]:
+        a6image.STRICT = mode
+        introcs.assert_false(a6image._is_pixel_list('a'))
+        introcs.assert_false(a6image._is_pixel_list((0,244,255)))
+        introcs.assert_false(a6image._is_pixel_list(['a']))
+        introcs.assert_true(a6image._is_pixel_list([(0,244,255)]))
+        introcs.assert_false(a6image._is_pixel_list([[(0,244,255)]]))
+        introcs.assert_false(a6image._is_pixel_list([(304,244,255)]))
+        introcs.assert_true(a6image._is_pixel_list([(0,244,255),(100,64,255),(50,3,250)]))
+        introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,'64',255),(50,3,250)]))
+        introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,-64,255),(50,3,250)]))
+        introcs.assert_false(a6image._is_pixel_list([(0,244,255),(1.0,64,255)]))
+        introcs.assert_false(a6image._is_pixel_list([(0,244,255),(True,64,255)]))
+        introcs.assert_false(a6image._is_pixel_list([(0,244,255),(100,64)]))
+    a6image.STRICT = strict
     print("tests complete")
 
 
@@ -133,6 +146,40 @@ def test_image_init():
     introcs.assert_error(a6image.Image,p,5,    message='Image does not enforce the precondition width validity')
 
 
+def test_image_from_buffer():
+    """
+    Tests the method fromBuffer in class Image
+    """
+    print('Testing method fromBuffer')
+    
+    data = bytes(x*3 % 256 for x in range(3*4*3))
+    for validated in [True,False]:
+        image = a6image.Image.fromBuffer(data,4,validated)
+        introcs.assert_true(image.isBuffered())
+        introcs.assert_equals((4,3),(image.getWidth(),image.getHeight()))
+        introcs.assert_equals(data,bytes(image.getView()))
+        image = a6image.Image.fromBuffer(memoryview(data),6,validated)
+        introcs.assert_equals((6,2),(image.getWidth(),image.getHeight()))
+    
+    # A bytearray is used directly
+    buffer = bytearray(data)
+    image  = a6image.Image.fromBuffer(buffer,4)
+    image.setPixel(0,0,(1,2,3))
+    introcs.assert_equals(b'\x01\x02\x03',bytes(buffer[:3]))
+    
+    # Untrusted data raises ValueError, even when not in STRICT mode
+    introcs.assert_error(a6image.Image.fromBuffer,data,5,False,error=ValueError)
+    introcs.assert_error(a6image.Image.fromBuffer,data[:-1],4,False,error=ValueError)
+    introcs.assert_error(a6image.Image.fromBuffer,b'',1,False,error=ValueError)
+    introcs.assert_error(a6image.Image.fromBuffer,'abc',1,False,error=ValueError)
+    introcs.assert_error(a6image.Image.fromBuffer,data,4.0,False,error=ValueError)
+    strict = a6image.STRICT
+    a6image.STRICT = True
+    introcs.assert_error(a6image.Image.fromBuffer,data,5,error=ValueError)
+    a6image.STRICT = strict
+    introcs.assert_error(a6image.Image.fromBuffer,data,5,message='fromBuffer does not enforce the precondition on width')
+
+
 def test_image_setters():
     """
     Tests the width and height setters for class Image
@@ -298,6 +345,581 @@ def test_image_other():
     introcs.assert_error(image.swapPixels, 0, 1, 0, 'a', message='swapPixels does not enforce the precondition on column type')
     introcs.assert_error(image.swapPixels, 0, 1, 0, 8,   message='swapPixels does not enforce the precondition on column value')
 
+
+def test_image_buffer():
+    """
+    Tests the buffer-backed storage in class Image
+    """
+    print('Testing image buffer storage')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    b = bytearray([255, 64, 0, 0, 255, 64, 64, 0, 255, 64, 255, 128, 128, 64, 255, 255, 128, 64])
+    
+    introcs.assert_true(a6image._is_pixel_buffer(b))
+    introcs.assert_false(a6image._is_pixel_buffer(bytes(b)))
+    introcs.assert_false(a6image._is_pixel_buffer(bytearray()))
+    introcs.assert_false(a6image._is_pixel_buffer(b[:-1]))
+    introcs.assert_false(a6image._is_pixel_buffer(p))
+    
+    image = a6image.Image(b,2)
+    introcs.assert_true(image.isBuffered())
+    introcs.assert_equals(id(b),id(image.getBuffer()))
+    introcs.assert_equals(6,len(image))
+    introcs.assert_equals(2,image.getWidth())
+    introcs.assert_equals(3,image.getHeight())
+    introcs.assert_equals(p,image.getData())
+    for n in range(6):
+        introcs.assert_equals(p[n],image[n])
+        introcs.assert_equals(p[n],image.getPixel(n // 2, n % 2))
+    
+    image[4] = (1,2,3)
+    introcs.assert_equals((1,2,3),image[4])
+    introcs.assert_equals([1,2,3],list(b[12:15]))   # Because image has a reference to b
+    image.setPixel(0,1,(4,5,6))
+    introcs.assert_equals((4,5,6),image[1])
+    image.swapPixels(0,1,2,0)
+    introcs.assert_equals((1,2,3),image.getPixel(0,1))
+    introcs.assert_equals((4,5,6),image.getPixel(2,0))
+    
+    image.setWidth(3)
+    introcs.assert_equals(2,image.getHeight())
+    introcs.assert_equals(str(a6image.Image(image.getData(),3)),str(image))
+    
+    copy = image.copy()
+    introcs.assert_true(copy.isBuffered())
+    introcs.assert_not_equals(id(image.getBuffer()), id(copy.getBuffer()))
+    copy[0] = (0,0,0)
+    introcs.assert_equals(p[0],image[0])
+    
+    # A list-backed image packs into a new buffer
+    image = a6image.Image(p,3)
+    introcs.assert_false(image.isBuffered())
+    introcs.assert_equals(b'\xff@\x00',bytes(image.getBuffer()[:3]))
+    introcs.assert_equals(p,a6image.Image(image.getBuffer(),3).getData())
+    
+    # The raw buffer is only given out when it is the data of the image
+    introcs.assert_true(image.getRawBuffer() is None)
+    buffer = bytearray(range(18))
+    image = a6image.Image(buffer,3)
+    introcs.assert_true(image.getRawBuffer() is buffer)
+    copy = image.copy()
+    introcs.assert_true(copy.getRawBuffer() is buffer)
+    image.setPixel(0,0,(1,1,1))
+    introcs.assert_true(copy.getRawBuffer() is None)
+    introcs.assert_true(image.getRawBuffer() is buffer)
+    introcs.assert_true(image.view(0,0,1,1).getRawBuffer() is None)
+    
+    # Test enforcement
+    introcs.assert_error(a6image.Image,b[:-1],1, message='Image does not enforce the precondition on buffer length')
+    introcs.assert_error(a6image.Image,b,4,      message='Image does not enforce the precondition on buffer width')
+    introcs.assert_error(image.setPixel,0,0,(0,0,256), message='setPixel does not enforce the precondition on pixel value')
+
+
+def test_editor():
+    """
+    Tests the edit history in class Editor
+    """
+    print('Testing editor history')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    
+    for image in [a6image.Image(p[:],2), a6image.Image(a6image.Image(p,2).getBuffer(),2)]:
+        editor = a6editor.Editor(image)
+        introcs.assert_equals(p,editor.getCurrent().getData())
+        introcs.assert_not_equals(id(image),id(editor.getCurrent()))
+        introcs.assert_false(editor.undo())
+        
+        editor.increment()
+        editor.getCurrent().setPixel(1,1,(1,1,1))
+        editor.increment()
+        editor.getCurrent().setWidth(3)
+        editor.getCurrent().setPixel(0,0,(2,2,2))
+        editor.increment()
+        introcs.assert_equals(3,editor.getCurrent().getWidth())
+        introcs.assert_equals((2,2,2),editor.getCurrent()[0])
+        introcs.assert_equals((1,1,1),editor.getCurrent()[3])
+        
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(3,editor.getCurrent().getWidth())
+        introcs.assert_equals((2,2,2),editor.getCurrent()[0])
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(2,editor.getCurrent().getWidth())
+        introcs.assert_equals(p[0],editor.getCurrent()[0])
+        introcs.assert_equals((1,1,1),editor.getCurrent()[3])
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(p,editor.getCurrent().getData())
+        introcs.assert_false(editor.undo())
+        introcs.assert_equals(p,image.getData())
+        
+        # Changes without an increment are lost on undo
+        editor.increment()
+        editor.getCurrent()[5] = (3,3,3)
+        editor.increment()
+        editor.getCurrent()[4] = (4,4,4)
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals((3,3,3),editor.getCurrent()[5])
+        introcs.assert_equals(p[4],editor.getCurrent()[4])
+        
+        editor.clear()
+        introcs.assert_equals(p,editor.getCurrent().getData())
+        introcs.assert_false(editor.undo())
+    
+    # The history never grows past MAX_HISTORY
+    editor = a6editor.Editor(a6image.Image(p[:],2))
+    for n in range(a6editor.Editor.MAX_HISTORY+5):
+        editor.increment()
+        editor.getCurrent()[0] = (n,n,n)
+    for n in range(a6editor.Editor.MAX_HISTORY-1):
+        introcs.assert_true(editor.undo())
+    introcs.assert_false(editor.undo())
+    introcs.assert_equals(5,editor.getCurrent()[0][0])
+
+
+def test_history():
+    """
+    Tests that class History only stores the blocks that change
+    """
+    print('Testing compact history')
+    width = 64
+    block = a6image.BLOCK_BYTES
+    image = a6image.Image(bytearray(3*width*160),width)
+    history = a6history.History(5)
+    introcs.assert_equals(0,len(history))
+    
+    history.push(image)
+    image.setPixel(7,3,(9,9,9))
+    image.setPixel(8,30,(9,9,9))
+    image.setPixel(100,0,(9,9,9))
+    history.push(image)
+    introcs.assert_equals(2,len(history))
+    step = history._steps[-1]
+    introcs.assert_equals([(0,block),(6*block,block)],step.layout)
+    
+    # A rotation needs a keyframe
+    image.setWidth(160)
+    history.push(image)
+    step = history._steps[-1]
+    introcs.assert_equals(64,step.width)
+    introcs.assert_equals([(0,3*64*160)],step.layout)
+    
+    history.pop(image)
+    introcs.assert_equals(160,image.getWidth())
+    history.pop(image)
+    introcs.assert_equals(64,image.getWidth())
+    introcs.assert_equals((9,9,9),image.getPixel(8,30))
+    history.pop(image)
+    introcs.assert_equals((0,0,0),image.getPixel(8,30))
+    introcs.assert_equals(0,len(history))
+
+
+def test_history_budget():
+    """
+    Tests the memory budget (compression and spilling) of class History
+    """
+    print('Testing history memory budget')
+    width = 30
+    data = bytearray((8*x) % 256 for x in range(3*width*width))
+    image = a6image.Image(data,width)
+    editor = a6editor.Editor(image,5000)
+    
+    versions = []
+    for n in range(40):
+        editor.increment()
+        versions.append(editor.getCurrent().getData())
+        current = editor.getCurrent()
+        for row in range(n % current.getHeight(), current.getHeight(), 7):
+            current.setPixel(row,n % current.getWidth(),(n,n,n))
+        if n % 10 == 9:
+            current.setWidth(width*3 if current.getWidth() == width else width)
+    
+    stats = editor.getStats()
+    introcs.assert_equals(40,stats['versions'])
+    introcs.assert_true(stats['resident'] <= 5000)
+    introcs.assert_true(stats['spilled'] > 0)
+    introcs.assert_true(stats['ratio'] > 1.0)
+    
+    while versions:
+        introcs.assert_true(editor.undo())
+        introcs.assert_equals(versions.pop(),editor.getCurrent().getData())
+    introcs.assert_false(editor.undo())
+    introcs.assert_equals(image.getData(),editor.getCurrent().getData())
+    introcs.assert_equals(0,editor.getStats()['spilled'])
+
+
+def test_image_share():
+    """
+    Tests that copies of buffer-backed images share unchanged blocks
+    """
+    print('Testing image copy-on-write')
+    block  = a6image.BLOCK_BYTES//3
+    width  = block//4
+    pixels = [(n % 256, n // 256, 7) for n in range(3*block)]
+    image  = a6image.Image(a6image.Image(pixels,width).getBuffer(),width)
+    
+    copy1 = image.copy()
+    introcs.assert_true(copy1._data is image._data)
+    introcs.assert_equals(pixels,copy1.getData())
+    
+    # Writing to the original only saves the block written
+    image.setPixel(0,0,(1,1,1))
+    image[2*block] = (2,2,2)
+    introcs.assert_equals([0,2],sorted(copy1._saved))
+    introcs.assert_equals(pixels[0],copy1.getPixel(0,0))
+    introcs.assert_equals(pixels[2*block],copy1[2*block])
+    introcs.assert_equals(pixels,copy1.getData())
+    introcs.assert_equals((1,1,1),image[0])
+    introcs.assert_equals([(0,a6image.BLOCK_BYTES),(2*a6image.BLOCK_BYTES,a6image.BLOCK_BYTES)],
+                          [(pos,len(data)) for pos, data in copy1.getChanges(image)])
+    introcs.assert_equals([],image.getChanges(image.copy()))
+    
+    # A copy of a copy shares the same buffer
+    copy2 = copy1.copy()
+    introcs.assert_true(copy2._data is image._data)
+    image[block] = (3,3,3)
+    introcs.assert_equals(pixels,copy1.getData())
+    introcs.assert_equals(pixels,copy2.getData())
+    
+    # Writing to a copy gives it its own buffer
+    copy2[1] = (4,4,4)
+    introcs.assert_false(copy2._data is image._data)
+    introcs.assert_equals((4,4,4),copy2[1])
+    introcs.assert_equals(pixels[1],copy1[1])
+    introcs.assert_equals(pixels[1],image[1])
+    introcs.assert_equals(pixels[block],copy2[block])
+    
+    # setBuffer only saves the blocks that change
+    copy3 = image.copy()
+    data = bytearray(image.getView())
+    data[-1] = 255
+    image.setBuffer(data)
+    introcs.assert_equals([2],sorted(copy3._saved))
+    introcs.assert_equals(7,copy3[len(copy3)-1][2])
+    introcs.assert_equals(255,image[len(image)-1][2])
+    
+    # getBuffer ends the sharing
+    buffer = image.getBuffer()
+    buffer[0] = 99
+    introcs.assert_equals(1,copy3[0][0])
+    introcs.assert_equals(pixels,copy1.getData())
+    introcs.assert_false(copy1._data is image._data)
+
+
+def test_image_dirty():
+    """
+    Tests the dirty rectangles of class Image
+    """
+    print('Testing dirty rectangles')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]*20
+    for image in [a6image.Image(p[:],12), a6image.Image(a6image.Image(p,12).getBuffer(),12)]:
+        introcs.assert_equals([(0,0,10,12)],image.getDirty())
+        image.clearDirty()
+        introcs.assert_equals([],image.getDirty())
+        
+        # Writes in row order are merged
+        for row in range(2,5):
+            for col in range(3,7):
+                image.setPixel(row,col,(0,0,0))
+        introcs.assert_equals([(2,3,3,4)],image.getDirty())
+        image[5*12+3] = (1,1,1)
+        introcs.assert_equals([(2,3,3,4),(5,3,1,1)],image.getDirty())
+        image.swapPixels(9,11,0,0)
+        introcs.assert_equals([(2,3,3,4),(5,3,1,1),(9,11,1,1),(0,0,1,1)],image.getDirty())
+        
+        # Too many rectangles become their bounding box
+        image.clearDirty()
+        for pos in range(0,120,2):
+            image[pos] = (2,2,2)
+        introcs.assert_equals(60,len(image.getDirty()))
+        image[121-2*12] = (2,2,2)
+        image[3] = (2,2,2)
+        introcs.assert_equals(62,len(image.getDirty()))
+        for pos in range(1,7,2):
+            image[60+pos] = (3,3,3)
+        introcs.assert_equals([(0,0,10,11)],image.getDirty())
+        
+        # Only the rows that change in setBuffer
+        image.clearDirty()
+        buffer = bytearray(image.getView())
+        buffer[3*12*4+5] = 255-buffer[3*12*4+5]
+        buffer[3*12*6] = 255-buffer[3*12*6]
+        buffer[3*12*7-1] = 255-buffer[3*12*7-1]
+        image.setBuffer(buffer)
+        if image.isBuffered():
+            introcs.assert_equals([(4,0,1,12),(6,0,1,12)],image.getDirty())
+        else:
+            introcs.assert_equals([(0,0,10,12)],image.getDirty())
+        
+        image.clearDirty()
+        image.markDirty(1,2,3,4)
+        introcs.assert_equals([(1,2,3,4)],image.getDirty())
+        image.setWidth(12)
+        introcs.assert_equals([(0,0,10,12)],image.getDirty())
+        image.clearDirty()
+        introcs.assert_equals([(0,0,10,12)],image.copy().getDirty())
+        introcs.assert_equals([],image.getDirty())
+        introcs.assert_error(image.markDirty,9,0,2,1,message='markDirty does not enforce the precondition on height')
+        introcs.assert_error(image.markDirty,0,12,1,1,message='markDirty does not enforce the precondition on col')
+
+
+def test_image_shrink():
+    """
+    Tests the method shrink in class Image
+    """
+    print('Testing method shrink')
+    
+    data = bytearray(x % 256 for x in range(3*7*5))
+    for image in [a6image.Image(data[:],7),a6image.Image(a6image.Image(data[:],7).getData(),7)]:
+        for factor in [1,2,3,7,9]:
+            small = image.shrink(factor)
+            introcs.assert_true(small.isBuffered())
+            introcs.assert_equals((7+factor-1)//factor,small.getWidth())
+            introcs.assert_equals((5+factor-1)//factor,small.getHeight())
+            for row in range(small.getHeight()):
+                for col in range(small.getWidth()):
+                    introcs.assert_equals(image.getPixel(row*factor,col*factor),small.getPixel(row,col))
+    small[0] = (1,2,3)
+    introcs.assert_equals(tuple(data[:3]),image[0])
+    introcs.assert_error(image.shrink,0,message='shrink does not enforce the precondition on factor')
+
+
+def test_image_raw():
+    """
+    Tests the raw file format (saveRaw and openMmap) in class Image
+    """
+    import os
+    import tempfile
+    print('Testing raw image files')
+    
+    data = bytearray(x*5 % 256 for x in range(3*7*5))
+    image = a6image.Image(data[:],7)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder,'image.raw')
+        image.saveRaw(path)
+        introcs.assert_true(a6image.is_raw(path))
+        introcs.assert_false(a6image.is_raw(os.path.join(folder,'missing.raw')))
+        introcs.assert_equals((7,5),a6image.get_raw_size(path))
+        
+        # Copy on write never changes the file
+        mapped = a6image.Image.openMmap(path)
+        introcs.assert_true(mapped.isBuffered())
+        introcs.assert_equals((7,5),(mapped.getWidth(),mapped.getHeight()))
+        introcs.assert_equals(image.getData(),mapped.getData())
+        saved = mapped.copy()
+        mapped.setPixel(1,2,(1,2,3))
+        introcs.assert_equals((1,2,3),mapped.getPixel(1,2))
+        introcs.assert_equals(image.getPixel(1,2),saved.getPixel(1,2))
+        introcs.assert_equals(image.getData(),a6image.Image.openMmap(path,'r').getData())
+        
+        # Read-only maps cannot be written
+        readonly = a6image.Image.openMmap(path,'r')
+        introcs.assert_error(readonly.setPixel,0,0,(1,2,3),error=TypeError)
+        
+        # Write-through maps change the file, and filters work on them
+        mapped = a6image.Image.openMmap(path,'w')
+        editor = a6filter.Filter(mapped)
+        editor.invert()
+        editor.getCurrent().saveRaw(path+'2')
+        expected = a6filter.Filter(a6image.Image(data[:],7))
+        expected.invert()
+        introcs.assert_equals(expected.getCurrent().getData(),a6files.load_image(path+'2').getData())
+        mapped.setBuffer(expected.getCurrent().getView())
+        del mapped, editor
+        introcs.assert_equals(expected.getCurrent().getData(),a6image.Image.openMmap(path,'r').getData())
+        
+        with open(os.path.join(folder,'bad.raw'),'wb') as file:
+            file.write(b'A6RAW')
+        introcs.assert_error(a6image.Image.openMmap,os.path.join(folder,'bad.raw'))
+        introcs.assert_error(a6image.Image.openMmap,path,'x',message='openMmap does not enforce the precondition on mode')
+
+
+def test_tiled_image():
+    """
+    Tests the class TiledImage
+    """
+    import os
+    import random
+    import tempfile
+    print('Testing class TiledImage')
+    
+    random.seed(3110)
+    width, height = (11,10)
+    data = bytearray(random.randrange(256) for x in range(3*width*height))
+    image = a6image.Image(data[:],width)
+    tiles = a6image.TiledImage.TILE_BYTES
+    a6image.TiledImage.TILE_BYTES = 3*width*3
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder,'image.raw')
+            image.saveRaw(path)
+            with a6image.TiledImage(path,2*3*width*3) as tiled:
+                introcs.assert_equals((11,10),(tiled.getWidth(),tiled.getHeight()))
+                introcs.assert_equals(110,len(tiled))
+                introcs.assert_equals(3,tiled.getTileRows())
+                introcs.assert_equals(0,tiled.getStats()['reads'])
+            
+                # Reading pixels only keeps the most recent tiles
+                for row in range(height):
+                    for col in range(width):
+                        introcs.assert_equals(image.getPixel(row,col),tiled.getPixel(row,col))
+                introcs.assert_equals(image[37],tiled[37])
+                stats = tiled.getStats()
+                introcs.assert_equals(2,stats['tiles'])
+                introcs.assert_true(stats['resident'] <= tiled.getCapacity())
+                introcs.assert_equals(5,stats['reads'])
+            
+                # Changed tiles are written back when dropped, or on flush
+                tiled.setPixel(0,0,(1,2,3))
+                tiled[109] = (4,5,6)
+                image.setPixel(0,0,(1,2,3))
+                image[109] = (4,5,6)
+                introcs.assert_equals((1,2,3),tiled.getPixel(0,0))
+                introcs.assert_equals(image.getView()[3*width*2:3*width*8],tiled.getRows(2,6))
+                band = bytes(range(3*width*4))
+                tiled.setRows(4,band)
+                image.getBuffer()[3*width*4:3*width*8] = band
+                introcs.assert_equals(image.getView()[3*width*3:3*width*9],tiled.getRows(3,6))
+                tiled.setCapacity(1)
+                introcs.assert_equals(1,tiled.getStats()['tiles'])
+                tiled.flush()
+                introcs.assert_equals(0,tiled.getStats()['changed'])
+                introcs.assert_equals(image.getData(),a6image.Image.openMmap(path,'r').getData())
+            
+            introcs.assert_error(tiled.getPixel,10,0,message='getPixel does not enforce the precondition on row')
+            introcs.assert_error(tiled.setPixel,0,0,(256,0,0),message='setPixel does not enforce the precondition on pixel')
+            introcs.assert_error(tiled.getRows,8,3,message='getRows does not enforce the precondition on count')
+            introcs.assert_error(tiled.setRows,0,b'12',message='setRows does not enforce the precondition on data')
+            introcs.assert_error(tiled.setCapacity,0,message='setCapacity does not enforce the precondition on value')
+            
+            # A new image is black
+            with a6image.TiledImage.create(os.path.join(folder,'blank.raw'),5,4) as blank:
+                introcs.assert_equals((0,0,0),blank.getPixel(3,4))
+                blank.setPixel(3,4,(7,8,9))
+            introcs.assert_equals((7,8,9),a6image.Image.openMmap(os.path.join(folder,'blank.raw')).getPixel(3,4))
+            
+            # Changes made before an error are still written
+            try:
+                with a6image.TiledImage(os.path.join(folder,'blank.raw')) as blank:
+                    blank.setPixel(0,0,(1,2,3))
+                    raise RuntimeError('partway')
+            except RuntimeError:
+                pass
+            introcs.assert_true(blank._file.closed)
+            introcs.assert_equals((1,2,3),a6image.Image.openMmap(os.path.join(folder,'blank.raw')).getPixel(0,0))
+    finally:
+        a6image.TiledImage.TILE_BYTES = tiles
+
+
+def test_image_bulk():
+    """
+    Tests the bulk access methods (getRow, getBlock, fillRect, etc) in class Image
+    """
+    print('Testing bulk access methods')
+    
+    data = bytearray(x*5 % 256 for x in range(3*7*5))
+    images = [a6image.Image(data[:],7),a6image.Image(a6image.Image(data[:],7).getData(),7)]
+    images.append(a6image.Image(bytearray(3*9*8),9).view(2,1,5,7))
+    images[2].setBuffer(data)
+    for image in images:
+        pixels = image.getData()
+        packed = lambda items: bytes(value for pixel in items for value in pixel)
+        introcs.assert_equals(packed(pixels[14:21]),image.getRow(2))
+        introcs.assert_equals(packed(pixels[3::7]),image.getColumn(3))
+        block = [pixels[row*7+col] for row in range(1,4) for col in range(2,4)]
+        introcs.assert_equals(packed(block),image.getBlock(1,2,3,2))
+        
+        image.clearDirty()
+        image.setBlock(1,2,3,2,bytes(range(18)))
+        introcs.assert_equals((6,7,8),image.getPixel(2,2))
+        introcs.assert_equals(pixels[1*7+4],image.getPixel(1,4))
+        image.setRow(4,bytes(21))
+        introcs.assert_equals(bytes(21),image.getRow(4))
+        image.fillRect(0,5,5,2,(255,0,0))
+        introcs.assert_equals(packed([(255,0,0)]*5),image.getColumn(6))
+        introcs.assert_equals(pixels[4],image.getPixel(0,4))
+        introcs.assert_equals([(1,2,3,2),(4,0,1,7),(0,5,5,2)],image.getDirty())
+        
+        introcs.assert_error(image.getRow,5,message='getRow does not enforce the precondition on row')
+        introcs.assert_error(image.setRow,0,bytes(3),message='setRow does not enforce the precondition on data')
+        introcs.assert_error(image.getBlock,4,0,2,1,message='getBlock does not enforce the precondition on height')
+        introcs.assert_error(image.fillRect,0,0,1,1,(256,0,0),message='fillRect does not enforce the precondition on pixel')
+    
+    # Bulk writes do not change copies of the image
+    image = a6image.Image(data[:],7)
+    copy  = image.copy()
+    image.fillRect(0,0,5,7,(1,2,3))
+    introcs.assert_equals(bytes(data),bytes(copy.getView()))
+
+
+def test_image_view():
+    """
+    Tests the method view and class ImageView in module a6image
+    """
+    print('Testing image views')
+    
+    data = bytearray(x*3 % 256 for x in range(3*7*5))
+    for image in [a6image.Image(data[:],7),a6image.Image(a6image.Image(data[:],7).getData(),7)]:
+        view = image.view(1,2,3,4)
+        introcs.assert_equals((4,3),(view.getWidth(),view.getHeight()))
+        introcs.assert_equals(12,len(view))
+        introcs.assert_equals(image.isBuffered(),view.isBuffered())
+        introcs.assert_equals(image.getPixel(2,3),view.getPixel(1,1))
+        introcs.assert_equals(image.getPixel(2,3),view[5])
+        expected = [image.getPixel(row,col) for row in range(1,4) for col in range(2,6)]
+        introcs.assert_equals(expected,view.getData())
+        introcs.assert_equals(expected,view.copy().getData())
+        
+        # Writes go to the image, and only inside the view
+        view.clearDirty()
+        view.setPixel(2,3,(1,2,3))
+        introcs.assert_equals((1,2,3),image.getPixel(3,5))
+        introcs.assert_equals([(2,3,1,1)],view.getDirty())
+        view[0] = (4,5,6)
+        introcs.assert_equals((4,5,6),image.getPixel(1,2))
+        inner = view.view(1,1,2,2)
+        introcs.assert_equals((2,3),inner.getOrigin())
+        introcs.assert_true(inner.getSource() is image)
+        inner.setBuffer(bytes(12))
+        introcs.assert_equals((0,0,0),image.getPixel(3,4))
+        introcs.assert_equals((0,0,0),view.getPixel(1,1))
+        introcs.assert_equals(expected[4],image.getPixel(2,2))
+        introcs.assert_equals(tuple(data[3*13:3*13+3]),image.getPixel(1,6))
+        introcs.assert_error(view.getPixel,3,0,message='getPixel does not enforce the precondition on row')
+        introcs.assert_error(view.setWidth,3,message='setWidth does not enforce the precondition on value')
+        introcs.assert_error(image.view,3,2,3,4,message='view does not enforce the precondition on height')
+    
+    # Writing through a view does not change copies of the image
+    image = a6image.Image(data[:],7)
+    copy  = image.copy()
+    image.view(0,0,5,7).setBuffer(bytes(3*35))
+    introcs.assert_equals(bytes(data),bytes(copy.getView()))
+    introcs.assert_equals(bytes(3*35),bytes(image.getView()))
+
+
+def test_summed_area():
+    """
+    Tests the class SummedArea
+    """
+    print('Testing summed-area tables')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    
+    for image in [a6image.Image(p,3), a6image.Image(a6image.Image(p,3).getBuffer(),3)]:
+        sums = a6image.SummedArea(image)
+        introcs.assert_equals(3,sums.getWidth())
+        introcs.assert_equals(2,sums.getHeight())
+        introcs.assert_equals((766,766,766),sums.getSum(0,0,2,3))
+        introcs.assert_equals((319,319,319),sums.getSum(0,0,1,3))
+        introcs.assert_equals((192,319,383),sums.getSum(1,0,1,2))
+        introcs.assert_equals((128,64,255),sums.getSum(1,1,1,1))
+        introcs.assert_equals((0,0,0),sums.getSum(1,1,0,2))
+        introcs.assert_equals((96.0,159.5,191.5),sums.getMean(1,0,1,2))
+        
+        # The table does not change with the image
+        image.setPixel(0,0,(0,0,0))
+        introcs.assert_equals((766,766,766),sums.getSum(0,0,2,3))
+        
+        introcs.assert_error(sums.getSum,0,0,3,1,  message='getSum does not enforce the precondition on height')
+        introcs.assert_error(sums.getSum,0,2,1,2,  message='getSum does not enforce the precondition on width')
+        introcs.assert_error(sums.getMean,0,0,0,1, message='getMean does not enforce the precondition on height')
+
+
 ## All of these tests hava a familiar form
 
 def compare_images(image1,image2,file1,file2):
@@ -334,17 +956,20 @@ def compare_images(image1,image2,file1,file2):
                                   ' at ('+str(col)+','+str(row)+')')
 
 
-def test_reflect_vert():
+def test_reflect_vert(backend):
     """
     Tests the method reflectVert in class Filter
+    
+    Parameter backend: The filter backend to test
+    Precondition: backend is a string in Filter.BACKENDS
     """
-    print('Testing method reflectVert')
+    print('Testing method reflectVert ('+backend+')')
 
     file1 = 'blocks'
     file2 = 'blocks-reflect-vertical'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.reflectVert()
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -353,23 +978,26 @@ def test_reflect_vert():
     file2 = 'home-reflect-vertical'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.reflectVert()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_monochromify():
+def test_monochromify(backend):
     """
     Tests the method monochromify in class Filter
+    
+    Parameter backend: The filter backend to test
+    Precondition: backend is a string in Filter.BACKENDS
     """
-    print('Testing method monochromify (greyscale)')
+    print('Testing method monochromify (greyscale, '+backend+')')
     
     file1 = 'blocks'
     file2 = 'blocks-grey'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.monochromify(False)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -378,18 +1006,18 @@ def test_monochromify():
     file2 = 'home-grey'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.monochromify(False)
     compare_images(editor.getCurrent(),image2,file1,file2)
     
-    print('Testing method monochromify (sepia)')
+    print('Testing method monochromify (sepia, '+backend+')')
     
     file1 = 'blocks'
     file2 = 'blocks-sepia'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.monochromify(True)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -398,23 +1026,26 @@ def test_monochromify():
     file2 = 'home-sepia'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.monochromify(True)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_jail():
+def test_jail(backend):
     """
     Tests the method jail in class Filter
+    
+    Parameter backend: The filter backend to test
+    Precondition: backend is a string in Filter.BACKENDS
     """
-    print('Testing method jail')
+    print('Testing method jail ('+backend+')')
     
     file1 = 'blocks'
     file2 = 'blocks-jail'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.jail()
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -423,23 +1054,26 @@ def test_jail():
     file2 = 'home-jail'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.jail()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_vignette():
+def test_vignette(backend):
     """
     Tests the method vignette in class Filter
+    
+    Parameter backend: The filter backend to test
+    Precondition: backend is a string in Filter.BACKENDS
     """
-    print('Testing method vignette')
+    print('Testing method vignette ('+backend+')')
     
     file1 = 'blocks'
     file2 = 'blocks-vignette'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.vignette()
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -448,23 +1082,26 @@ def test_vignette():
     file2 = 'home-vignette'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.vignette()
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
-def test_pixellate():
+def test_pixellate(backend):
     """
     Tests the method pixellate in class Filter
+    
+    Parameter backend: The filter backend to test
+    Precondition: backend is a string in Filter.BACKENDS
     """
-    print('Testing method pixellate')
+    print('Testing method pixellate ('+backend+')')
     
     file1 = 'blocks'
     file2 = 'blocks-pixellate-10'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(10)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -472,7 +1109,7 @@ def test_pixellate():
     file2 = 'blocks-pixellate-20'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(20)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -480,7 +1117,7 @@ def test_pixellate():
     file2 = 'blocks-pixellate-50'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(50)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -489,7 +1126,7 @@ def test_pixellate():
     file2 = 'home-pixellate-10'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(10)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -497,7 +1134,7 @@ def test_pixellate():
     file2 = 'home-pixellate-20'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(20)
     compare_images(editor.getCurrent(),image2,file1,file2)
@@ -505,12 +1142,806 @@ def test_pixellate():
     file2 = 'home-pixellate-50'
     image1 = load_image(file1)
     image2 = load_image(file2)
-    editor = a6filter.Filter(image1)
+    editor = a6filter.Filter(image1,backend)
     
     editor.pixellate(50)
     compare_images(editor.getCurrent(),image2,file1,file2)
 
 
+def test_pixel_maps():
+    """
+    Tests the methods mapChannels, mapPixels and contrast in class Filter
+    """
+    print('Testing pixel maps')
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    
+    for image in [a6image.Image(p[:],2), a6image.Image(a6image.Image(p,2).getBuffer(),2)]:
+        editor = a6filter.Filter(image)
+        editor.mapChannels(lambda v: v // 2)
+        introcs.assert_equals([tuple(v // 2 for v in x) for x in p],editor.getCurrent().getData())
+        editor.clear()
+        editor.mapChannels(lambda v: v,lambda v: 0,lambda v: 255-v)
+        introcs.assert_equals([(x[0],0,255-x[2]) for x in p],editor.getCurrent().getData())
+        editor.clear()
+        
+        calls = []
+        def swap(pixel):
+            calls.append(pixel)
+            return (pixel[2],pixel[1],pixel[0])
+        editor.getCurrent()[3] = p[0]
+        editor.mapPixels(swap)
+        introcs.assert_equals((0,64,255),editor.getCurrent()[0])
+        introcs.assert_equals((0,64,255),editor.getCurrent()[3])
+        introcs.assert_equals(5,len(calls))     # Each color only once
+        
+        editor.clear()
+        editor.contrast(2)
+        introcs.assert_equals([(255,0,0),(0,255,0),(0,0,255),(0,255,128),(128,0,255),(255,128,0)],
+                              editor.getCurrent().getData())
+        
+        introcs.assert_error(editor.mapChannels,lambda v: v+1,  message='mapChannels does not enforce the precondition on the function')
+        introcs.assert_error(editor.mapPixels,lambda p: (0,0), message='mapPixels does not enforce the precondition on the function')
+        introcs.assert_error(editor.contrast,-1,  message='contrast does not enforce the precondition on the factor')
+
+
+def test_mask_cache():
+    """
+    Tests the vignette mask cache of class Filter
+    """
+    print('Testing vignette mask cache')
+    cache = a6filter._MaskCache(100)
+    calls = []
+    def make(size):
+        calls.append(size)
+        return a6filter.array('d',[0.5]*size)
+    
+    introcs.assert_equals(5,len(cache.get('a',lambda: make(5))))
+    introcs.assert_equals(5,len(cache.get('a',lambda: make(5))))
+    introcs.assert_equals([5],calls)
+    introcs.assert_equals(40,cache.getSize())
+    cache.get('b',lambda: make(5))
+    cache.get('a',lambda: make(5))          # Now b is the least recently used
+    cache.get('c',lambda: make(5))
+    introcs.assert_equals(2,len(cache))
+    introcs.assert_equals(80,cache.getSize())
+    cache.get('a',lambda: make(5))
+    introcs.assert_equals([5,5,5],calls)    # a was kept
+    cache.get('b',lambda: make(5))
+    introcs.assert_equals([5,5,5,5],calls)  # b was evicted
+    cache.get('d',lambda: make(20))         # Too big to keep
+    introcs.assert_equals(2,len(cache))
+    cache.setCapacity(50)
+    introcs.assert_equals(1,len(cache))
+    introcs.assert_equals(40,cache.getSize())
+    cache.clear()
+    introcs.assert_equals(0,cache.getSize())
+    introcs.assert_error(cache.setCapacity,-1,message='setCapacity does not enforce the precondition on value')
+    
+    # Masks have one factor per pixel, and the mask of a 12 MP photo fits
+    capacity = a6filter.Filter.MASKS.getCapacity()
+    introcs.assert_true(capacity >= 8*4000*3000)
+    introcs.assert_equals(12,len(a6filter.Filter(a6image.Image(bytearray(3),1))._vignetteMask(3,4)))
+    
+    # Repeated vignettes reuse the mask and get the same answer
+    a6filter.Filter.MASKS.clear()
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    editor = a6filter.Filter(a6image.Image(p[:],3),'python')
+    editor.vignette()
+    expected = editor.getCurrent().getData()
+    introcs.assert_equals(1,len(a6filter.Filter.MASKS))
+    editor = a6filter.Filter(a6image.Image(p[:],3),'python')
+    editor.vignette()
+    introcs.assert_equals(expected,editor.getCurrent().getData())
+    introcs.assert_equals(1,len(a6filter.Filter.MASKS))
+    a6filter.Filter.MASKS.setCapacity(0)
+    editor = a6filter.Filter(a6image.Image(p[:],2),'python')
+    editor.vignette()
+    introcs.assert_equals(0,len(a6filter.Filter.MASKS))
+    a6filter.Filter.MASKS.setCapacity(capacity)
+    
+    # A band of a taller image uses the cached mask of the whole image, or
+    # only computes its own rows if that mask does not fit
+    if not a6filter.numpy is None:
+        editor = a6filter.Filter(a6image.Image(p[:],3),'numpy')
+        pixels = a6filter.numpy.arange(3*6*4,dtype=a6filter.numpy.uint8).reshape(6,4,3)
+        whole  = editor._vignetteNumpy(pixels)
+        a6filter.Filter.MASKS.clear()
+        band = editor._vignetteNumpy(pixels[2:5],2,6)
+        introcs.assert_equals(whole[2:5].tolist(),band.tolist())
+        introcs.assert_equals(1,len(a6filter.Filter.MASKS))
+        a6filter.Filter.MASKS.setCapacity(8*6*4-1)
+        band = editor._vignetteNumpy(pixels[2:5],2,6)
+        introcs.assert_equals(whole[2:5].tolist(),band.tolist())
+        introcs.assert_equals(0,len(a6filter.Filter.MASKS))
+        a6filter.Filter.MASKS.setCapacity(capacity)
+
+
+def test_transform():
+    """
+    Tests the method transform in class Filter
+    """
+    import random
+    print('Testing method transform')
+    
+    backends = list(a6filter.Filter.BACKENDS)
+    if a6filter.numpy is None:
+        backends.remove('numpy')
+    
+    # The algebra
+    compose = a6filter._compose_transforms
+    moves = a6filter._TRANSFORMS
+    identity = a6filter._IDENTITY
+    rotation = moves['rotateRight']
+    for x in range(3):
+        introcs.assert_not_equals(identity,rotation)
+        rotation = compose(rotation,moves['rotateRight'])
+    introcs.assert_equals(identity,rotation)
+    introcs.assert_equals(moves['rotateRight'],compose(moves['transpose'],moves['reflectHori']))
+    introcs.assert_equals(moves['rotateLeft'],compose(moves['transpose'],moves['reflectVert']))
+    introcs.assert_equals(moves['rotateLeft'],compose(moves['rotateRight'],
+                                                      compose(moves['reflectHori'],moves['reflectVert'])))
+    for name in moves:
+        if name != 'rotateRight' and name != 'rotateLeft':
+            introcs.assert_equals(identity,compose(moves[name],moves[name]))
+    
+    # Every sequence agrees with moving one pixel at a time
+    random.seed(3110)
+    data = [tuple(random.randrange(256) for x in range(3)) for y in range(7*5)]
+    names = list(moves)
+    for trial in range(40):
+        sequence = [random.choice(names) for x in range(trial % 6)]
+        pixels = [data[7*row:7*row+7] for row in range(5)]
+        for name in sequence:
+            if name in ['transpose','rotateRight','rotateLeft']:
+                pixels = [list(column) for column in zip(*pixels)]
+            if name in ['reflectVert','rotateLeft']:
+                pixels = pixels[::-1]
+            if name in ['reflectHori','rotateRight']:
+                pixels = [row[::-1] for row in pixels]
+        expected = [pixel for row in pixels for pixel in row]
+        for backend in backends:
+            for image in [a6image.Image(data[:],7),a6image.Image(a6image.Image(data,7).getBuffer(),7)]:
+                editor = a6filter.Filter(image,backend)
+                editor.transform(sequence)
+                introcs.assert_equals(len(pixels[0]),editor.getCurrent().getWidth())
+                introcs.assert_equals(expected,editor.getCurrent().getData())
+    
+    editor = a6filter.Filter(a6image.Image(data[:],7))
+    introcs.assert_error(editor.transform,['invert'],message='transform does not enforce the precondition on names')
+    introcs.assert_error(editor.transform,'transpose',message='transform does not enforce the precondition on names')
+
+
+def test_pipeline():
+    """
+    Tests the method pipeline in class Filter
+    """
+    import random
+    print('Testing method pipeline')
+    
+    backends = list(a6filter.Filter.BACKENDS)
+    if a6filter.numpy is None:
+        backends.remove('numpy')
+    
+    recipes = [[],[('invert',)],[('contrast',1.5),('invert',),('contrast',0.5)],
+               [('monochromify',True),('vignette',),('invert',)],
+               [('invert',),('monochromify',False),('contrast',2),('rotateLeft',),
+                ('pixellate',4),('invert',),('blur',1),('transpose',)],
+               [('rotateRight',),('invert',),('reflectVert',),('monochromify',True),
+                ('transpose',),('jail',),('rotateLeft',),('contrast',0.5),('rotateLeft',)]]
+    random.seed(2110)
+    data = [tuple(random.randrange(256) for x in range(3)) for y in range(17*11)]
+    for recipe in recipes:
+        expected = a6filter.Filter(a6image.Image(data[:],17),'python')
+        for action in recipe:
+            getattr(expected,action[0])(*action[1:])
+        expected = expected.getCurrent()
+        for backend in backends:
+            editor = a6filter.Filter(a6image.Image(a6image.Image(data,17).getBuffer(),17),backend)
+            editor.increment()
+            editor.pipeline(recipe)
+            compare_images(editor.getCurrent(),expected,backend+' pipeline','separate actions')
+            editor.undo()
+            introcs.assert_equals(data,editor.getCurrent().getData())
+    
+    # A failed pipeline leaves the image unchanged
+    for backend in backends:
+        editor = a6filter.Filter(a6image.Image(data[:],17),backend)
+        introcs.assert_error(editor.pipeline,[('invert',),('rotateLeft',),('contrast',-1)])
+        introcs.assert_equals(17,editor.getCurrent().getWidth())
+        introcs.assert_equals(data,editor.getCurrent().getData())
+        introcs.assert_error(editor.pipeline,[('invert',),('undo',)],message='pipeline does not enforce the precondition on operations')
+        introcs.assert_error(editor.pipeline,'invert',message='pipeline does not enforce the precondition on operations')
+
+
+def test_tiled():
+    """
+    Tests that tiled filters in several processes match the serial ones
+    """
+    import random
+    print('Testing tiled filters')
+    if a6filter.numpy is None:
+        print('Skipping tiled filters (NumPy is not installed)')
+        return
+    
+    actions = [('invert',),('monochromify',False),('monochromify',True),('contrast',1.5),
+               ('vignette',),('pixellate',3),('pixellate',7),('pixellate',60),
+               ('blur',0),('blur',2),('blur',9),('jail',),('rotateLeft',)]
+    minimum = a6filter.Filter.MIN_TILED
+    a6filter.Filter.MIN_TILED = 1
+    try:
+        random.seed(4110)
+        for (width, height) in [(23,41),(9,5),(1,1)]:
+            data = bytearray(random.randrange(256) for x in range(3*width*height))
+            for action in actions:
+                if action[0] == 'jail' and (width < 8 or height < 6):
+                    continue
+                expected = a6filter.Filter(a6image.Image(data[:],width),'numpy')
+                getattr(expected,action[0])(*action[1:])
+                editor = a6filter.Filter(a6image.Image(data[:],width),'numpy')
+                editor.setProcesses(3)
+                introcs.assert_equals(3,editor.getProcesses())
+                getattr(editor,action[0])(*action[1:])
+                compare_images(editor.getCurrent(),expected.getCurrent(),'tiled '+action[0],'serial '+action[0])
+    finally:
+        a6filter.Filter.MIN_TILED = minimum
+    
+    editor = a6filter.Filter(a6image.Image(data[:],width),'numpy')
+    introcs.assert_error(editor.setProcesses,0,message='setProcesses does not enforce the precondition on value')
+
+
+def test_progress():
+    """
+    Tests progress reports and cancellation of the long filters
+    """
+    import random
+    print('Testing progress and cancellation')
+    
+    class Monitor(object):
+        def __init__(self, limit=None):
+            self.reports = []
+            self.limit = limit
+        def setProgress(self, value):
+            self.reports.append(value)
+        def isCancelled(self):
+            return not self.limit is None and len(self.reports) >= self.limit
+    
+    actions = [('invert',),('monochromify',False),('monochromify',True),('contrast',1.5),
+               ('vignette',),('pixellate',3),('blur',2)]
+    backends = [backend for backend in a6filter.Filter.BACKENDS 
+                if backend != 'numpy' or not a6filter.numpy is None]
+    chunk = a6filter.Filter.CHUNK_PIXELS
+    a6filter.Filter.CHUNK_PIXELS = 40
+    try:
+        random.seed(1110)
+        width, height = (13,17)
+        data = bytearray(random.randrange(256) for x in range(3*width*height))
+        for backend in backends:
+            for action in actions:
+                if backend == 'python' and action[0] in ('invert','contrast'):
+                    continue    # A single table lookup, so never slow
+                expected = a6filter.Filter(a6image.Image(data[:],width),backend)
+                getattr(expected,action[0])(*action[1:])
+                
+                # Chunks give the same result, with increasing progress
+                editor = a6filter.Filter(a6image.Image(data[:],width),backend)
+                monitor = Monitor()
+                editor.setMonitor(monitor)
+                introcs.assert_true(editor.getMonitor() is monitor)
+                getattr(editor,action[0])(*action[1:])
+                compare_images(editor.getCurrent(),expected.getCurrent(),
+                               backend+' chunked '+action[0],backend+' '+action[0])
+                introcs.assert_true(len(monitor.reports) > 1)
+                introcs.assert_equals(sorted(monitor.reports),monitor.reports)
+                introcs.assert_floats_equal(1.0,monitor.reports[-1])
+                
+                # Cancelling stops part way, and undo restores the image
+                editor = a6filter.Filter(a6image.Image(data[:],width),backend)
+                editor.setMonitor(Monitor(2))
+                editor.increment()
+                try:
+                    getattr(editor,action[0])(*action[1:])
+                    introcs.quit_with_error(action[0]+' was not cancelled')
+                except a6editor.Cancelled:
+                    pass
+                editor.undo()
+                introcs.assert_equals(bytes(data),bytes(editor.getCurrent().getView()))
+        
+        # The vignette chunks share one cached mask for the whole image
+        if 'numpy' in backends:
+            a6filter.Filter.MASKS.clear()
+            for trial in range(2):
+                editor = a6filter.Filter(a6image.Image(data[:],width),'numpy')
+                editor.setMonitor(Monitor())
+                editor.vignette()
+                introcs.assert_equals(1,len(a6filter.Filter.MASKS))
+    finally:
+        a6filter.Filter.CHUNK_PIXELS = chunk
+    
+    editor = a6filter.Filter(a6image.Image(data[:],width))
+    introcs.assert_error(editor.setMonitor,'monitor',message='setMonitor does not enforce the precondition on value')
+
+
+def test_lazy():
+    """
+    Tests lazy mode (deferred actions) in class Filter
+    """
+    import random
+    print('Testing lazy mode')
+    
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    editor = a6filter.Filter(a6image.Image(p[:],3))
+    introcs.assert_false(editor.isLazy())
+    editor.setLazy(True)
+    introcs.assert_true(editor.isLazy())
+    
+    # Redundant actions are never done
+    editor.invert()
+    editor.reflectVert()
+    editor.invert()
+    editor.reflectVert()
+    introcs.assert_equals([],editor.getDeferred())
+    editor.rotateRight()
+    editor.rotateRight()
+    editor.pixellate(2)
+    editor.pixellate(2)
+    editor.monochromify(False)
+    editor.monochromify(False)
+    introcs.assert_equals([('reflectHori',),('reflectVert',),('pixellate',2),
+                           ('monochromify',False),('monochromify',False)],editor.getDeferred())
+    introcs.assert_equals(p,editor._current.getData())
+    
+    # Reading the image does the work
+    expected = a6filter.Filter(a6image.Image(p[:],3))
+    expected.pipeline([('rotateRight',),('rotateRight',),('pixellate',2),
+                       ('monochromify',False),('monochromify',False)])
+    introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+    introcs.assert_equals([],editor.getDeferred())
+    
+    # Undo throws the deferred actions away, increment does them
+    editor.increment()
+    editor.blur(1)
+    introcs.assert_equals([('blur',1)],editor.getDeferred())
+    introcs.assert_true(editor.undo())
+    introcs.assert_equals([],editor.getDeferred())
+    introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+    editor.contrast(2)
+    editor.increment()
+    introcs.assert_equals([],editor.getDeferred())
+    expected.contrast(2)
+    introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+    editor.invert()
+    editor.setLazy(False)
+    expected.invert()
+    introcs.assert_equals([],editor.getDeferred())
+    introcs.assert_equals(expected.getCurrent().getData(),editor._current.getData())
+    introcs.assert_error(editor.pixellate,0,message='pixellate does not enforce the precondition on step')
+    introcs.assert_error(editor.setLazy,1,message='setLazy does not enforce the precondition on value')
+    
+    # Random sequences give the same pixels as eager filters
+    random.seed(2110)
+    actions = [('invert',),('transpose',),('reflectHori',),('reflectVert',),('rotateRight',),
+               ('rotateLeft',),('monochromify',False),('monochromify',True),('jail',),
+               ('vignette',),('pixellate',3),('contrast',0.5),('blur',1)]
+    width, height = (12,9)
+    data = bytearray(random.randrange(256) for x in range(3*width*height))
+    for backend in a6filter.Filter.BACKENDS:
+        if backend == 'numpy' and a6filter.numpy is None:
+            continue
+        for trial in range(20):
+            sequence = [random.choice(actions) for x in range(random.randrange(1,8))]
+            expected = a6filter.Filter(a6image.Image(data[:],width),backend)
+            editor = a6filter.Filter(a6image.Image(data[:],width),backend)
+            editor.setLazy(True)
+            for action in sequence:
+                getattr(expected,action[0])(*action[1:])
+                getattr(editor,action[0])(*action[1:])
+            introcs.assert_true(len(editor.getDeferred()) <= len(sequence))
+            compare_images(editor.getCurrent(),expected.getCurrent(),'lazy '+repr(sequence),'eager')
+
+
+def test_proxy():
+    """
+    Tests the proxy images (getProxy) in class Editor and previews in class Filter
+    """
+    print('Testing proxy previews')
+    
+    width, height = (40,30)
+    data = bytearray(x*7 % 256 for x in range(3*width*height))
+    editor = a6filter.Filter(a6image.Image(data[:],width))
+    introcs.assert_true(editor.getProxy(width*height) is editor.getCurrent())
+    proxy = editor.getProxy(100)
+    introcs.assert_equals((10,8),(proxy.getWidth(),proxy.getHeight()))
+    introcs.assert_equals(editor.getCurrent().shrink(4).getData(),proxy.getData())
+    introcs.assert_true(editor.getProxy(100) is proxy)
+    introcs.assert_true(editor.getProxy(300) is editor.getProxy(300))
+    
+    # A preview scales the sizes in pixels, and changes nothing
+    result = editor.preview(proxy,'pixellate',16)
+    expected = a6filter.Filter(proxy)
+    expected.pixellate(4)
+    introcs.assert_equals(expected.getCurrent().getData(),result.getData())
+    result = editor.preview(proxy,'pipeline',[('blur',16),('rotateLeft',)])
+    expected = a6filter.Filter(proxy)
+    expected.pipeline([('blur',4),('rotateLeft',)])
+    introcs.assert_equals(expected.getCurrent().getData(),result.getData())
+    introcs.assert_equals(bytes(data),bytes(editor.getCurrent().getView()))
+    introcs.assert_equals(editor.getCurrent().shrink(4).getData(),proxy.getData())
+    
+    # The history invalidates the proxies
+    editor.increment()
+    editor.invert()
+    changed = editor.getProxy(100)
+    introcs.assert_false(changed is proxy)
+    introcs.assert_equals(editor.getCurrent().shrink(4).getData(),changed.getData())
+    editor.undo()
+    introcs.assert_equals(proxy.getData(),editor.getProxy(100).getData())
+    editor.increment()
+    editor.rotateRight()
+    changed = editor.getProxy(100)
+    introcs.assert_equals((8,10),(changed.getWidth(),changed.getHeight()))
+    editor.clear()
+    introcs.assert_equals(proxy.getData(),editor.getProxy(100).getData())
+    introcs.assert_error(editor.getProxy,0,message='getProxy does not enforce the precondition on limit')
+    
+    # A lazy filter does its deferred edits first
+    editor = a6filter.Filter(a6image.Image(data[:],width))
+    editor.setLazy(True)
+    proxy = editor.getProxy(100)
+    editor.increment()
+    editor.invert()
+    introcs.assert_equals(['invert'],[action[0] for action in editor.getDeferred()])
+    changed = editor.getProxy(100)
+    introcs.assert_equals([],editor.getDeferred())
+    introcs.assert_equals(editor.getCurrent().shrink(4).getData(),changed.getData())
+    introcs.assert_false(changed.getData() == proxy.getData())
+    editor.invert()
+    editor.flush()
+    introcs.assert_equals(proxy.getData(),editor.getProxy(100).getData())
+
+
+def test_stream():
+    """
+    Tests streaming filters over a TiledImage (method stream in class Filter)
+    """
+    import os
+    import random
+    import tempfile
+    print('Testing method stream')
+    
+    random.seed(4111)
+    width, height = (13,23)
+    data = bytearray(random.randrange(256) for x in range(3*width*height))
+    actions = [('invert',),('monochromify',False),('monochromify',True),('contrast',0.5),
+               ('vignette',),('pixellate',4),('pixellate',30)]
+    backends = [backend for backend in a6filter.Filter.BACKENDS 
+                if backend != 'numpy' or not a6filter.numpy is None]
+    tiles = a6image.TiledImage.TILE_BYTES
+    a6image.TiledImage.TILE_BYTES = 3*width*5
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder,'image.raw')
+            for backend in backends:
+                for action in actions:
+                    a6image.Image(data[:],width).saveRaw(path)
+                    editor = a6filter.Filter(a6image.Image(data[:],width),backend)
+                    with a6image.TiledImage(path,3*width*5) as tiled:
+                        editor.stream(tiled,*action)
+                    introcs.assert_equals(bytes(data),bytes(editor.getCurrent().getView()))
+                    getattr(editor,action[0])(*action[1:])
+                    compare_images(a6image.Image.openMmap(path),editor.getCurrent(),
+                                   'streamed '+repr(action),backend+' '+repr(action))
+            
+            with a6image.TiledImage(path) as tiled:
+                introcs.assert_error(editor.stream,tiled,'blur',1,message='stream does not enforce the precondition on action')
+                introcs.assert_error(editor.stream,tiled,'pixellate',0,message='stream does not enforce the precondition on action')
+                introcs.assert_error(editor.stream,editor.getCurrent(),'invert',message='stream does not enforce the precondition on image')
+    finally:
+        a6image.TiledImage.TILE_BYTES = tiles
+
+
+def test_selection():
+    """
+    Tests editing a selection (an image view) in place in class Filter
+    """
+    print('Testing selections')
+    
+    width, height = (20,15)
+    data = bytearray(x*11 % 256 for x in range(3*width*height))
+    for backend in a6filter.Filter.BACKENDS:
+        if backend == 'numpy' and a6filter.numpy is None:
+            continue
+        image  = a6image.Image(data[:],width)
+        view   = image.view(2,3,9,9)
+        editor = a6filter.Filter(view,backend)
+        introcs.assert_true(editor.getCurrent() is view)
+        introcs.assert_equals(view.getData(),editor.getOriginal().getData())
+        crop = a6filter.Filter(view.copy(),backend)
+        for action in [('blur',2),('monochromify',True),('rotateLeft',),('pixellate',3)]:
+            editor.increment()
+            getattr(editor,action[0])(*action[1:])
+            getattr(crop,action[0])(*action[1:])
+        introcs.assert_equals(crop.getCurrent().getData(),view.getData())
+        
+        # Nothing outside the selection changed
+        for row in range(height):
+            for col in range(width):
+                if not (2 <= row < 11 and 3 <= col < 12):
+                    pos = 3*(row*width+col)
+                    introcs.assert_equals(tuple(data[pos:pos+3]),image.getPixel(row,col))
+        
+        # The history only holds the selection
+        introcs.assert_true(editor.getStats()['resident'] <= 3*81*5)
+        editor.undo()
+        editor.clear()
+        introcs.assert_equals(bytes(data),bytes(image.getView()))
+
+
+def test_backends():
+    """
+    Tests that every backend of class Filter produces the same images.
+    
+    The test images are not square, and their sizes are not multiples of the
+    pixellate steps, so this catches mistakes the tests above cannot.
+    """
+    import random
+    print('Testing that all backends agree')
+    
+    backends = [b for b in a6filter.Filter.BACKENDS if b != 'python']
+    if a6filter.numpy is None:
+        backends.remove('numpy')
+    
+    actions = [('invert',),('transpose',),('reflectHori',),('reflectVert',),
+               ('rotateLeft',),('rotateRight',),('monochromify',False),
+               ('monochromify',True),('jail',),('vignette',),('pixellate',3),
+               ('pixellate',5),('pixellate',60),('blur',0),('blur',2),('blur',40),
+               ('contrast',0),('contrast',0.5),('contrast',2.5)]
+    random.seed(1110)
+    for (width, height) in [(58,13),(9,61),(1,1)]:
+        data = [tuple(random.randrange(256) for x in range(3)) for y in range(width*height)]
+        for action in actions:
+            if action[0] == 'jail' and (width < 8 or height < 6):
+                continue
+            expected = a6filter.Filter(a6image.Image(data[:],width),'python')
+            getattr(expected,action[0])(*action[1:])
+            expected = expected.getCurrent()
+            for backend in backends:
+                editor = a6filter.Filter(a6image.Image(data[:],width),backend)
+                getattr(editor,action[0])(*action[1:])
+                compare_images(editor.getCurrent(),expected,backend+' '+action[0],'python '+action[0])
+                buffered = a6image.Image(a6image.Image(data,width).getBuffer(),width)
+                editor = a6filter.Filter(buffered,backend)
+                getattr(editor,action[0])(*action[1:])
+                compare_images(editor.getCurrent(),expected,backend+' '+action[0],'python '+action[0])
+
+
+def test_load():
+    """
+    Tests the loading functions in module a6files
+    """
+    import os.path
+    import tempfile
+    from PIL import Image as CoreImage
+    print('Testing image loading')
+    
+    for file in ['blocks','home']:
+        path = os.path.join(os.path.split(__file__)[0],'tests',file+'.png')
+        image, seconds = a6files.load_timed(path)
+        introcs.assert_true(image.isBuffered())
+        introcs.assert_true(seconds >= 0)
+        compare_images(image,load_image(file),'a6files '+file,file)
+        introcs.assert_true(type(image.getRawBuffer()) == bytearray)
+    
+    # The pixels are unpacked into one buffer, in several blocks if large
+    picture = CoreImage.frombytes('RGB',(300,200),bytes(range(256))*703+bytes(32))
+    buffer  = a6files.unpack_pixels(picture)
+    introcs.assert_equals(bytearray,type(buffer))
+    introcs.assert_equals(picture.tobytes(),bytes(buffer))
+    introcs.assert_error(a6files.unpack_pixels,picture.convert('L'),message='unpack_pixels does not enforce the precondition on image')
+    
+    # Draft mode decodes a JPEG at a reduced scale
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder,'large.jpg')
+        CoreImage.new('RGB',(640,480),(200,100,50)).save(path)
+        image = a6files.load_image(path)
+        introcs.assert_equals((640,480),(image.getWidth(),image.getHeight()))
+        image = a6files.load_image(path,(160,120))
+        introcs.assert_equals((160,120),(image.getWidth(),image.getHeight()))
+        image = a6files.load_image(path,(200,200))
+        introcs.assert_equals((320,240),(image.getWidth(),image.getHeight()))
+        introcs.assert_error(a6files.load_image,path,(0,10),message='load_image does not enforce the precondition on preview')
+
+
+def test_save():
+    """
+    Tests the saving functions in module a6files
+    """
+    import os
+    import tempfile
+    print('Testing image saving')
+    
+    image  = load_image('home')
+    blocks = a6image.Image(load_image('blocks').getBuffer(),29)
+    introcs.assert_equals((104,104),a6files.to_pil(image).size)
+    introcs.assert_equals(image[5],a6files.to_pil(image).getpixel((5,0)))
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder,'home.png')
+        a6files.save_image(image,path)
+        compare_images(a6files.load_image(path),image,'saved home','home')
+        size = os.path.getsize(path)
+        a6files.save_image(image,path,0)
+        introcs.assert_true(os.path.getsize(path) > size)
+        compare_images(a6files.load_image(path),image,'saved home','home')
+        introcs.assert_error(a6files.save_image,image,path,10,message='save_image does not enforce the precondition on level')
+        
+        # A batch, with one file that cannot be written
+        jobs = [(image,os.path.join(folder,'a.png')),(blocks,os.path.join(folder,'b.png')),
+                (image,os.path.join(folder,'missing','c.png'))]
+        failures = a6files.save_images(jobs,1)
+        introcs.assert_equals([jobs[2][1]],[file for file, error in failures])
+        compare_images(a6files.load_image(jobs[1][1]),blocks,'saved blocks','blocks')
+        
+        # In the background, from a snapshot
+        results = []
+        expected = blocks.copy()
+        thread = a6files.save_async(jobs[:2],callback=results.append)
+        blocks[0] = (1,2,3)
+        thread.join()
+        introcs.assert_equals([[]],results)
+        compare_images(a6files.load_image(jobs[1][1]),expected,'saved blocks','blocks')
+
+
+def test_worker():
+    """
+    Tests the classes Job and Worker in module a6worker
+    """
+    import threading
+    import time
+    print('Testing class Worker')
+    
+    p = [(255, 64, 0),(0, 255, 64),(64, 0, 255),(64, 255, 128),(128, 64, 255),(255, 128, 64)]
+    gate = threading.Event()
+    class Blocker(object):
+        def block(self):
+            gate.wait()
+    
+    finished = []
+    worker = a6worker.Worker(finished.append)
+    editor = a6filter.Filter(a6image.Image(p[:],3))
+    blocker = Blocker()
+    introcs.assert_true(worker.isIdle())
+    
+    # While the worker is busy, rotations coalesce
+    first = worker.submit(blocker,'block')
+    while worker.getCurrent() is None:
+        time.sleep(0.001)
+    job1 = worker.submit(editor,'rotateRight')
+    job2 = worker.submit(editor,'rotateRight')
+    job3 = worker.submit(editor,'transpose')
+    job4 = worker.submit(editor,'invert')
+    job5 = worker.submit(editor,'reflectHori')
+    introcs.assert_true(job1 is job2)
+    introcs.assert_true(job1 is job3)
+    introcs.assert_false(job4 is job1)
+    introcs.assert_equals(['transform',['rotateRight','rotateRight','transpose']],job1.getAction())
+    introcs.assert_equals('pending',job1.getState())
+    introcs.assert_false(worker.isIdle())
+    introcs.assert_equals(3,worker.getPending())
+    job5.cancel()
+    gate.set()
+    introcs.assert_true(worker.join(10))
+    
+    introcs.assert_equals([first,job1,job4,job5],finished)
+    introcs.assert_equals(['done','done','done','cancelled'],[job.getState() for job in finished])
+    introcs.assert_equals(1.0,job4.getProgress())
+    expected = a6filter.Filter(a6image.Image(p[:],3))
+    expected.transform(['rotateRight','rotateRight','transpose'])
+    expected.invert()
+    introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+    introcs.assert_equals(2,editor.getStats()['versions'])
+    
+    # A failed job is undone
+    job = worker.submit(editor,'pixellate',0)
+    introcs.assert_true(job.wait(10))
+    introcs.assert_equals('failed',job.getState())
+    introcs.assert_true(isinstance(job.getError(),AssertionError))
+    introcs.assert_equals(expected.getCurrent().getData(),editor.getCurrent().getData())
+    introcs.assert_equals(2,editor.getStats()['versions'])
+    
+    # A job whose increment fails does not undo the edit before it
+    class Broken(object):
+        def __init__(self):
+            self.calls = []
+        def increment(self):
+            raise MemoryError('no room for the history')
+        def undo(self):
+            self.calls.append('undo')
+        def invert(self):
+            self.calls.append('invert')
+    broken = Broken()
+    job = worker.submit(broken,'invert')
+    introcs.assert_true(job.wait(10))
+    introcs.assert_equals('failed',job.getState())
+    introcs.assert_true(isinstance(job.getError(),MemoryError))
+    introcs.assert_equals([],broken.calls)
+    
+    # Undo is not an edit
+    job = worker.submit(editor,'undo')
+    worker.join(10)
+    introcs.assert_equals('done',job.getState())
+    introcs.assert_equals(1,editor.getStats()['versions'])
+    
+    # Cancel everything
+    gate.clear()
+    first = worker.submit(blocker,'block')
+    while worker.getCurrent() is None:
+        time.sleep(0.001)
+    job = worker.submit(editor,'invert')
+    worker.cancel()
+    introcs.assert_true(first.isCancelled())
+    gate.set()
+    worker.join(10)
+    introcs.assert_equals('done',first.getState())
+    introcs.assert_equals('cancelled',job.getState())
+    introcs.assert_equals(1,editor.getStats()['versions'])
+    
+    worker.shutdown()
+    introcs.assert_error(worker.submit,editor,'invert')
+    introcs.assert_error(job.setProgress,1.5,message='setProgress does not enforce the precondition on value')
+
+
+def test_batch():
+    """
+    Tests the batch processing functions in module a6batch
+    """
+    import os
+    import tempfile
+    print('Testing batch processing')
+    
+    operations = a6batch.parse_operations('monochromify:sepia, vignette,pixellate:3,contrast:1.5')
+    introcs.assert_equals([('monochromify',True),('vignette',),('pixellate',3),('contrast',1.5)],operations)
+    introcs.assert_equals([('monochromify',False),('invert',)],a6batch.parse_operations('monochromify,invert'))
+    introcs.assert_equals([('monochromify',False)],a6batch.parse_operations('monochromify:greyscale'))
+    introcs.assert_error(a6batch.parse_operations,'sharpen',error=ValueError)
+    introcs.assert_error(a6batch.parse_operations,'pixellate:big',error=ValueError)
+    for text in ['pixellate:0','monochromify:5','invert:1','contrast:-1','blur:1:2','pixellate:2.5']:
+        introcs.assert_error(a6batch.parse_operations,text,error=ValueError)
+    
+    folder = os.path.join(os.path.split(__file__)[0],'tests')
+    files  = [os.path.join(folder,name+'.png') for name in ('home','blocks','home')]
+    with tempfile.TemporaryDirectory() as output:
+        missing = os.path.join(output,'missing.png')
+        reports = []
+        # One byte of memory, so the files are processed one at a time
+        results = a6batch.process_files(files+[missing],operations,output,2,1,report=reports.append)
+        introcs.assert_equals(results,reports)
+        introcs.assert_equals(files+[missing],[result['file'] for result in results])
+        introcs.assert_true(isinstance(results[-1]['error'],FileNotFoundError))
+        # The two files named home.png do not overwrite each other
+        introcs.assert_equals([os.path.join(output,name) for name in ('home.png','blocks.png','home-2.png','missing.png')],
+                              [result['target'] for result in results])
+        for result in results[:-1]:
+            introcs.assert_true(result['load'] >= 0 and result['filter'] >= 0 and result['save'] >= 0)
+            expected = a6filter.Filter(a6files.load_image(result['file']))
+            expected.pipeline(operations)
+            compare_images(a6files.load_image(result['target']),expected.getCurrent(),
+                           result['target'],'filtered '+result['file'])
+        names = ['a/home.png','b/home.jpg','home-2.png','c/home.png']
+        introcs.assert_equals([os.path.join(output,name) for name in ('home.png','home-2.png','home-2-2.png','home-3.png')],
+                              a6batch.get_targets(names,output))
+        introcs.assert_true(a6batch.format_result(results[0]).startswith(files[0]+' -> '))
+        introcs.assert_true('FAILED' in a6batch.format_result(results[-1]))
+        introcs.assert_true('1 failed' in a6batch.format_summary(results,1.0))
+        
+        # Invalid arguments fail before any file is processed
+        introcs.assert_error(a6batch.process_files,files,[('pixellate',0)],output,error=ValueError)
+        
+        # The size of a raw file comes from its header
+        raw = os.path.join(output,'image.raw')
+        a6image.Image(bytearray(3*6*4),6).saveRaw(raw)
+        introcs.assert_equals(3*6*4,a6batch.get_size(raw))
+        introcs.assert_equals(0,a6batch.get_size(missing))
+
+
 def test_all():
     """
     Execute all of the test cases.
@@ -522,18 +1953,66 @@ def test_all():
     
     print('Testing class Image')
     test_image_init()
+    test_image_from_buffer()
     test_image_setters()
     test_image_operators()
     test_image_access()
     test_image_str()
     test_image_other()
+    test_image_buffer()
+    test_image_share()
+    test_image_dirty()
+    test_image_shrink()
+    test_image_raw()
+    test_tiled_image()
+    test_image_view()
+    test_image_bulk()
+    test_summed_area()
     print('Class Image passed all tests.')
     print()
     
+    print('Testing class Editor')
+    test_editor()
+    test_history()
+    test_history_budget()
+    print('Class Editor passed all tests.')
+    print()
+    
     print('Testing class Filter')
-    test_reflect_vert()
-    test_monochromify()
-    test_jail()
-    test_vignette()
-    test_pixellate()
+    for backend in a6filter.Filter.BACKENDS:
+        if backend == 'numpy' and a6filter.numpy is None:
+            print('Skipping backend numpy (NumPy is not installed)')
+            continue
+        test_reflect_vert(backend)
+        test_monochromify(backend)
+        test_jail(backend)
+        test_vignette(backend)
+        test_pixellate(backend)
+    test_pixel_maps()
+    test_mask_cache()
+    test_transform()
+    test_pipeline()
+    test_tiled()
+    test_progress()
+    test_lazy()
+    test_proxy()
+    test_stream()
+    test_selection()
+    test_backends()
     print('Class Filter passed all tests.')
+    print()
+    
+    print('Testing module a6files')
+    test_load()
+    test_save()
+    print('Module a6files passed all tests.')
+    print()
+    
+    print('Testing module a6worker')
+    test_worker()
+    print('Module a6worker passed all tests.')
+    print()
+    
+    print('Testing module a6batch')
+    test_batch()
+    print('Module a6batch passed all tests.')
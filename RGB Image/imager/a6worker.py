@@ -0,0 +1,379 @@
+"""
+A persistent background worker for the imager application.
+
+The original application started a new thread for every button press, and
+disabled the menu bar until that thread was done.  The classes in this module
+replace that with one long-lived thread and a queue of jobs.  Buttons can be
+pressed while a job is running; the new jobs simply wait their turn.  Jobs
+that are still waiting can be cancelled, and a waiting job may absorb a new
+one (e.g. several rotations in a row become a single rotation).
+
+The worker is a thread and not a process, because the jobs edit the images
+of the application in place.  This module does not depend on Kivy.
+"""
+import a6editor
+import threading
+from collections import deque
+
+
+class Job(object):
+    """
+    A class representing a single request to a Worker.
+
+    A job is an action (a method name plus arguments) to call on a target
+    object, usually an editor.  The job moves through the states 'pending'
+    (waiting in the queue), 'running', and then one of 'done', 'failed' or
+    'cancelled'.
+
+    A running action may report its progress with setProgress, and it may
+    check isCancelled to stop early.
+
+    Attribute STATES: A CLASS ATTRIBUTE for the possible job states
+    Invariant: STATES is a tuple of strings
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _target: The object the action is called on
+    # Invariant: _target is an object with a method for the action
+    #
+    # Attribute _finished: The event set when the job is finished
+    # Invariant: _finished is a threading.Event
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _action: The method name followed by its arguments
+    # Invariant: _action is a non-empty list whose first element is a string
+    #
+    # Attribute _state: The state of the job
+    # Invariant: _state is one of the strings in STATES
+    #
+    # Attribute _progress: The fraction of the job completed
+    # Invariant: _progress is a float in 0..1
+    #
+    # Attribute _cancelled: Whether the job has been asked to stop
+    # Invariant: _cancelled is a bool
+    #
+    # Attribute _error: The exception raised by the action
+    # Invariant: _error is an Exception, or None if the job has not failed
+
+    # The job states
+    STATES = ('pending','running','done','failed','cancelled')
+
+    # INITIALIZER
+    def __init__(self, target, action):
+        """
+        Initializes a pending job.
+
+        Parameter target: The object the action is called on
+        Precondition: target is an object with a method named action[0]
+
+        Parameter action: The method name followed by its arguments
+        Precondition: action is a non-empty list or tuple whose first element
+        is a string
+        """
+        assert len(action) > 0 and type(action[0]) == str, repr(action)+' is not a valid action'
+        self._target = target
+        self._action = list(action)
+        self._state  = 'pending'
+        self._progress  = 0.0
+        self._cancelled = False
+        self._error = None
+        self._finished = threading.Event()
+
+    # GETTERS AND SETTERS
+    def getTarget(self):
+        """
+        Returns the object the action is called on
+        """
+        return self._target
+
+    def getAction(self):
+        """
+        Returns a copy of the action (the method name followed by its arguments)
+        """
+        return self._action.copy()
+
+    def getState(self):
+        """
+        Returns the state of this job (one of STATES)
+        """
+        return self._state
+
+    def getError(self):
+        """
+        Returns the exception raised by the action, or None if there was none
+        """
+        return self._error
+
+    def getProgress(self):
+        """
+        Returns the fraction of this job completed (a float in 0..1)
+        """
+        return self._progress
+
+    def setProgress(self, value):
+        """
+        Sets the fraction of this job completed.
+
+        Parameter value: The fraction completed
+        Precondition: value is an int or float in 0..1
+        """
+        assert type(value) in [int,float] and 0 <= value <= 1, repr(value)+' is not a valid progress'
+        self._progress = float(value)
+
+    # STATUS METHODS
+    def isCancelled(self):
+        """
+        Returns True if this job has been asked to stop, False otherwise
+        """
+        return self._cancelled
+
+    def isFinished(self):
+        """
+        Returns True if this job is done, failed or cancelled, False otherwise
+        """
+        return self._finished.is_set()
+
+    def cancel(self):
+        """
+        Asks this job to stop.
+
+        A pending job will never run.  A running job stops only if its action
+        checks isCancelled.  Cancelling a finished job does nothing.
+        """
+        self._cancelled = True
+
+    def wait(self, timeout=None):
+        """
+        Waits for this job to finish, and returns True if it has finished.
+
+        Parameter timeout: The maximum number of seconds to wait
+        Precondition: timeout is an int or float >= 0, or None to wait forever
+        """
+        return self._finished.wait(timeout)
+
+    # HIDDEN METHODS
+    def _finish(self, state, error=None):
+        """
+        Marks this job as finished.
+
+        Parameter state: The final state
+        Precondition: state is 'done', 'failed' or 'cancelled'
+
+        Parameter error: The exception raised by the action
+        Precondition: error is an Exception or None
+        """
+        self._state = state
+        self._error = error
+        if state == 'done':
+            self._progress = 1.0
+        self._finished.set()
+
+
+class Worker(object):
+    """
+    A class representing a persistent thread that performs jobs in order.
+
+    Jobs are submitted with submit and performed one at a time, in the order
+    submitted.  If the target of a job has a method increment (like an
+    editor), it is called right before the action, so every job is one edit
+    in the edit history.  If the action then fails (or is cancelled), the
+    edit is undone, restoring the image.  The actions in UNRECORDED (like
+    undo itself) are not edits.
+
+    If the target has a method coalesce, it is used to merge a new job into
+    the last pending job (see submit).  If the target has a method 
+    setMonitor (like an editor), the job is its monitor while it runs, so 
+    the action can report progress and be cancelled part way through.
+
+    Attribute UNRECORDED: A CLASS ATTRIBUTE for the actions that are not edits
+    Invariant: UNRECORDED is a tuple of strings
+    """
+    # IMMUTABLE ATTRIBUTES (Fixed after initialization)
+    # Attribute _callback: The function called when a job finishes
+    # Invariant: _callback is None or a function taking a Job
+    #
+    # Attribute _lock: The lock protecting the queue
+    # Invariant: _lock is a threading.Condition
+    #
+    # Attribute _thread: The worker thread
+    # Invariant: _thread is a daemon threading.Thread
+    #
+    # MUTABLE ATTRIBUTES
+    # Attribute _queue: The pending jobs, oldest first
+    # Invariant: _queue is a deque of Job objects
+    #
+    # Attribute _current: The running job
+    # Invariant: _current is a Job, or None if no job is running
+    #
+    # Attribute _stopped: Whether the worker has been shut down
+    # Invariant: _stopped is a bool
+
+    # The actions that do not add to the edit history
+    UNRECORDED = ('undo','clear')
+
+    # INITIALIZER
+    def __init__(self, callback=None):
+        """
+        Initializes a worker and starts its thread.
+
+        When a job finishes (in any way), callback is called with the job.
+        It is called in the worker thread, so a GUI should pass it back to its
+        own thread.
+
+        Parameter callback: The function to call when a job finishes
+        Precondition: callback is None or a function taking a Job
+        """
+        self._callback = callback
+        self._lock  = threading.Condition()
+        self._queue = deque()
+        self._current = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run,daemon=True)
+        self._thread.start()
+
+    # GETTERS
+    def getCurrent(self):
+        """
+        Returns the running job, or None if no job is running
+        """
+        return self._current
+
+    def getPending(self):
+        """
+        Returns the number of jobs waiting to run
+        """
+        return len(self._queue)
+
+    def isIdle(self):
+        """
+        Returns True if no job is running or waiting, False otherwise
+        """
+        with self._lock:
+            return self._current is None and len(self._queue) == 0
+
+    # JOB METHODS
+    def submit(self, target, *action):
+        """
+        Adds a job to the queue and returns it.
+
+        If the last job in the queue is still pending, has the same target,
+        and the target has a method coalesce, then target.coalesce(old, new)
+        is called with the two actions.  If it returns an action, the pending
+        job is changed to that action and returned, instead of adding a new
+        job.  For example, a filter merges two rotations into one transform.
+
+        Parameter target: The object the action is called on
+        Precondition: target is an object with a method named action[0]
+
+        Parameter action: The method name followed by its arguments
+        Precondition: action is a non-empty list whose first element is a string
+        """
+        job = Job(target,action)
+        with self._lock:
+            assert not self._stopped, 'The worker has been shut down'
+            if self._queue and hasattr(target,'coalesce'):
+                last = self._queue[-1]
+                if last._target is target and not last._cancelled:
+                    merged = target.coalesce(last._action,job._action)
+                    if not merged is None:
+                        last._action = list(merged)
+                        return last
+            self._queue.append(job)
+            self._lock.notify_all()
+        return job
+
+    def cancel(self):
+        """
+        Cancels every pending job, and asks the running job to stop.
+        """
+        with self._lock:
+            if not self._current is None:
+                self._current.cancel()
+            for job in self._queue:
+                job.cancel()
+
+    def join(self, timeout=None):
+        """
+        Waits until no job is running or waiting, and returns True if so.
+
+        Parameter timeout: The maximum number of seconds to wait
+        Precondition: timeout is an int or float >= 0, or None to wait forever
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: self._current is None and len(self._queue) == 0, timeout)
+
+    def shutdown(self):
+        """
+        Cancels all jobs and stops the worker thread.
+
+        No more jobs may be submitted afterwards.
+        """
+        self.cancel()
+        with self._lock:
+            self._stopped = True
+            self._lock.notify_all()
+        self._thread.join()
+
+    # HIDDEN METHODS
+    def _run(self):
+        """
+        Performs jobs until the worker is shut down.
+        """
+        while True:
+            with self._lock:
+                self._lock.wait_for(lambda: self._stopped or len(self._queue) > 0)
+                if self._stopped:
+                    while self._queue:
+                        self._queue.popleft()._finish('cancelled')
+                    self._lock.notify_all()
+                    return
+                job = self._queue.popleft()
+                self._current = job
+
+            self._perform(job)
+            with self._lock:
+                self._current = None
+                self._lock.notify_all()
+            if not self._callback is None:
+                self._callback(job)
+
+    def _perform(self, job):
+        """
+        Performs a single job, and marks it as finished.
+
+        Parameter job: The job to perform
+        Precondition: job is a Job that was pending
+        """
+        if job._cancelled:
+            job._finish('cancelled')
+            return
+
+        job._state = 'running'
+        target = job._target
+        action = job._action
+        record = hasattr(target,'increment') and not action[0] in self.UNRECORDED
+        monitor = hasattr(target,'setMonitor')
+        recorded = False    # Only undo an edit this job added to the history
+        try:
+            if monitor:
+                target.setMonitor(job)
+            if record:
+                target.increment()
+                recorded = True
+            getattr(target,action[0])(*action[1:])
+        except Exception as e:
+            if recorded:
+                target.undo()
+            if isinstance(e,a6editor.Cancelled):
+                job._finish('cancelled')
+            else:
+                job._finish('failed',e)
+            return
+        finally:
+            if monitor:
+                target.setMonitor(None)
+
+        if job._cancelled and record:
+            target.undo()
+            job._finish('cancelled')
+        else:
+            job._finish('done')
@@ -23,8 +23,10 @@ from kivy.uix.boxlayout import BoxLayout
 from kivy.properties import *
 from kivy.app import App
 from kivy.metrics import sp
+from kivy.logger import Logger
 
 from widgets import *
+import a6worker
 import traceback
 
 class InterfacePanel(BoxLayout):
@@ -36,7 +38,17 @@ class InterfacePanel(BoxLayout):
     for additional (eyeball) testing beyond the provided test script
     
     The view for this application is defined the interface.kv file.
+    
+    For large images, an action is first done on a low-resolution proxy of
+    the image (see getProxy in class Editor), which is shown right away.  The
+    full-resolution result replaces it once the worker has done every action.
+    
+    Attribute PROXY_PIXELS: A CLASS ATTRIBUTE for the size of a preview
+    Invariant: PROXY_PIXELS is an int > 0 (a number of pixels)
     """
+    # Larger images get a preview (about the size of the image panel)
+    PROXY_PIXELS = 512*512
+    
     # These fields are 'hooks' to connect to the .kv file
     # The source file for the initial image
     source = StringProperty(ImagePanel.getResource('im_walker.png'))
@@ -79,6 +91,11 @@ class InterfacePanel(BoxLayout):
         """
         # For working with pop-ups (Hidden since not .kv aware)
         self._popup = None
+        # The persistent worker for the image actions
+        self.worker = a6worker.Worker(self.async_complete)
+        self.async_action = None
+        # The preview on display while the worker is busy (or None)
+        self.preview = None
         self.place_image('',self.source)
         self.imagedrop = ImageDropDown(choices=['load','save','undo','reset'], 
                                        save=[self.save_image], load=[self.load_image],
@@ -99,8 +116,6 @@ class InterfacePanel(BoxLayout):
                                        p50=[self.do_async,'pixellate',50],
                                        p100=[self.do_async,'pixellate',100],
                                        p200=[self.do_async,'pixellate',200])
-        self.async_action = None
-        self.async_thread = None
     
     # DIALOG BOXES
     def error(self, msg):
@@ -205,37 +220,33 @@ class InterfacePanel(BoxLayout):
             self._popup = None
     
     # FILE HANDLING
-    def read_image(self, file):
+    def read_image(self, file, preview=None):
         """
         Returns an Image object for the give file.
         
         If it cannot read the image (either Image is not defined or the file 
         is not an image file), this method returns None.
         
+        The image is read as a single block of bytes (see a6files), and the
+        load time is reported in the log.  If preview is not None, a large 
+        JPEG is decoded at a reduced scale of about that size.
+        
         Parameter file: An absolute path to an image file
         Precondition: file is a string
+        
+        Parameter preview: The size needed, as (width, height)
+        Precondition: preview is None or a pair of ints > 0
         """
-        import a6image
-        from PIL import Image as CoreImage
+        import a6files
         
         try:
-            image = CoreImage.open(file)
-            image = image.convert("RGB")
-            buffer = list(image.getdata())
-            size  = image.size[0]*image.size[1]
-            width = image.size[0]
+            result, seconds = a6files.load_timed(file,preview)
+            Logger.info('Imager: Loaded %dx%d image in %.3f seconds' % 
+                        (result.getWidth(),result.getHeight(),seconds))
         except:
             traceback.print_exc()
             self.error('Could not load the image file')
-            buffer = None
-        
-        result = None
-        if not buffer is None:
-            try:
-                result = a6image.Image(buffer,width)
-            except:
-                traceback.print_exc()
-                result = None
+            result = None
         return result
     
     def check_save_png(self, path, filename):
@@ -291,23 +302,38 @@ class InterfacePanel(BoxLayout):
         Parameter filename: An absolute filename
         Precondition: filename is a string
         """
-        import os.path
-        import traceback
         self.dismiss_popup()
         
-        # prepare image for saving
-        from PIL import Image as CoreImage
-
-        # This worked (Unlike Kivy)!  But is slow.
+        # Save after the actions in the queue, and encode in the background
+        self.worker.submit(self,'export_png',filename)
+    
+    def export_png(self, filename):
+        """
+        Starts saving the current image in the background.
+        
+        This is called by the worker, so the image includes every action that
+        was queued before the save.
+        
+        Parameter filename: An absolute filename
+        Precondition: filename is a string
+        """
+        import a6files
         current = self.workspace.getCurrent()
-        try:
-            im = CoreImage.new('RGBA',(current.getWidth(),current.getHeight()))
-            im.putdata(tuple(current.getData()))
-            im.save(filename,'PNG')
-        except:
-            traceback.print_exc()
-            self.error('Cannot save image file ' + os.path.split(filename)[1])
-                # These fields are 'hooks' to connect to the imager.kv file
+        a6files.save_async([(current,filename)],callback=self.saved_png)
+    
+    @mainthread
+    def saved_png(self, failures):
+        """
+        Reports any errors from saving images in the background.
+        
+        Parameter failures: The files that could not be saved
+        Precondition: failures is a list of (file, exception) pairs
+        """
+        import os.path
+        for filename, error in failures:
+            traceback.print_exception(type(error),error,error.__traceback__)
+        if failures:
+            self.error('Cannot save image file ' + os.path.split(failures[0][0])[1])
     
     def place_image(self, path, filename):
         """
@@ -331,6 +357,9 @@ class InterfacePanel(BoxLayout):
             file = os.path.join(path,filename)
         
         import a6filter
+        self.worker.cancel()
+        self.worker.join()
+        self.preview = None
         self.picture = self.read_image(file)
         try:
             self.workspace = a6filter.Filter(self.picture)
@@ -471,29 +500,23 @@ class InterfacePanel(BoxLayout):
         """
         Undos the last edit to the image.
         
-        This method will undo the last edit to the image.
+        This method will undo the last edit to the image.  The undo waits in
+        the worker queue, so it undoes the most recent action even if that 
+        action has not finished yet.
         """
-        try:
-            self.workspace.undo()
-            self.workimage.update(self.workspace.getCurrent())
-            self.canvas.ask_update()
-        except:
-            traceback.print_exc()
-            self.error('An error occurred when trying to undo')
+        self.preview = None
+        self.do_async('undo')
         
     def clear(self):
         """
         Clears all edits to the image.
         
-        This method will remove all edits to the image.
+        This method will remove all edits to the image.  Any actions that are
+        still waiting are cancelled first.
         """
-        try:
-            self.workspace.clear()
-            self.workimage.update(self.workspace.getCurrent())
-            self.canvas.ask_update()
-        except:
-            traceback.print_exc()
-            self.error('An error occurred when trying to clear edits')
+        self.worker.cancel()
+        self.preview = None
+        self.do_async('clear')
     
     def load_text(self):
         """
@@ -517,57 +540,102 @@ class InterfacePanel(BoxLayout):
     
     def do_async(self,*action):
         """
-        Launchs the given action in an asynchronous thread
+        Queues the given action to be performed by the worker.
         
         The action parameters are an expanded list where the first element is 
-        a callable and any other elements are parameters to the callable.
+        the name of a workspace method and any other elements are parameters 
+        to that method.  The worker performs the actions one at a time, in 
+        order, so the buttons stay active while an action is running.
         
-        The thread progress is monitored by async_monitor.  When the thread 
-        is done, it will call async_complete in the main event thread.
+        The worker progress is monitored by async_monitor.  When an action is
+        done, the worker will call async_complete in the main event thread.
+        
+        For a large image, a preview of the action is shown first (see 
+        show_preview).
         
         Parameter(s) *action: An expanded list defining the action
-        Precondition: The first element of action is callable
+        Precondition: The first element of action is the name of a method
         """
-        import threading
-        self.menubar.disabled = True
+        self.show_preview(action)
+        self.worker.submit(self.workspace,*action)
         self.processing = True
-        self.async_thread = threading.Thread(target=self.async_work,args=action)
-        self.async_thread.start()
-
-    def async_work(self,*action):
-        """
-        Performs the given action asynchronously.
-        
-        The action parameters are an expanded list where the first element is 
-        a callable and any other elements are parameters to the callable.
-        
-        This is the function that is launched in a separate thread.  Even if 
-        the action fails, it is guaranteed to call async_complete for clean-up
+        if self.async_action is None:
+            self.async_action = Clock.schedule_interval(self.async_monitor,0.1)
+    
+    def show_preview(self, action):
+        """
+        Shows the result of action on a low-resolution proxy of the image.
+        
+        The first preview starts from the proxy of the current image, which
+        is only safe to make when the worker is idle.  While the worker is
+        busy, each new preview starts from the one on display, so the 
+        previews keep up with the buttons.  Otherwise there is no preview.
+        Small images never need one.
+        
+        Parameter action: The action to preview
+        Precondition: action is a tuple whose first element is the name of a 
+        workspace method
+        """
+        workspace = self.workspace
+        if workspace is None or not (action[0] in workspace.ACTIONS or 
+                                     action[0] in ('pipeline','transform')):
+            return
+        
+        if not self.preview is None:
+            proxy = self.preview
+        elif self.worker.isIdle():
+            proxy = workspace.getProxy(self.PROXY_PIXELS)
+            if proxy is workspace.getCurrent():
+                return
+        else:
+            return
         
-        Parameter(s) *action: An expanded list defining the action
-        Precondition: The first element of action is callable
-        """
         try:
-            self.workspace.increment()
-            getattr(self.workspace,action[0])(*action[1:])
+            self.preview = workspace.preview(proxy,*action)
+            self.workimage.setImage(self.preview)
         except:
             traceback.print_exc()
-            self.error('Action '+action[0]+' could not be completed')
-        self.async_complete()
+            self.preview = None
+    
+    def async_monitor(self,dt):
+        """
+        Shows the progress of the worker, and stops when it is idle.
+        
+        Parameter dt: The time since the last call (ignored)
+        Precondition: dt is a number
+        """
+        job = self.worker.getCurrent()
+        if self.worker.isIdle():
+            Clock.unschedule(self.async_action)
+            self.async_action = None
+            self.processing = False
+            self.progress.text = 'PROCESSING'
+        elif not job is None:
+            text = '%d%%' % int(100*job.getProgress())
+            if self.worker.getPending():
+                text += ' (+%d)' % self.worker.getPending()
+            self.progress.text = text
      
     @mainthread
-    def async_complete(self):
-        """
-        Cleans up an asynchronous thread after completion.
-        """
-        self.workimage.update(self.workspace.getCurrent())
-        self.async_thread.join()
-        Clock.unschedule(self.async_action)
-        self.async_thread = None
-        self.async_action = None
-        self.menubar.disabled = False
-        self.processing = False
-        #self.progress.canvas.ask_update()
+    def async_complete(self,job):
+        """
+        Shows the result of a job, after the worker has finished it.
+        
+        Parameter job: The finished job
+        Precondition: job is a finished a6worker.Job
+        """
+        if job.getState() == 'failed':
+            error = job.getError()
+            traceback.print_exception(type(error),error,error.__traceback__)
+            self.error('Action '+job.getAction()[0]+' could not be completed')
+        # Keep showing the preview until every action is done.  The worker 
+        # edits the image (and its dirty rectangles) in place, so it is only 
+        # safe to read it here when the worker is idle.  Nothing can start a 
+        # new job until this method returns, as jobs are submitted from this 
+        # thread.
+        if job.getTarget() is self.workspace and self.worker.isIdle():
+            self.preview = None
+            self.workimage.update(self.workspace.getCurrent())
         self.canvas.ask_update()
 
 
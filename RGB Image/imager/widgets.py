@@ -20,7 +20,6 @@ from kivy.metrics import sp
 
 from kivy.properties import *
 
-from array import array             # Byte buffers
 from io import StringIO             # Making complex strings
 import traceback
 
@@ -308,6 +307,18 @@ class ImagePanel(Widget):
     # The position offset of the current image
     imageoff  = ListProperty((0,0))
     
+    def __init__(self,**keywords):
+        """
+        Initializes a new image panel
+        
+        Parameter keyword: The Kivy keyword arguments
+        Precondition: keyword is a dictionary with string keys
+        """
+        super().__init__(**keywords)
+        # The texture upload buffers for images without a usable pixel buffer
+        self._blitter = bytearray()
+        self._regions = bytearray()
+    
     @classmethod
     def getResource(self,filename):
         """
@@ -326,13 +337,66 @@ class ImagePanel(Widget):
         return os.path.join(dir,filename)
     
     def blit(self,picture):
-        for pos in range(len(picture)):
-            pixel = picture[pos]
-            self._blitter[pos*3  ] = pixel[0]
-            self._blitter[pos*3+1] = pixel[1]
-            self._blitter[pos*3+2] = pixel[2]
+        """
+        Returns the pixels of picture as a byte buffer for the texture.
+        
+        A buffer-backed image is uploaded straight from its own buffer (see
+        getRawBuffer in class Image), with no copying at all.  Kivy does not
+        accept the read-only view from getView.  Otherwise the packed pixels
+        are copied into an upload buffer kept by this panel, which is only 
+        reallocated when the size changes.
+        
+        Parameter picture: The image to upload
+        Precondition: picture is an Image object
+        """
+        buffer = picture.getRawBuffer()
+        if not buffer is None:
+            return buffer
+        
+        if len(self._blitter) != len(picture)*3:
+            self._blitter = bytearray(len(picture)*3)
+        self._blitter[:] = picture.getView()
         return self._blitter
     
+    def region(self,picture,row,col,height,width):
+        """
+        Returns the pixels of a rectangle of picture as a byte buffer.
+        
+        If the rectangle is full width and the image has its own buffer (see
+        getRawBuffer in class Image), this is a slice of that buffer, with no
+        copying.  Otherwise the rows are copied into an upload buffer kept by
+        this panel, which only grows when a larger rectangle is needed.  Kivy
+        does not accept the read-only view from getView.
+        
+        Parameter picture: The image to upload
+        Precondition: picture is a buffer-backed Image object
+        
+        Parameter row: The top row of the rectangle
+        Precondition: row is an int >= 0 and < picture height
+        
+        Parameter col: The left column of the rectangle
+        Precondition: col is an int >= 0 and < picture width
+        
+        Parameter height: The number of rows in the rectangle
+        Precondition: height is an int > 0 and row+height <= picture height
+        
+        Parameter width: The number of columns in the rectangle
+        Precondition: width is an int > 0 and col+width <= picture width
+        """
+        size = 3*picture.getWidth()
+        buffer = picture.getRawBuffer()
+        if width == picture.getWidth() and not buffer is None:
+            return memoryview(buffer)[row*size:(row+height)*size]
+        
+        view = picture.getView()
+        line = 3*width
+        if len(self._regions) < line*height:
+            self._regions = bytearray(line*height)
+        for r in range(height):
+            pos = (row+r)*size+3*col
+            self._regions[r*line:(r+1)*line] = view[pos:pos+line]
+        return memoryview(self._regions)[:line*height]
+    
     def setImage(self,picture):
         """
         Returns True if the image panel successfully displayed picture
@@ -358,9 +422,9 @@ class ImagePanel(Widget):
             self.picture  = picture
             self.texture  = Texture.create(size=(picture.getWidth(), picture.getHeight()), 
                                            colorfmt='rgb', bufferfmt='ubyte')
-            self._blitter = array('B',[0]*len(picture)*3)
             self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
             self.texture.flip_vertical()
+            picture.clearDirty()
             
             if self.texture.width < self.texture.height:
                 self.imagesize[0] = int(self.inside[0]*(self.texture.width/self.texture.height))
@@ -382,17 +446,31 @@ class ImagePanel(Widget):
         """
         Returns True if the image panel successfully displayed picture
         
-        This method is slightly faster than setImage in the case where the 
-        picture is a (dimension-preserving) modification of the current one.  
-        Otherwise it calls setImage.
+        This method is faster than setImage in the case where the picture is a
+        (dimension-preserving) modification of the current one.  Otherwise it
+        calls setImage.
+        
+        If picture is the image already displayed and it is buffer-backed, 
+        only its dirty rectangles (see getDirty in class Image) are uploaded.
+        So a small edit takes time proportional to the edited area.  The 
+        dirty rectangles are read and then cleared, so nothing else may edit
+        picture during this call (e.g. only call it when the worker is idle).
         
         Parameter picture: The image to display
         Precondition: picture is an Image object or None
         """
         try:
             assert picture.getWidth() == self.texture.width
-            self.picture = picture
-            self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
+            assert picture.getHeight() == self.texture.height
+            if picture is self.picture and picture.isBuffered():
+                for rect in picture.getDirty():
+                    self.texture.blit_buffer(self.region(picture,*rect), 
+                                             pos=(rect[1],rect[0]), size=(rect[3],rect[2]),
+                                             colorfmt='rgb', bufferfmt='ubyte')
+            else:
+                self.picture = picture
+                self.texture.blit_buffer(self.blit(picture), colorfmt='rgb', bufferfmt='ubyte')
+            picture.clearDirty()
             return True
         except:
             pass